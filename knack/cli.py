@@ -5,6 +5,8 @@
 
 from __future__ import print_function
 import sys
+import copy
+import shlex
 from collections import defaultdict
 
 from .invocation import CommandInvoker
@@ -14,17 +16,50 @@ from .log import CLILogging, get_logger
 from .util import CLIError
 from .config import CLIConfig
 from .query import CLIQuery
-from .events import EVENT_CLI_PRE_EXECUTE, EVENT_CLI_POST_EXECUTE
+from .events import EVENT_CLI_PRE_EXECUTE, EVENT_CLI_POST_EXECUTE, EVENT_CLI_TIMINGS
 from .parser import CLICommandParser
 from .commands import CLICommandsLoader
 from .help import CLIHelp
+from .profiler import CLIProfiler
+from .timings import PHASE_OUTPUT
 
 logger = get_logger(__name__)
 
 
+class _Subsystem(object):  # pylint: disable=too-few-public-methods
+    """ A subsystem of the CLI that is created the first time it is used. It can also be set. """
+
+    def __init__(self, name, create):
+        self.attr = '_' + name
+        self.create = create
+
+    def __get__(self, cli_ctx, owner):
+        if cli_ctx is None:
+            return self
+        value = cli_ctx.__dict__.get(self.attr)
+        if value is None:
+            value = self.create(cli_ctx)
+            cli_ctx.__dict__[self.attr] = value
+        return value
+
+    def __set__(self, cli_ctx, value):
+        cli_ctx.__dict__[self.attr] = value
+
+
 class CLI(object):  # pylint: disable=too-many-instance-attributes
     """ The main driver for the CLI """
 
+    SCRIPT_FLAG = '--script'
+
+    # Data that's typically backed to persistent storage
+    config = _Subsystem('config', lambda cli_ctx: cli_ctx.config_cls(
+        config_dir=cli_ctx.config_dir, config_env_var_prefix=cli_ctx.config_env_var_prefix))
+    completion = _Subsystem('completion', lambda cli_ctx: cli_ctx.completion_cls(cli_ctx=cli_ctx))
+    logging = _Subsystem('logging', lambda cli_ctx: cli_ctx.logging_cls(cli_ctx.name, cli_ctx=cli_ctx))
+    profiler = _Subsystem('profiler', lambda cli_ctx: cli_ctx.profiler_cls(cli_ctx.name, cli_ctx=cli_ctx))
+    output = _Subsystem('output', lambda cli_ctx: cli_ctx.output_cls(cli_ctx=cli_ctx))
+    query = _Subsystem('query', lambda cli_ctx: cli_ctx.query_cls(cli_ctx=cli_ctx))
+
     def __init__(self,
                  cli_name='cli',
                  config_dir=None,
@@ -38,7 +73,8 @@ class CLI(object):  # pylint: disable=too-many-instance-attributes
                  query_cls=CLIQuery,
                  parser_cls=CLICommandParser,
                  commands_loader_cls=CLICommandsLoader,
-                 help_cls=CLIHelp):
+                 help_cls=CLIHelp,
+                 profiler_cls=CLIProfiler):
         """
         :param cli_name: The name of the CLI (e.g. the executable name 'az')
         :type cli_name: str
@@ -66,31 +102,46 @@ class CLI(object):  # pylint: disable=too-many-instance-attributes
         :type commands_loader_cls: knack.commands.CLICommandsLoader
         :param help_cls: Class to handle help
         :type help_cls: knack.help.CLIHelp
+        :param profiler_cls: Class to handle profiling of invocations
+        :type profiler_cls: knack.profiler.CLIProfiler
         """
         self.name = cli_name
         self.out_file = out_file
+        self.config_dir = config_dir
+        self.config_env_var_prefix = config_env_var_prefix
         self.config_cls = config_cls
         self.logging_cls = logging_cls
         self.output_cls = output_cls
+        self.completion_cls = completion_cls
+        self.query_cls = query_cls
+        self.profiler_cls = profiler_cls
         self.parser_cls = parser_cls
         self.help_cls = help_cls
         self.commands_loader_cls = commands_loader_cls
         self.invocation_cls = invocation_cls
         self.invocation = None
         self._event_handlers = defaultdict(lambda: [])
-        # Data that's typically backed to persistent storage
-        self.config = config_cls(config_dir=config_dir, config_env_var_prefix=config_env_var_prefix)
         # In memory collection of key-value data for this current cli. This persists between invocations.
         self.data = defaultdict(lambda: None)
-        self.completion = completion_cls(cli_ctx=self)
-        self.logging = logging_cls(self.name, cli_ctx=self)
-        self.output = self.output_cls(cli_ctx=self)
-        self.query = query_cls(cli_ctx=self)
+        # The subsystems are only created when they are used (e.g. showing the version doesn't need the output)
+        # so their event handlers are registered up front from the EVENT_HANDLERS they declare.
+        for subsystem_cls in (logging_cls, profiler_cls, output_cls, query_cls, invocation_cls):
+            self.register_event_handlers(subsystem_cls)
+        # A subclass may still register event handlers in its __init__, so a subsystem that isn't the default
+        # is created right away like before.
+        for name, default_cls in (('config', CLIConfig), ('completion', CLICompletion), ('logging', CLILogging),
+                                  ('profiler', CLIProfiler), ('output', OutputProducer), ('query', CLIQuery)):
+            if getattr(self, name + '_cls') is not default_cls:
+                getattr(self, name)
 
     @staticmethod
     def _should_show_version(args):
         return args and (args[0] == '--version' or args[0] == '-v')
 
+    @staticmethod
+    def _should_run_script(args):
+        return args and args[0] == CLI.SCRIPT_FLAG
+
     def get_cli_version(self):  # pylint: disable=no-self-use
         """ Get the CLI Version. Override this to define how to get the CLI version
 
@@ -131,6 +182,16 @@ class CLI(object):  # pylint: disable=too-many-instance-attributes
         """
         self._event_handlers[event_name].append(handler)
 
+    def register_event_handlers(self, subsystem_cls):
+        """ Register the event handlers that a class declares in EVENT_HANDLERS,
+            a list of (event name, name of a static method of the class).
+
+        :param subsystem_cls: The class (e.g. knack.output.OutputProducer)
+        :type subsystem_cls: type
+        """
+        for event_name, handler_name in getattr(subsystem_cls, 'EVENT_HANDLERS', []):
+            self.register_event(event_name, getattr(subsystem_cls, handler_name))
+
     def unregister_event(self, event_name, handler):
         """ Unregister a callable that will be called when event is raised.
 
@@ -161,6 +222,15 @@ class CLI(object):  # pylint: disable=too-many-instance-attributes
         logger.exception(ex)
         return 1
 
+    def _create_invocation(self, initial_invocation_data=None, batch=False):
+        invocation_kwargs = {'batch': True} if batch else {}
+        return self.invocation_cls(cli_ctx=self,
+                                   parser_cls=self.parser_cls,
+                                   commands_loader_cls=self.commands_loader_cls,
+                                   help_cls=self.help_cls,
+                                   initial_data=initial_invocation_data,
+                                   **invocation_kwargs)
+
     def invoke(self, args, initial_invocation_data=None, out_file=None):
         """ Invoke a command.
 
@@ -175,6 +245,83 @@ class CLI(object):  # pylint: disable=too-many-instance-attributes
         """
         if not isinstance(args, (list, tuple)):
             raise TypeError('args should be a list or tuple.')
+        with self.profiler.profile(args):
+            if CLI._should_run_script(args):
+                return self.invoke_script(args[1] if len(args) > 1 else '-', out_file=out_file)
+            return self._invoke(args, lambda: self._create_invocation(initial_invocation_data), out_file=out_file)
+
+    def invoke_batch(self, commands, initial_invocation_data=None, out_file=None):
+        """ Invoke many commands in this process.
+            The command table, parser and global parser are loaded once and reused for every command.
+            Each command still gets its own invocation data, exit code and output.
+
+        :param commands: The commands to invoke, each one a list of arguments
+        :type commands: iterable of list
+        :param initial_invocation_data: Prime the in memory collection of key-value data for each invocation.
+        :type initial_invocation_data: dict
+        :param out_file: The file to send output to. If not used, we use out_file for knack.cli.CLI instance
+        :type out_file: file-like object
+        :return: The exit code of each invocation
+        :rtype: list of int
+        """
+        batch_invocation = []
+
+        def _get_invocation():
+            initial_data = copy.copy(initial_invocation_data)
+            if not batch_invocation:
+                batch_invocation.append(self._create_invocation(initial_data, batch=True))
+            else:
+                batch_invocation[0].reset_data(initial_data)
+            return batch_invocation[0]
+
+        exit_codes = []
+        for args in commands:
+            try:
+                exit_code = self._invoke(list(args), _get_invocation, out_file=out_file)
+            except SystemExit as ex:
+                # argparse exits on errors and help, which should only end this command
+                exit_code = ex.code if isinstance(ex.code, int) else int(bool(ex.code))
+            exit_codes.append(exit_code)
+        return exit_codes
+
+    def invoke_script(self, script, out_file=None):
+        """ Invoke the commands in a script file, one command per line. See invoke_batch().
+            Blank lines and comments are skipped and a leading CLI name on a line is ignored.
+
+        :param script: The path to the script or '-' to read it from stdin
+        :type script: str
+        :param out_file: The file to send output to. If not used, we use out_file for knack.cli.CLI instance
+        :type out_file: file-like object
+        :return: The exit code of the first command that failed, otherwise 0
+        :rtype: int
+        """
+        try:
+            if script == '-':
+                lines = sys.stdin.readlines()
+            else:
+                with open(script, 'r') as f:
+                    lines = f.readlines()
+            commands = []
+            for line in lines:
+                args = shlex.split(line, comments=True)
+                if args and args[0] == self.name:
+                    args = args[1:]
+                if args:
+                    commands.append(args)
+        except (IOError, OSError, ValueError) as ex:
+            logger.error("Unable to read script '%s': %s", script, ex)
+            return 1
+        exit_codes = self.invoke_batch(commands, out_file=out_file)
+        return next((exit_code for exit_code in exit_codes if exit_code), 0)
+
+    def _report_timings(self):
+        timings = self.invocation.timings
+        timings.stop()
+        self.raise_event(EVENT_CLI_TIMINGS, timings=timings)
+        if self.invocation.data['debug_timings']:
+            sys.stderr.write(timings.format_report())
+
+    def _invoke(self, args, get_invocation, out_file=None):
         try:
             args = self.completion.get_completion_args() or args
             out_file = out_file or self.out_file
@@ -183,28 +330,29 @@ class CLI(object):  # pylint: disable=too-many-instance-attributes
             logger.debug('Command arguments: %s', args)
 
             self.raise_event(EVENT_CLI_PRE_EXECUTE)
+            cmd_result = None
             if CLI._should_show_version(args):
                 self.show_version()
             else:
-                self.invocation = self.invocation_cls(cli_ctx=self,
-                                                      parser_cls=self.parser_cls,
-                                                      commands_loader_cls=self.commands_loader_cls,
-                                                      help_cls=self.help_cls,
-                                                      initial_data=initial_invocation_data)
+                self.invocation = get_invocation()
                 cmd_result = self.invocation.execute(args)
                 output_type = self.invocation.data['output']
                 if cmd_result and cmd_result.result is not None:
                     formatter = self.output.get_formatter(output_type)
-                    self.output.out(cmd_result, formatter=formatter, out_file=out_file)
+                    with self.invocation.timings.phase(PHASE_OUTPUT):
+                        self.output.out(cmd_result, formatter=formatter, out_file=out_file)
+                self._report_timings()
             self.raise_event(EVENT_CLI_POST_EXECUTE)
-            exit_code = 0
+            exit_code = cmd_result.exit_code if cmd_result else 0
         except CLIError as ex:
             logger.error(ex)
             exit_code = 1
+            self.logging.dump_flight_recorder()
         except KeyboardInterrupt:
             exit_code = 1
         except Exception as ex:  # pylint: disable=broad-except
             exit_code = self.exception_handler(ex)
+            self.logging.dump_flight_recorder()
         finally:
             pass
         return exit_code
@@ -3,6 +3,7 @@
 # Licensed under the MIT License. See License.txt in the project root for license information.
 # --------------------------------------------------------------------------------------------
 
+import sys
 import types
 import copy
 from collections import OrderedDict, defaultdict
@@ -16,6 +17,7 @@ from .arguments import ArgumentRegistry, CLICommandArgument
 from .introspection import extract_args_from_signature, extract_full_summary_from_signature
 from .events import (EVENT_CMDLOADER_LOAD_COMMAND_TABLE, EVENT_CMDLOADER_LOAD_ARGUMENTS,
                      EVENT_COMMAND_CANCELLED)
+from .manifest import CommandManifest, get_module_file
 from .log import get_logger
 
 logger = get_logger(__name__)
@@ -37,8 +39,9 @@ class CLICommand(object):  # pylint:disable=too-many-instance-attributes
         :type handler: function
         :param description: The description for the command
         :type description: str
-        :param table_transformer: A function that transforms the command output for displaying in a table
-        :type table_transformer: function
+        :param table_transformer: A function or JMESPath expression that transforms the command output for
+                                  displaying in a table
+        :type table_transformer: function, str
         :param arguments_loader: The function that defines how the arguments for the command should be loaded
         :type arguments_loader: function
         :param description_loader: The function that defines how the description for the command should be loaded
@@ -123,7 +126,8 @@ class CLICommand(object):  # pylint:disable=too-many-instance-attributes
 
 class CLICommandsLoader(object):
 
-    def __init__(self, cli_ctx=None, command_cls=CLICommand, excluded_command_handler_args=None):
+    def __init__(self, cli_ctx=None, command_cls=CLICommand, excluded_command_handler_args=None,
+                 use_command_manifest=False):
         """ The loader of commands. It contains the command table and argument registries.
 
         :param cli_ctx: CLI Context
@@ -133,6 +137,9 @@ class CLICommandsLoader(object):
         :param excluded_command_handler_args: List of params to ignore and not extract from a commands handler.
                                               By default we ignore ['self', 'kwargs'].
         :type excluded_command_handler_args: list of str
+        :param use_command_manifest: Persist a manifest of the commands registered with CommandGroup so that
+                                     later invocations only create the commands that match the command line.
+        :type use_command_manifest: bool
         """
         from .cli import CLI
         if cli_ctx is not None and not isinstance(cli_ctx, CLI):
@@ -145,6 +152,7 @@ class CLICommandsLoader(object):
         # An argument registry stores all arguments for commands
         self.argument_registry = ArgumentRegistry()
         self.extra_argument_registry = defaultdict(lambda: {})
+        self.command_manifest = CommandManifest(cli_ctx=cli_ctx) if use_command_manifest else None
 
     def load_command_table(self, args):  # pylint: disable=unused-argument
         """ Load commands into the command table
@@ -154,6 +162,31 @@ class CLICommandsLoader(object):
         :return: The ordered command table
         :rtype: collections.OrderedDict
         """
+        self.register_commands()
+        if self.command_manifest is not None:
+            self.command_manifest.add_module(type(self).__module__)
+        return self._get_loaded_command_table()
+
+    def register_commands(self):
+        """ Register the commands into the command table (e.g. with CommandGroup).
+            Override this instead of load_command_table() to use the command manifest, which skips the
+            registrations when it is up to date. The registrations should not depend on the command line.
+        """
+        pass
+
+    def uses_command_manifest(self):
+        """ Whether the command manifest can stand in for load_command_table()
+
+        :rtype: bool
+        """
+        if self.command_manifest is None:
+            return False
+        # An overridden load_command_table may do more than register commands so it always has to run
+        load_command_table = type(self).load_command_table
+        return getattr(load_command_table, '__func__', load_command_table) is \
+            getattr(CLICommandsLoader.load_command_table, '__func__', CLICommandsLoader.load_command_table)
+
+    def _get_loaded_command_table(self):
         self.cli_ctx.raise_event(EVENT_CMDLOADER_LOAD_COMMAND_TABLE, cmd_tbl=self.command_table)
         return OrderedDict(self.command_table)
 
@@ -240,6 +273,24 @@ class CommandGroup(object):
         self.group_name = group_name
         self.operations_tmpl = operations_tmpl
         self.group_kwargs = kwargs
+        # The module of the handlers is recorded in the command manifest so that it is rebuilt when they change
+        self._module_name = operations_tmpl.split('#')[0]
+        command_manifest = getattr(command_loader, 'command_manifest', None)
+        self._module_file = None
+        if command_manifest is not None:
+            self._module_file = get_module_file(self._module_name)
+            CommandGroup._add_registering_modules(command_manifest)
+
+    @staticmethod
+    def _add_registering_modules(command_manifest):
+        # The modules that called into the registration, up to the commands loader, are recorded in the command
+        # manifest too, so that it's rebuilt when e.g. a helper module that registers commands changes.
+        frame = sys._getframe(1)  # pylint: disable=protected-access
+        while frame is not None and frame.f_code is not _LOAD_COMMAND_TABLE_CODE:
+            frame_globals = frame.f_globals
+            if frame_globals is not globals():
+                command_manifest.add_module(frame_globals.get('__name__'), frame_globals.get('__file__'))
+            frame = frame.f_back
 
     def __enter__(self):
         return self
@@ -261,7 +312,15 @@ class CommandGroup(object):
         command_name = '{} {}'.format(self.group_name, name) if self.group_name else name
         command_kwargs = copy.deepcopy(self.group_kwargs)
         command_kwargs.update(kwargs)
+        operation = self.operations_tmpl.format(handler_name)
+        command_manifest = getattr(self.command_loader, 'command_manifest', None)
+        if command_manifest is not None:
+            command_manifest.add(command_name, operation, command_kwargs, self._module_name, self._module_file)
+            CommandGroup._add_registering_modules(command_manifest)
         self.command_loader.command_table[command_name] = self.command_loader.create_command(
             command_name,
-            self.operations_tmpl.format(handler_name),
+            operation,
             **command_kwargs)
+
+
+_LOAD_COMMAND_TABLE_CODE = six.get_function_code(six.get_unbound_function(CLICommandsLoader.load_command_table))
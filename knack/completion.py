@@ -4,22 +4,20 @@
 # --------------------------------------------------------------------------------------------
 
 import os
-import argcomplete
 
 from .util import CtxTypeError
 
 ARGCOMPLETE_ENV_NAME = '_ARGCOMPLETE'
 
 
-class CaseInsensitiveChoicesCompleter(argcomplete.completers.ChoicesCompleter):
+class CaseInsensitiveChoicesCompleter(object):  # pylint: disable=too-few-public-methods
+    def __init__(self, choices):
+        self.choices = choices
+
     def __call__(self, prefix, **kwargs):
         return (c for c in self.choices if c.lower().startswith(prefix.lower()))
 
 
-# Override the choices completer with one that is case insensitive
-argcomplete.completers.ChoicesCompleter = CaseInsensitiveChoicesCompleter
-
-
 class CLICompletion(object):
 
     def __init__(self, cli_ctx=None):
@@ -43,6 +41,13 @@ class CLICompletion(object):
 
     def enable_autocomplete(self, parser):
         if self.cli_ctx.data['completer_active']:
+            # argcomplete is only imported when completing as it is slow to import
+            import argcomplete
+            if not issubclass(argcomplete.completers.ChoicesCompleter, CaseInsensitiveChoicesCompleter):
+                # Override the choices completer with one that is case insensitive
+                argcomplete.completers.ChoicesCompleter = type('CaseInsensitiveChoicesCompleter',
+                                                               (CaseInsensitiveChoicesCompleter,
+                                                                argcomplete.completers.ChoicesCompleter), {})
             argcomplete.autocomplete = argcomplete.CompletionFinder()
             argcomplete.autocomplete(parser, validator=lambda c, p: c.lower().startswith(p.lower()),
                                      default_completer=lambda _: ())
@@ -5,15 +5,63 @@
 import os
 import sys
 import stat
+import threading
+from contextlib import contextmanager
+from timeit import default_timer
 from six.moves import configparser
 
-from .util import ensure_dir
+from .util import atomic_write, file_lock
+from .log import get_logger
+
+logger = get_logger(__name__)
 
 _UNSET = object()
 
+_ConfigParserBase = configparser.ConfigParser if sys.version_info.major == 3 else configparser.SafeConfigParser
+
 
 def get_config_parser():
-    return configparser.ConfigParser() if sys.version_info.major == 3 else configparser.SafeConfigParser()
+    return _ConfigParserBase()
+
+
+class _VersionedConfigParser(_ConfigParserBase):  # pylint: disable=too-many-ancestors
+    """ A config parser that counts its changes so that the values read from it can be cached """
+
+    def __init__(self, *args, **kwargs):
+        self.version = 0
+        # The files read, in order, so that they can be read again when they change
+        self.read_filenames = []
+        _ConfigParserBase.__init__(self, *args, **kwargs)
+
+    def _changed(self):
+        self.version += 1
+
+    def set(self, section, option, value=None):
+        self._changed()
+        return _ConfigParserBase.set(self, section, option, value)
+
+    def add_section(self, section):
+        self._changed()
+        return _ConfigParserBase.add_section(self, section)
+
+    def remove_section(self, section):
+        self._changed()
+        return _ConfigParserBase.remove_section(self, section)
+
+    def remove_option(self, section, option):
+        self._changed()
+        return _ConfigParserBase.remove_option(self, section, option)
+
+    def read(self, filenames, *args, **kwargs):  # pylint: disable=arguments-differ
+        filenames = list(filenames) if isinstance(filenames, (list, tuple)) else [filenames]
+        self.read_filenames.extend(f for f in filenames if f not in self.read_filenames)
+        self._changed()
+        return _ConfigParserBase.read(self, filenames, *args, **kwargs)
+
+    def _read(self, *args, **kwargs):  # pylint: disable=arguments-differ
+        # read_file(), read_string() and readfp() all end up here
+        self._changed()
+        return _ConfigParserBase._read(self, *args, **kwargs)  # pylint: disable=protected-access
 
 
 class CLIConfig(object):
@@ -23,6 +71,9 @@ class CLIConfig(object):
     _DEFAULT_CONFIG_ENV_VAR_PREFIX = 'CLI'
     _DEFAULT_CONFIG_DIR = os.path.join('~', '.{}'.format('cli'))
     _CONFIG_FILE_NAME = 'config'
+    _LOCK_FILE_SUFFIX = '.lock'
+    # How often (in seconds) to check whether the config file was changed, e.g. by another process
+    FILE_CHECK_INTERVAL = 1.0
 
     def __init__(self, config_dir=None, config_env_var_prefix=None):
         """ Manages configuration options available in the CLI
@@ -34,58 +85,176 @@ class CLIConfig(object):
         """
         config_dir = config_dir or CLIConfig._DEFAULT_CONFIG_DIR
         config_env_var_prefix = config_env_var_prefix or CLIConfig._DEFAULT_CONFIG_ENV_VAR_PREFIX
-        self.config_parser = get_config_parser()
+        self.config_parser = _VersionedConfigParser()
         env_var_prefix = '{}_'.format(config_env_var_prefix.upper())
         default_config_dir = os.path.expanduser(config_dir)
         self.config_dir = os.environ.get('{}CONFIG_DIR'.format(env_var_prefix), default_config_dir)
         self.config_path = os.path.join(self.config_dir, CLIConfig._CONFIG_FILE_NAME)
+        # Writers of the config file take an advisory lock on this file, readers don't need to
+        # as the file is always replaced in a single rename.
+        self.lock_path = self.config_path + CLIConfig._LOCK_FILE_SUFFIX
+        # The open transaction of each thread (see transaction())
+        self._transaction_state = threading.local()
         self._env_var_format = env_var_prefix + '{section}_{option}'
+        # The values are resolved once and kept until the config parser or the config file changes.
+        # Environment variables are looked up by their name every time, which is a single dict lookup.
+        self._env_var_names = {}
+        self._file_values = {}
+        self._file_values_version = None
+        self._typed_values = {}
+        self._file_mtime = self._get_file_mtime()
+        self._next_file_check = default_timer() + CLIConfig.FILE_CHECK_INTERVAL
         self.config_parser.read(self.config_path)
 
     def env_var_name(self, section, option):
         return self._env_var_format.format(section=section.upper(),
                                            option=option.upper())
 
+    def _get_file_mtime(self):
+        try:
+            return os.stat(self.config_path).st_mtime
+        except OSError:
+            return None
+
+    def _check_file_values(self):
+        now = default_timer()
+        if now >= self._next_file_check:
+            self._next_file_check = now + CLIConfig.FILE_CHECK_INTERVAL
+            mtime = self._get_file_mtime()
+            if mtime != self._file_mtime:
+                self._file_mtime = mtime
+                # Read the same files again, including any that a subclass added to the config parser
+                config_parser = _VersionedConfigParser()
+                config_parser.read(getattr(self.config_parser, 'read_filenames', None) or [self.config_path])
+                self.config_parser = config_parser
+        version = (id(self.config_parser), getattr(self.config_parser, 'version', None))
+        if version != self._file_values_version or version[1] is None:
+            self._file_values = {}
+            self._file_values_version = version
+
+    def _get_value(self, section, option):
+        """ The value of the option from the environment or else the config file, or _UNSET """
+        key = (section, option)
+        env_var = self._env_var_names.get(key)
+        if env_var is None:
+            env_var = self._env_var_names[key] = self.env_var_name(section, option)
+        value = os.environ.get(env_var)
+        if value is not None:
+            return value
+        self._check_file_values()
+        try:
+            return self._file_values[key]
+        except KeyError:
+            try:
+                value = self.config_parser.get(section, option)
+            except (configparser.NoSectionError, configparser.NoOptionError):
+                value = _UNSET
+            self._file_values[key] = value
+            return value
+
     def has_option(self, section, option):
-        if self.env_var_name(section, option) in os.environ:
-            return True
-        return self.config_parser.has_option(section, option)
+        return self._get_value(section, option) is not _UNSET
 
     def get(self, section, option, fallback=_UNSET):
-        try:
-            env = self.env_var_name(section, option)
-            return os.environ[env] if env in os.environ else self.config_parser.get(section, option)
-        except (configparser.NoSectionError, configparser.NoOptionError):
+        value = self._get_value(section, option)
+        if value is _UNSET:
             if fallback is _UNSET:
-                raise
-            else:
-                return fallback
+                # Raises the error for the missing section or option
+                return self.config_parser.get(section, option)
+            return fallback
+        return value
+
+    def _get_typed(self, section, option, fallback, convert):
+        value = self._get_value(section, option)
+        if value is _UNSET:
+            return convert(self.get(section, option, fallback))
+        key = (section, option, convert)
+        cached = self._typed_values.get(key)
+        if cached is not None and cached[0] == value:
+            return cached[1]
+        typed_value = convert(value)
+        self._typed_values[key] = (value, typed_value)
+        return typed_value
+
+    @staticmethod
+    def _to_boolean(value):
+        val = str(value)
+        if val.lower() not in CLIConfig._BOOLEAN_STATES:
+            raise ValueError('Not a boolean: {}'.format(val))
+        return CLIConfig._BOOLEAN_STATES[val.lower()]
 
     def getint(self, section, option, fallback=_UNSET):
-        return int(self.get(section, option, fallback))
+        return self._get_typed(section, option, fallback, int)
 
     def getfloat(self, section, option, fallback=_UNSET):
-        return float(self.get(section, option, fallback))
+        return self._get_typed(section, option, fallback, float)
 
     def getboolean(self, section, option, fallback=_UNSET):
-        val = str(self.get(section, option, fallback))
-        if val.lower() not in CLIConfig._BOOLEAN_STATES:
-            raise ValueError('Not a boolean: {}'.format(val))
-        return CLIConfig._BOOLEAN_STATES[val.lower()]
+        return self._get_typed(section, option, fallback, CLIConfig._to_boolean)
 
-    def set(self, config):
-        ensure_dir(self.config_dir)
-        with open(self.config_path, 'w') as configfile:
+    def _write(self, config):
+        # The caller holds the lock
+        with atomic_write(self.config_path, stat.S_IRUSR | stat.S_IWUSR) as configfile:
             config.write(configfile)
-        os.chmod(self.config_path, stat.S_IRUSR | stat.S_IWUSR)
         self.config_parser.read(self.config_path)
+        self._file_mtime = self._get_file_mtime()
+
+    @contextmanager
+    def transaction(self):
+        """ Make many changes to the config file at once. The file is locked for the whole transaction,
+            so concurrent writers (e.g. other CLI processes) don't lose each other's updates, and the
+            changes are written in a single atomic replace of the file when the context exits.
+            If an exception is raised in the context, no changes are written.
+
+            with cli_ctx.config.transaction():
+                cli_ctx.config.set_value('core', 'output', 'table')
+                cli_ctx.config.set_value('logging', 'enable_log_file', 'yes')
+
+            Transactions can be nested, in which case the outermost one writes the changes.
+
+        :return: The config parser with the current content of the file that the changes are made to
+        :rtype: configparser.ConfigParser
+        """
+        state = self._transaction_state
+        if getattr(state, 'config', None) is not None:
+            yield state.config
+            return
+        with file_lock(self.lock_path) as waited:
+            locked = default_timer()
+            config = _VersionedConfigParser()
+            config.read(self.config_path)
+            state.config = config
+            state.base_version = config.version
+            try:
+                yield config
+                config = state.config
+                changes = None if state.base_version is None else config.version - state.base_version
+                if changes != 0:
+                    self._write(config)
+            finally:
+                state.config = None
+            held = default_timer() - locked
+        logger.debug("Config transaction: %s change(s) to '%s'. Waited %.1f ms for the lock and held it %.1f ms.",
+                     'unknown number of' if changes is None else changes, self.config_path,
+                     waited * 1000, held * 1000)
+
+    def set(self, config):
+        """ Replace the content of the config file
+
+        :param config: The new content of the config file
+        :type config: configparser.ConfigParser
+        """
+        state = self._transaction_state
+        if getattr(state, 'config', None) is not None:
+            # Written when the transaction ends
+            state.config = config
+            state.base_version = None
+            return
+        with self.transaction():
+            self.set(config)
 
     def set_value(self, section, option, value):
-        config = get_config_parser()
-        config.read(self.config_path)
-        try:
-            config.add_section(section)
-        except configparser.DuplicateSectionError:
-            pass
-        config.set(section, option, value)
-        self.set(config)
+        with self.transaction() as config:
+            if not config.has_section(section):
+                config.add_section(section)
+            config.set(section, option, value)
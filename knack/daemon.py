@@ -0,0 +1,217 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+import os
+import sys
+import json
+import socket
+import struct
+import array
+from contextlib import closing
+
+from .util import CtxTypeError
+from .log import get_logger
+
+logger = get_logger(__name__)
+
+_HEADER = struct.Struct('!I')
+_STDIO_FDS = (0, 1, 2)
+
+
+def is_daemon_supported():
+    """ The daemon passes the stdio of the client over a Unix domain socket """
+    return hasattr(socket, 'AF_UNIX') and hasattr(socket.socket, 'sendmsg')
+
+
+def _send_message(sock, message, fds=None):
+    data = json.dumps(message).encode('utf-8')
+    data = _HEADER.pack(len(data)) + data
+    ancillary = [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', fds))] if fds else []
+    sent = sock.sendmsg([data], ancillary)
+    if sent < len(data):
+        sock.sendall(data[sent:])
+
+
+def _recv_exact(sock, size, fds):
+    data = b''
+    while len(data) < size:
+        chunk, ancillary, _, _ = sock.recvmsg(size - len(data), socket.CMSG_LEN(len(_STDIO_FDS) * 4))
+        if not chunk:
+            raise EOFError('Connection closed.')
+        for level, kind, fd_data in ancillary:
+            if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+                received = array.array('i')
+                received.frombytes(fd_data[:len(fd_data) - (len(fd_data) % received.itemsize)])
+                fds.extend(received)
+        data += chunk
+    return data
+
+
+def _recv_message(sock):
+    fds = []
+    size = _HEADER.unpack(_recv_exact(sock, _HEADER.size, fds))[0]
+    message = json.loads(_recv_exact(sock, size, fds).decode('utf-8'))
+    return message, fds
+
+
+def invoke_with_daemon(socket_path, args, fallback):
+    """ Forward an invocation to a running daemon.
+        This function only uses the standard library so that a thin client entry point stays fast to start.
+
+        Example:
+            def _invoke_in_process(args):
+                from mycli.main import mycli
+                return mycli.invoke(args)
+
+            sys.exit(invoke_with_daemon(socket_path, sys.argv[1:], _invoke_in_process))
+
+    :param socket_path: The path of the Unix domain socket the daemon listens on
+    :type socket_path: str
+    :param args: The arguments that represent the command
+    :type args: list
+    :param fallback: Called with args to invoke in-process when no daemon is available
+    :type fallback: function
+    :return: The exit code of the invocation
+    :rtype: int
+    """
+    if not is_daemon_supported():
+        return fallback(args)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    with closing(sock):
+        try:
+            sock.connect(socket_path)
+        except (socket.error, OSError):
+            return fallback(args)
+        request = {'args': list(args), 'env': dict(os.environ), 'cwd': os.getcwd()}
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            _send_message(sock, request, fds=_STDIO_FDS)
+            response, _ = _recv_message(sock)
+        except (socket.error, OSError, EOFError, ValueError) as ex:
+            # The command may have already run so it is not safe to fall back to in-process execution.
+            sys.stderr.write('The daemon failed to complete the command: {}\n'.format(ex))
+            return 1
+    return response['exit_code']
+
+
+class CLIDaemon(object):
+
+    _SOCKET_FILE_NAME = 'daemon.sock'
+
+    def __init__(self, cli_ctx=None, socket_path=None):
+        """ Serves invocations from a warm process over a Unix domain socket.
+            Requests are handled one at a time as each one takes over the stdio, environment and
+            working directory of the process.
+
+        :param cli_ctx: CLI Context
+        :type cli_ctx: knack.cli.CLI
+        :param socket_path: The path of the Unix domain socket to listen on. Defaults to a file in the config dir.
+        :type socket_path: str
+        """
+        from .cli import CLI
+        if cli_ctx is not None and not isinstance(cli_ctx, CLI):
+            raise CtxTypeError(cli_ctx)
+        self.cli_ctx = cli_ctx
+        self.socket_path = socket_path or os.path.join(cli_ctx.config.config_dir, CLIDaemon._SOCKET_FILE_NAME)
+        self._server = None
+
+    def _bind(self):
+        if not is_daemon_supported():
+            raise OSError('The daemon requires Unix domain sockets with file descriptor passing.')
+        socket_dir = os.path.dirname(self.socket_path)
+        if socket_dir and not os.path.isdir(socket_dir):
+            os.makedirs(socket_dir)
+        try:
+            os.unlink(self.socket_path)
+        except OSError:
+            pass
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o177)
+        try:
+            server.bind(self.socket_path)
+        finally:
+            os.umask(old_umask)
+        server.listen(5)
+        return server
+
+    def serve_forever(self):
+        """ Accept and run invocations until interrupted. """
+        self._server = self._bind()
+        logger.debug("Daemon listening on '%s'.", self.socket_path)
+        try:
+            while self._server:
+                conn, _ = self._server.accept()
+                with closing(conn):
+                    self.handle_connection(conn)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        if self._server:
+            self._server.close()
+            self._server = None
+            try:
+                os.unlink(self.socket_path)
+            except OSError:
+                pass
+
+    def handle_connection(self, conn):
+        try:
+            request, fds = _recv_message(conn)
+        except (socket.error, OSError, EOFError, ValueError) as ex:
+            logger.debug('Invalid daemon request: %s', ex)
+            return
+        try:
+            if len(fds) != len(_STDIO_FDS):
+                logger.debug('Daemon request did not include stdio.')
+                return
+            exit_code = self._invoke(request, fds)
+        finally:
+            for fd in fds:
+                os.close(fd)
+        try:
+            _send_message(conn, {'exit_code': exit_code})
+        except (socket.error, OSError) as ex:
+            logger.debug('Unable to send daemon response: %s', ex)
+
+    @staticmethod
+    def _flush_stdio(*streams):
+        for stream in streams:
+            try:
+                stream.flush()
+            except (IOError, OSError, ValueError):
+                pass
+
+    def _invoke(self, request, fds):
+        saved_fds = [os.dup(fd) for fd in _STDIO_FDS]
+        saved_stdio = (sys.stdin, sys.stdout, sys.stderr)
+        saved_env = dict(os.environ)
+        saved_cwd = os.getcwd()
+        CLIDaemon._flush_stdio(*saved_stdio)
+        try:
+            for target_fd, fd in zip(_STDIO_FDS, fds):
+                os.dup2(fd, target_fd)
+            # Fresh stdio objects so that nothing buffered from a previous client leaks into this one
+            sys.stdin = os.fdopen(0, 'r', closefd=False)
+            sys.stdout = os.fdopen(1, 'w', closefd=False)
+            sys.stderr = os.fdopen(2, 'w', closefd=False)
+            os.environ.clear()
+            os.environ.update(request['env'])
+            os.chdir(request['cwd'])
+            return self.cli_ctx.invoke(request['args'], out_file=sys.stdout)
+        except Exception as ex:  # pylint: disable=broad-except
+            return self.cli_ctx.exception_handler(ex)
+        finally:
+            CLIDaemon._flush_stdio(sys.stdout, sys.stderr, *saved_stdio)
+            sys.stdin, sys.stdout, sys.stderr = saved_stdio
+            for target_fd, fd in zip(_STDIO_FDS, saved_fds):
+                os.dup2(fd, target_fd)
+                os.close(fd)
+            os.environ.clear()
+            os.environ.update(saved_env)
+            os.chdir(saved_cwd)
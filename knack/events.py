@@ -5,6 +5,7 @@
 
 EVENT_CLI_PRE_EXECUTE = 'Cli.PreExecute'
 EVENT_CLI_POST_EXECUTE = 'Cli.PostExecute'
+EVENT_CLI_TIMINGS = 'Cli.OnTimings'
 
 EVENT_INVOKER_PRE_CMD_TBL_CREATE = 'CommandInvoker.OnPreCommandTableCreate'
 EVENT_INVOKER_POST_CMD_TBL_CREATE = 'CommandInvoker.OnPostCommandTableCreate'
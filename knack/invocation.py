@@ -4,27 +4,56 @@
 # --------------------------------------------------------------------------------------------
 
 import sys
+import copy
+import json
+from collections import defaultdict, deque
 
-from collections import defaultdict
-
-from .util import CLIError, CtxTypeError, CommandResultItem, todict
+from .util import CLIError, CtxTypeError, CommandResultItem, is_stream, todict, todict_view
 from .parser import CLICommandParser
 from .commands import CLICommandsLoader
 from .events import (EVENT_INVOKER_PRE_CMD_TBL_CREATE, EVENT_INVOKER_POST_CMD_TBL_CREATE,
                      EVENT_INVOKER_CMD_TBL_LOADED, EVENT_INVOKER_PRE_PARSE_ARGS,
                      EVENT_INVOKER_POST_PARSE_ARGS, EVENT_INVOKER_TRANSFORM_RESULT,
-                     EVENT_INVOKER_FILTER_RESULT)
+                     EVENT_INVOKER_FILTER_RESULT, EVENT_PARSER_GLOBAL_CREATE)
 from .help import CLIHelp
+from .query import CLIQuery
+from .log import get_logger
+from .timings import (InvocationTimings, PHASE_LOAD_COMMAND_TABLE, PHASE_LOAD_ARGUMENTS, PHASE_PARSER_LOAD,
+                      PHASE_PARSE_ARGS, PHASE_VALIDATION, PHASE_HANDLER, PHASE_TODICT, PHASE_TRANSFORM,
+                      PHASE_FILTER)
+
+logger = get_logger(__name__)
 
 
 class CommandInvoker(object):
 
+    FOR_EACH_FLAG = '--for-each'
+    FOR_EACH_ORDERS = ['input', 'completion']
+
+    # Registered by the CLI when it is created (see knack.cli.CLI.register_event_handlers)
+    EVENT_HANDLERS = [(EVENT_PARSER_GLOBAL_CREATE, 'on_global_arguments')]
+
+    @staticmethod
+    def on_global_arguments(cli_ctx, **kwargs):
+        arg_group = kwargs.get('arg_group')
+        arg_group.add_argument(CommandInvoker.FOR_EACH_FLAG, dest='_for_each_order', nargs='?', const='input',
+                               choices=CommandInvoker.FOR_EACH_ORDERS,
+                               help='Run the command for each JSON Lines record read from stdin. The fields of '
+                                    'a record are bound to the arguments of the command. Write the results in '
+                                    'input order (default) or as they complete.')
+        arg_group.add_argument('--for-each-workers', dest='_for_each_workers', type=int, metavar='N',
+                               default=cli_ctx.config.getint('core', 'for_each_workers', fallback=4),
+                               help='The number of records to run concurrently with --for-each.')
+        arg_group.add_argument('--debug-timings', dest='_debug_timings', action='store_true',
+                               help='Show the time spent in each phase of the invocation on stderr.')
+
     def __init__(self,
                  cli_ctx=None,
                  parser_cls=CLICommandParser,
                  commands_loader_cls=CLICommandsLoader,
                  help_cls=CLIHelp,
-                 initial_data=None):
+                 initial_data=None,
+                 batch=False):
         """ Manages a single invocation of the CLI (i.e. running a command)
 
         :param cli_ctx: CLI Context
@@ -37,19 +66,72 @@ class CommandInvoker(object):
         :type help_cls: knack.help.CLIHelp
         :param initial_data: The initial in-memory collection for this command invocation
         :type initial_data: dict
+        :param batch: Run many commands with this invoker. The full command table and the parsers
+                      are loaded once and reused (see reset_data()).
+        :type batch: bool
         """
         from .cli import CLI
         if cli_ctx is not None and not isinstance(cli_ctx, CLI):
             raise CtxTypeError(cli_ctx)
         self.cli_ctx = cli_ctx
+        self.batch = batch
+        self.data = None
+        self.timings = None
+        self.reset_data(initial_data)
+        self.parser_cls = parser_cls
+        self.help_cls = help_cls
+        self.commands_loader_cls = commands_loader_cls
+        # The parsers, help and commands loader are created the first time they are used
+        self._parser = None
+        self._help = None
+        self._commands_loader = None
+        self._cmd_tbl = None
+        self._commands_with_arguments = set()
+
+    @property
+    def help(self):
+        if self._help is None:
+            self._help = self.help_cls(cli_ctx=self.cli_ctx)
+        return self._help
+
+    @help.setter
+    def help(self, value):
+        self._help = value
+
+    @property
+    def parser(self):
+        if self._parser is None:
+            global_parser = self.parser_cls.create_global_parser(cli_ctx=self.cli_ctx)
+            # A batch only creates the parsers for the commands that are run
+            parser_kwargs = {'lazy_subparsers': True} if self.batch else {}
+            self._parser = self.parser_cls(cli_ctx=self.cli_ctx, cli_help=self.help,
+                                           prog=self.cli_ctx.name, parents=[global_parser], **parser_kwargs)
+        return self._parser
+
+    @parser.setter
+    def parser(self, value):
+        self._parser = value
+
+    @property
+    def commands_loader(self):
+        if self._commands_loader is None:
+            self._commands_loader = self.commands_loader_cls(cli_ctx=self.cli_ctx)
+        return self._commands_loader
+
+    @commands_loader.setter
+    def commands_loader(self, value):
+        self._commands_loader = value
+
+    def reset_data(self, initial_data=None):
+        """ Start the in-memory collection of key-value data for the next command
+
+        :param initial_data: The initial in-memory collection for the command invocation
+        :type initial_data: dict
+        """
         # In memory collection of key-value data for this current invocation This does not persist between invocations.
         self.data = initial_data or defaultdict(lambda: None)
         self.data['command'] = 'unknown'
-        self._global_parser = parser_cls.create_global_parser(cli_ctx=self.cli_ctx)
-        self.help = help_cls(cli_ctx=self.cli_ctx)
-        self.parser = parser_cls(cli_ctx=self.cli_ctx, cli_help=self.help,
-                                 prog=self.cli_ctx.name, parents=[self._global_parser])
-        self.commands_loader = commands_loader_cls(cli_ctx=self.cli_ctx)
+        self.timings = InvocationTimings()
 
     def _filter_params(self, args):  # pylint: disable=no-self-use
         # Consider - we are using any args that start with an underscore (_) as 'private'
@@ -74,6 +156,45 @@ class CommandInvoker(object):
             nouns.append(args[i])
         return ' '.join(nouns)
 
+    def _matches_command_table(self, command):
+        """ Whether the command, or a group or command it starts with, is in the command table of the batch """
+        if not command:
+            return True
+        return any(name == command or command.startswith(name + ' ') or name.startswith(command + ' ')
+                   for name in self._cmd_tbl)
+
+    def _reset_command_table(self):
+        self._cmd_tbl = None
+        self._parser = None
+        self._commands_loader = None
+        self._commands_with_arguments = set()
+
+    def _load_command_table(self, args, command):
+        """ Load the command table, only creating the commands that match the command
+            if the commands loader has an up-to-date command manifest.
+        """
+        uses_manifest = getattr(self.commands_loader, 'uses_command_manifest', lambda: False)()
+        # A batch runs many different commands so it always needs the full command table
+        with self.timings.phase(PHASE_LOAD_COMMAND_TABLE):
+            materialized = uses_manifest and not self.batch and \
+                self.commands_loader.command_manifest.materialize(self.commands_loader, command)
+        if materialized:
+            # The commands have been created from the manifest so we skip the registrations
+            # and only raise the event of load_command_table.
+            return self.commands_loader._get_loaded_command_table()  # pylint: disable=protected-access
+        with self.timings.phase(PHASE_LOAD_COMMAND_TABLE):
+            cmd_tbl = self.commands_loader.load_command_table(args)
+        if uses_manifest:
+            self.commands_loader.command_manifest.save(cmd_tbl)
+        return cmd_tbl
+
+    def _load_arguments(self, command):
+        if command not in self._commands_with_arguments:
+            with self.timings.phase(PHASE_LOAD_ARGUMENTS):
+                self.commands_loader.load_arguments(command)
+            if self.batch:
+                self._commands_with_arguments.add(command)
+
     def _validate_cmd_level(self, ns, cmd_validator):  # pylint: disable=no-self-use
         if cmd_validator:
             cmd_validator(ns)
@@ -112,12 +233,26 @@ class CommandInvoker(object):
         :rtype: knack.util.CommandResultItem
         """
         self.cli_ctx.raise_event(EVENT_INVOKER_PRE_CMD_TBL_CREATE, args=args)
-        cmd_tbl = self.commands_loader.load_command_table(args)
         command = self._rudimentary_get_command(args)
-        self.commands_loader.load_arguments(command)
-        self.cli_ctx.raise_event(EVENT_INVOKER_POST_CMD_TBL_CREATE, cmd_tbl=cmd_tbl)
-        self.parser.load_command_table(cmd_tbl)
-        self.cli_ctx.raise_event(EVENT_INVOKER_CMD_TBL_LOADED, parser=self.parser)
+        if self._cmd_tbl is not None and not self._matches_command_table(command):
+            # The commands loader may only have loaded the commands for the arguments of an earlier command
+            self._reset_command_table()
+        if self._cmd_tbl is None:
+            cmd_tbl = self._load_command_table(args, command)
+            self._load_arguments(command)
+            self.cli_ctx.raise_event(EVENT_INVOKER_POST_CMD_TBL_CREATE, cmd_tbl=cmd_tbl)
+            with self.timings.phase(PHASE_PARSER_LOAD):
+                self.parser.load_command_table(cmd_tbl)
+            self.cli_ctx.raise_event(EVENT_INVOKER_CMD_TBL_LOADED, parser=self.parser)
+            if self.batch:
+                self._cmd_tbl = cmd_tbl
+        else:
+            cmd_tbl = self._cmd_tbl
+            if command in cmd_tbl and command not in self._commands_with_arguments:
+                self._load_arguments(command)
+                # Make sure the parser for the command is created with the arguments that were just loaded
+                with self.timings.phase(PHASE_PARSER_LOAD):
+                    self.parser.load_command_table({command: cmd_tbl[command]})
         if not args:
             self.cli_ctx.completion.enable_autocomplete(self.parser)
             subparser = self.parser.subparsers[tuple()]
@@ -130,22 +265,225 @@ class CommandInvoker(object):
         self.cli_ctx.completion.enable_autocomplete(self.parser)
 
         self.cli_ctx.raise_event(EVENT_INVOKER_PRE_PARSE_ARGS, args=args)
-        parsed_args = self.parser.parse_args(args)
+        if CommandInvoker._may_run_for_each(args):
+            result = self._execute_for_each(args, command, cmd_tbl)
+            if result is not None:
+                return result
+        with self.timings.phase(PHASE_PARSE_ARGS):
+            parsed_args = self.parser.parse_args(args)
+        self.data['debug_timings'] = getattr(parsed_args, '_debug_timings', False)
         self.cli_ctx.raise_event(EVENT_INVOKER_POST_PARSE_ARGS, command=parsed_args.command, args=parsed_args)
 
-        self._validation(parsed_args)
+        with self.timings.phase(PHASE_VALIDATION):
+            self._validation(parsed_args)
 
         self.data['command'] = parsed_args.command
 
         params = self._filter_params(parsed_args)
 
-        cmd_result = parsed_args.func(params)
-        cmd_result = todict(cmd_result)
+        with self.timings.phase(PHASE_HANDLER):
+            cmd_result = parsed_args.func(params)
+        cmd_result = self._process_result(cmd_result)
+
+        return CommandResultItem(cmd_result,
+                                 table_transformer=cmd_tbl[parsed_args.command].table_transformer,
+                                 is_query_active=self.data['query_active'],
+                                 max_rows=self.data['max_rows'])
+
+    def _process_result(self, cmd_result, stream=True):
+        # A query usually reads a small part of the result so the result is only converted as it is read.
+        # Transform and other filter handlers can do anything with the result so they always get it converted.
+        event_handlers = self.cli_ctx._event_handlers  # pylint: disable=protected-access
+        lazy = self.data['query_active'] and not event_handlers.get(EVENT_INVOKER_TRANSFORM_RESULT) and \
+            all(handler is CLIQuery.filter_output for handler in event_handlers.get(EVENT_INVOKER_FILTER_RESULT, []))
+        if is_stream(cmd_result):
+            if stream:
+                # The items are converted as the output is written so the full result is never held in memory.
+                # Most queries also run on one item at a time (see knack.query.CLIQuery.filter_output).
+                convert = todict_view if lazy else todict
+                cmd_result = (convert(item) for item in cmd_result)
+            else:
+                cmd_result = list(cmd_result)
+        if not is_stream(cmd_result):
+            with self.timings.phase(PHASE_TODICT):
+                cmd_result = todict_view(cmd_result) if lazy else todict(cmd_result)
 
         event_data = {'result': cmd_result}
-        self.cli_ctx.raise_event(EVENT_INVOKER_TRANSFORM_RESULT, event_data=event_data)
-        self.cli_ctx.raise_event(EVENT_INVOKER_FILTER_RESULT, event_data=event_data)
+        with self.timings.phase(PHASE_TRANSFORM):
+            self.cli_ctx.raise_event(EVENT_INVOKER_TRANSFORM_RESULT, event_data=event_data)
+        with self.timings.phase(PHASE_FILTER):
+            self.cli_ctx.raise_event(EVENT_INVOKER_FILTER_RESULT, event_data=event_data)
+        if lazy:
+            result = event_data['result']
+            if is_stream(result):
+                event_data['result'] = (todict(item) for item in result)
+            else:
+                with self.timings.phase(PHASE_TODICT):
+                    event_data['result'] = todict(result)
+        return event_data['result']
 
-        return CommandResultItem(event_data['result'],
-                                 table_transformer=cmd_tbl[parsed_args.command].table_transformer,
-                                 is_query_active=self.data['query_active'])
+    def _get_command_parser(self, command):
+        path = command.split()
+        parser = self.parser
+        for length in range(len(path)):
+            parser = self.parser.subparsers[tuple(path[:length])].choices[path[length]]
+        return parser
+
+    @staticmethod
+    def _may_run_for_each(args):
+        """ Whether an argument can be the --for-each flag, also written as --for-each=ORDER or abbreviated """
+        for arg in args:
+            option = arg.split('=', 1)[0]
+            if len(option) > 2 and option.startswith('--') and CommandInvoker.FOR_EACH_FLAG.startswith(option):
+                return True
+        return False
+
+    def _execute_for_each(self, args, command, cmd_tbl):
+        """ Parse the command once and then run its handler for each record read from stdin.
+            Returns None if the arguments don't have the --for-each flag after all.
+        """
+        words = command.split()
+        while words and ' '.join(words) not in cmd_tbl:
+            words.pop()
+        if not words:
+            return None
+        command_name = ' '.join(words)
+        # Required arguments can be provided by the records so they are checked for each record instead.
+        # The command line is parsed by a parser of its own that doesn't require them.
+        global_parser = self.parser_cls.create_global_parser(cli_ctx=self.cli_ctx)
+        relaxed_parser = self.parser_cls(cli_ctx=self.cli_ctx, cli_help=self.help, prog=self.cli_ctx.name,
+                                         parents=[global_parser], lazy_subparsers=True, require_arguments=False)
+        relaxed_parser.load_command_table({command_name: cmd_tbl[command_name]})
+        with self.timings.phase(PHASE_PARSE_ARGS):
+            parsed_args = relaxed_parser.parse_args(args)
+        if getattr(parsed_args, '_for_each_order', None) is None:
+            # The command is parsed again as usual so that missing required arguments are reported
+            return None
+        self.data['debug_timings'] = getattr(parsed_args, '_debug_timings', False)
+        self.cli_ctx.raise_event(EVENT_INVOKER_POST_PARSE_ARGS, command=parsed_args.command, args=parsed_args)
+        self.data['command'] = parsed_args.command
+        order = parsed_args._for_each_order  # pylint: disable=protected-access
+        workers = max(parsed_args._for_each_workers, 1)  # pylint: disable=protected-access
+
+        # Records can use the name of the parameter or of any of its options
+        option_dests = {}
+        for action in parsed_args._parser._actions:  # pylint: disable=protected-access
+            for option in action.option_strings:
+                option_dests[option.lstrip('-').replace('-', '_')] = action.dest
+        required = [a for a in self._get_command_parser(command_name)._actions  # pylint: disable=protected-access
+                    if a.required and a.dest in option_dests.values()]
+
+        def _prepare_record(record_args):
+            ns = copy.copy(parsed_args)
+            for key, value in record_args.items():
+                key = key.lstrip('-').replace('-', '_')
+                if key not in option_dests:
+                    raise CLIError("unrecognized field '{}'".format(key))
+                setattr(ns, option_dests[key], value)
+            missing = ['/'.join(a.option_strings) for a in required if getattr(ns, a.dest, None) is None]
+            if missing:
+                raise CLIError('the following arguments are required: {}'.format(', '.join(missing)))
+            with self.timings.phase(PHASE_VALIDATION):
+                self._validation(ns)
+            params = self._filter_params(ns)
+
+            def _call_handler():
+                with self.timings.phase(PHASE_HANDLER):
+                    return parsed_args.func(params)
+            return _call_handler
+
+        result_item = CommandResultItem(None, is_query_active=self.data['query_active'], max_rows=self.data['max_rows'])
+
+        def _results():
+            # The results are streamed to the output so the exit codes are only known once it has been written
+            exit_codes = {}
+            try:
+                for index, exit_code, result in self._iter_for_each(_prepare_record, workers, order == 'input'):
+                    exit_codes[index] = exit_code
+                    if exit_code == 0:
+                        yield result
+            finally:
+                self.data['for_each_exit_codes'] = [exit_codes[index] for index in sorted(exit_codes)]
+                result_item.exit_code = next((code for code in self.data['for_each_exit_codes'] if code), 0)
+
+        result_item.result = _results()
+        return result_item
+
+    @staticmethod
+    def _read_records():
+        for line in sys.stdin:
+            line = line.strip()
+            if line:
+                yield line
+
+    @staticmethod
+    def _parse_record(line):
+        try:
+            record = json.loads(line)
+        except ValueError as ex:
+            raise CLIError('invalid JSON: {}'.format(ex))
+        if not isinstance(record, dict):
+            raise CLIError('expected a JSON object')
+        return record
+
+    def _run_for_each_step(self, index, step, *args):
+        """ Run a step of a record and return (index, exit_code, what the step returned) """
+        try:
+            return index, 0, step(*args)
+        except CLIError as ex:
+            logger.error('Record %d: %s', index, ex)
+            return index, 1, None
+        except SystemExit as ex:
+            # argparse validation errors have already been written to stderr
+            return index, ex.code or 1, None
+        except Exception as ex:  # pylint: disable=broad-except
+            logger.error('Record %d failed.', index)
+            return index, self.cli_ctx.exception_handler(ex), None
+
+    def _prepare_for_each_record(self, prepare_record, index, line):
+        return self._run_for_each_step(index, lambda: prepare_record(CommandInvoker._parse_record(line)))
+
+    def _finish_for_each_record(self, index, call_handler):
+        return self._run_for_each_step(index, lambda: self._process_result(call_handler(), stream=False))
+
+    def _iter_for_each(self, prepare_record, workers, ordered):
+        """ Run the records and yield (index, exit_code, result) in input or completion order.
+            Only the handlers run on a thread pool. The records are bound to the arguments and validated, and
+            the result events are raised, on this thread, so they share the invocation data as without --for-each.
+            Only a bounded number of records are in flight at a time.
+        """
+        records = enumerate(CommandInvoker._read_records())
+        try:
+            from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+        except ImportError:
+            logger.debug('concurrent.futures is not available. Running records sequentially.')
+            for index, line in records:
+                index, exit_code, call_handler = self._prepare_for_each_record(prepare_record, index, line)
+                yield (index, exit_code, None) if exit_code else self._finish_for_each_record(index, call_handler)
+            return
+        max_in_flight = workers * 2
+        # The index of each record, its exit code so far and the future of its handler (None if it already failed)
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for index, line in records:
+                index, exit_code, call_handler = self._prepare_for_each_record(prepare_record, index, line)
+                pending.append((index, exit_code, None if exit_code else executor.submit(call_handler)))
+                while len(pending) >= max_in_flight:
+                    for item in self._next_completed(pending, ordered, wait, FIRST_COMPLETED):
+                        yield item
+            while pending:
+                for item in self._next_completed(pending, ordered, wait, FIRST_COMPLETED):
+                    yield item
+
+    def _next_completed(self, pending, ordered, wait, first_completed):
+        if ordered:
+            done = [pending.popleft()]
+        else:
+            done = [item for item in pending if item[2] is None or item[2].done()]
+            if not done:
+                wait([item[2] for item in pending], return_when=first_completed)
+                done = [item for item in pending if item[2].done()]
+            for item in done:
+                pending.remove(item)
+        return [(index, exit_code, None) if future is None else self._finish_for_each_record(index, future.result)
+                for index, exit_code, future in done]
@@ -4,14 +4,21 @@
 # --------------------------------------------------------------------------------------------
 
 import os
+import copy
+import json
+import time
+import uuid
+import datetime
 import logging
-from logging.handlers import RotatingFileHandler
+from collections import deque
 
-from .util import CtxTypeError, ensure_dir
+from .util import CtxTypeError, ensure_dir, file_lock
 from .events import EVENT_INVOKER_PRE_CMD_TBL_CREATE, EVENT_PARSER_GLOBAL_CREATE
 
 CLI_LOGGER_NAME = 'cli'
 
+_LOG_FILE_FORMAT = '%(process)d : %(asctime)s : %(levelname)s : %(name)s : %(message)s'
+
 
 def get_logger(module_name=None):
     """ Get the logger for a module. If no module name is given, the current CLI logger is returned.
@@ -65,11 +72,11 @@ class _CustomStreamHandler(logging.StreamHandler):
 
     def __init__(self, log_level_config, log_format):
         import platform
-        import colorama
 
         logging.StreamHandler.__init__(self)
         self.setLevel(log_level_config)
         if platform.system() == 'Windows':
+            import colorama
             self.stream = colorama.AnsiToWin32(self.stream).stream
         self.enable_color = self._should_enable_color()
         self.setFormatter(logging.Formatter(log_format[self.enable_color]))
@@ -84,11 +91,145 @@ class _CustomStreamHandler(logging.StreamHandler):
         return msg
 
 
+class _RingBufferHandler(logging.Handler):
+    """ Keeps the last records in memory. The records are only formatted if they are written out. """
+
+    def __init__(self, capacity):
+        logging.Handler.__init__(self, logging.DEBUG)
+        self.records = deque(maxlen=capacity)
+
+    def handle(self, record):
+        # Appending to a deque is thread-safe so the handler lock isn't needed
+        rv = self.filter(record)
+        if rv:
+            self.records.append(record)
+        return rv
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class _InvocationLogFilter(logging.Filter):
+    """ Adds the invocation that a record was logged in to the record: invocation_id, command, elapsed
+        (the seconds since the invocation started) and process (the process ID, which every record has).
+    """
+
+    def __init__(self, cli_logging):
+        logging.Filter.__init__(self)
+        self.cli_logging = cli_logging
+
+    def filter(self, record):
+        cli_logging = self.cli_logging
+        record.invocation_id = cli_logging.invocation_id
+        record.command = cli_logging.get_invocation_command()
+        record.elapsed = record.created - cli_logging.invocation_start
+        return True
+
+
+_EXCEPTION_FORMATTER = logging.Formatter()
+
+
+class _JSONLogFormatter(logging.Formatter):
+    """ Formats a record as a JSON object on a single line """
+
+    def format(self, record):
+        entry = {
+            'time': '{}.{:03d}Z'.format(time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)),
+                                        int(record.msecs)),
+            'level': record.levelname,
+            'logger': record.name,
+            'process': record.process,
+            'invocation_id': getattr(record, 'invocation_id', None),
+            'command': getattr(record, 'command', None),
+            'elapsed': round(getattr(record, 'elapsed', 0.0), 6),
+            'message': record.getMessage()
+        }
+        # A record that went through the queue only has the traceback text (see _get_queue_handler_cls)
+        exception = record.exc_text or (record.exc_info and self.formatException(record.exc_info))
+        if exception:
+            entry['exception'] = exception
+        return json.dumps(entry, sort_keys=True, default=str)
+
+
+def _get_queue_handler_cls():
+    from logging.handlers import QueueHandler
+
+    class _QueueHandler(QueueHandler):
+        """ Queues a record with its message merged with the arguments like QueueHandler, but keeps the traceback
+            in exc_text instead of adding it to the message, so the formatter of the log file gets it separately.
+        """
+
+        def prepare(self, record):
+            exc_text = record.exc_text
+            if record.exc_info and not exc_text:
+                exc_text = _EXCEPTION_FORMATTER.formatException(record.exc_info)
+            message = record.getMessage()
+            # A copy so that the other handlers of the record aren't affected
+            record = copy.copy(record)
+            record.message = record.msg = message
+            record.args = None
+            record.exc_info = None
+            record.exc_text = exc_text
+            return record
+
+    return _QueueHandler
+
+
+def _get_rotating_file_handler_cls():
+    from logging.handlers import RotatingFileHandler
+
+    class _SharedRotatingFileHandler(RotatingFileHandler):
+        """ A rotating file handler for a log file that is shared by many processes.
+            The log file is rotated by one process at a time, under a lock, and a process that finds that
+            another one has already rotated the log file opens the new one instead of rotating it again.
+        """
+
+        def __init__(self, filename, **kwargs):
+            RotatingFileHandler.__init__(self, filename, delay=True, **kwargs)
+            self.lock_path = self.baseFilename + '.lock'
+
+        def shouldRollover(self, record):
+            if self.maxBytes <= 0:
+                return False
+            if self.stream is None:
+                self.stream = self._open()
+            # The file is opened for appending so the end of the file includes what other processes wrote.
+            # The record isn't formatted to measure it, so a log file goes over maxBytes by up to one record.
+            self.stream.seek(0, 2)
+            return self.stream.tell() >= self.maxBytes
+
+        def _is_rotated(self):
+            try:
+                return os.fstat(self.stream.fileno()).st_ino != os.stat(self.baseFilename).st_ino
+            except OSError:
+                return True
+
+        def doRollover(self):
+            with file_lock(self.lock_path):
+                if self.stream is not None and self._is_rotated():
+                    self.stream.close()
+                    self.stream = self._open()
+                    return
+                RotatingFileHandler.doRollover(self)
+                if self.stream is None:
+                    self.stream = self._open()
+
+    return _SharedRotatingFileHandler
+
+
 class CLILogging(object):
 
     DEBUG_FLAG = '--debug'
     VERBOSE_FLAG = '--verbose'
 
+    # Writes the records to the log file on a background thread (see _init_logfile_handlers)
+    _file_log_listener = None
+    _end_file_log_registered = False
+
+    # Registered by the CLI when it is created (see knack.cli.CLI.register_event_handlers)
+    EVENT_HANDLERS = [(EVENT_PARSER_GLOBAL_CREATE, 'on_global_arguments'),
+                      (EVENT_INVOKER_PRE_CMD_TBL_CREATE, 'remove_logger_flags')]
+
     @staticmethod
     def on_global_arguments(_, **kwargs):
         arg_group = kwargs.get('arg_group')
@@ -121,14 +262,19 @@ class CLILogging(object):
         from .cli import CLI
         if cli_ctx is not None and not isinstance(cli_ctx, CLI):
             raise CtxTypeError(cli_ctx)
+        self.name = name
         self.logfile_name = '{}.log'.format(name)
         self.file_log_enabled = CLILogging._is_file_log_enabled(cli_ctx)
+        self.file_log_format = cli_ctx.config.get('logging', 'log_file_format', fallback='text').lower()
         self.log_dir = CLILogging._get_log_dir(cli_ctx)
         self.console_log_configs = CLILogging._get_console_log_configs()
         self.console_log_format = CLILogging._get_console_log_format()
         self.cli_ctx = cli_ctx
-        self.cli_ctx.register_event(EVENT_PARSER_GLOBAL_CREATE, CLILogging.on_global_arguments)
-        self.cli_ctx.register_event(EVENT_INVOKER_PRE_CMD_TBL_CREATE, CLILogging.remove_logger_flags)
+        # The invocation that is being logged (see configure())
+        self.invocation_id = None
+        self.invocation_start = time.time()
+        self._previous_invocation_data = None
+        self._flight_recorder = None
 
     def configure(self, args):
         """ Configure the loggers with the appropriate log level etc.
@@ -136,6 +282,7 @@ class CLILogging(object):
         :param args: The arguments from the command line
         :type args: list
         """
+        self._start_invocation()
         verbose_level = self._determine_verbose_level(args)
         log_level_config = self.console_log_configs[verbose_level]
         root_logger = logging.getLogger()
@@ -145,14 +292,68 @@ class CLILogging(object):
         root_logger.setLevel(logging.DEBUG)
         cli_logger.setLevel(logging.DEBUG)
         cli_logger.propagate = False
+        self._init_flight_recorder(cli_logger)
         if root_logger.handlers and cli_logger.handlers:
-            # loggers already configured
+            # loggers already configured (e.g. a long-lived CLI) so only apply the verbosity for these args
+            self._set_console_log_levels(root_logger, cli_logger, log_level_config)
             return
         self._init_console_handlers(root_logger, cli_logger, log_level_config)
         if self.file_log_enabled:
             self._init_logfile_handlers(root_logger, cli_logger)
             get_logger(__name__).debug("File logging enabled - writing logs to '%s'.", self.log_dir)
 
+    def _start_invocation(self):
+        # Configured at the start of every invocation
+        self.invocation_id = uuid.uuid4().hex
+        self.invocation_start = time.time()
+        invocation = getattr(self.cli_ctx, 'invocation', None)
+        self._previous_invocation_data = invocation.data if invocation is not None else None
+        if self._flight_recorder is not None:
+            self._flight_recorder.records.clear()
+
+    def get_invocation_command(self):
+        """ The command of the invocation that is being logged, or None if it isn't known yet """
+        invocation = self.cli_ctx.invocation
+        data = invocation.data if invocation is not None else None
+        if data is None or data is self._previous_invocation_data:
+            return None
+        return data['command']
+
+    def _init_flight_recorder(self, cli_logger):
+        if self._flight_recorder is None and \
+                self.cli_ctx.config.getboolean('logging', 'flight_recorder', fallback=False):
+            capacity = self.cli_ctx.config.getint('logging', 'flight_recorder_size', fallback=1000)
+            self._flight_recorder = _RingBufferHandler(capacity)
+            cli_logger.addHandler(self._flight_recorder)
+
+    def dump_flight_recorder(self):
+        """ Save the debug log of the current invocation (its last records, see section=logging,
+            option=flight_recorder) to a file in the logs directory. The CLI does this when a command fails.
+
+        :return: The path of the file or None if there is nothing to save
+        :rtype: str
+        """
+        if self._flight_recorder is None or not self._flight_recorder.records:
+            return None
+        records = list(self._flight_recorder.records)
+        self._flight_recorder.records.clear()
+        timestamp = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+        dump_path = os.path.join(self.log_dir, '{}_{}_{}.debug.log'.format(self.name, timestamp, os.getpid()))
+        formatter = logging.Formatter(_LOG_FILE_FORMAT)
+        try:
+            ensure_dir(self.log_dir)
+            with open(dump_path, 'w') as f:
+                for record in records:
+                    try:
+                        f.write(formatter.format(record) + '\n')
+                    except Exception:  # pylint: disable=broad-except
+                        f.write('{} : {}\n'.format(record.levelname, record.msg))
+        except (IOError, OSError) as ex:
+            get_logger(__name__).warning("Unable to save the debug log to '%s': %s", dump_path, ex)
+            return None
+        get_logger(__name__).warning("The debug log of the failed command was saved to '%s'.", dump_path)
+        return dump_path
+
     def _determine_verbose_level(self, args):
         """ Get verbose level by reading the arguments. """
         verbose_level = 0
@@ -170,15 +371,67 @@ class CLILogging(object):
         cli_logger.addHandler(_CustomStreamHandler(log_level_config[CLI_LOGGER_NAME],
                                                    self.console_log_format[CLI_LOGGER_NAME]))
 
+    @staticmethod
+    def _set_console_log_levels(root_logger, cli_logger, log_level_config):
+        for logger, level in ((root_logger, log_level_config['root']),
+                              (cli_logger, log_level_config[CLI_LOGGER_NAME])):
+            for handler in logger.handlers:
+                if isinstance(handler, _CustomStreamHandler):
+                    handler.setLevel(level)
+
     def _init_logfile_handlers(self, root_logger, cli_logger):
         ensure_dir(self.log_dir)
         log_file_path = os.path.join(self.log_dir, self.logfile_name)
-        logfile_handler = RotatingFileHandler(log_file_path, maxBytes=10 * 1024 * 1024, backupCount=5)
-        lfmt = logging.Formatter('%(process)d : %(asctime)s : %(levelname)s : %(name)s : %(message)s')
+        logfile_handler = _get_rotating_file_handler_cls()(log_file_path, maxBytes=10 * 1024 * 1024, backupCount=5)
+        if self.file_log_format == 'json':
+            lfmt = _JSONLogFormatter()
+        else:
+            lfmt = logging.Formatter(_LOG_FILE_FORMAT)
         logfile_handler.setFormatter(lfmt)
         logfile_handler.setLevel(logging.DEBUG)
-        root_logger.addHandler(logfile_handler)
-        cli_logger.addHandler(logfile_handler)
+        try:
+            from logging.handlers import QueueListener
+        except ImportError:
+            # Python 2 writes the records on the thread that logs them
+            handler = logfile_handler
+        else:
+            # The records are written to the file on a background thread so logging doesn't wait for the disk
+            from six.moves import queue
+            CLILogging._end_file_log()
+            log_queue = queue.Queue(-1)
+            handler = _get_queue_handler_cls()(log_queue)
+            CLILogging._file_log_listener = QueueListener(log_queue, logfile_handler, respect_handler_level=True)
+            CLILogging._file_log_listener.start()
+            if not CLILogging._end_file_log_registered:
+                import atexit
+                atexit.register(CLILogging._end_file_log)
+                CLILogging._end_file_log_registered = True
+        handler.setLevel(logging.DEBUG)
+        if self.file_log_format == 'json':
+            # Filters run on the thread that logs the record, before it is queued
+            handler.addFilter(_InvocationLogFilter(self))
+        root_logger.addHandler(handler)
+        cli_logger.addHandler(handler)
+
+    @staticmethod
+    def flush_file_log():
+        """ Wait until the queued log records have been written to the log file. """
+        listener = CLILogging._file_log_listener
+        if listener is not None:
+            # Stopping the listener writes out the records that are in the queue
+            listener.stop()
+            for handler in listener.handlers:
+                handler.flush()
+            listener.start()
+
+    @staticmethod
+    def _end_file_log():
+        listener = CLILogging._file_log_listener
+        if listener is not None:
+            CLILogging._file_log_listener = None
+            listener.stop()
+            for handler in listener.handlers:
+                handler.close()
 
     @staticmethod
     def _is_file_log_enabled(cli_ctx):
@@ -0,0 +1,260 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+import os
+import sys
+import json
+from collections import OrderedDict
+from importlib import import_module
+
+import six
+
+from .util import CtxTypeError
+from .log import get_logger
+
+logger = get_logger(__name__)
+
+MANIFEST_FORMAT_VERSION = 1
+_REF_KEY = '__ref__'
+
+
+class _NotSerializableError(ValueError):
+    pass
+
+
+def _get_callable_ref(func):
+    """ Get a 'module#attr.path' reference for a callable, if it can be imported back """
+    module_name = getattr(func, '__module__', None)
+    attr_path = getattr(func, '__qualname__', None) or getattr(func, '__name__', None)
+    if not module_name or not attr_path or '<' in attr_path:
+        raise _NotSerializableError(func)
+    ref = '{}#{}'.format(module_name, attr_path)
+    try:
+        resolved = _resolve_callable_ref(ref)
+    except (ImportError, AttributeError):
+        raise _NotSerializableError(func)
+    if resolved is not func and getattr(resolved, '__func__', None) is not func:
+        raise _NotSerializableError(func)
+    return ref
+
+
+def _resolve_callable_ref(ref):
+    mod_to_import, attr_path = ref.split('#')
+    obj = import_module(mod_to_import)
+    for part in attr_path.split('.'):
+        obj = getattr(obj, part)
+    return obj
+
+
+def get_module_file(module_name):
+    """ The file of a module, without importing the module if it isn't imported yet
+
+    :param module_name: The name of the module
+    :type module_name: str
+    :return: The file of the module or None if it can't be found
+    :rtype: str
+    """
+    module = sys.modules.get(module_name)
+    if module is not None:
+        return getattr(module, '__file__', None)
+    try:
+        from importlib.util import find_spec
+    except ImportError:
+        # Python 2
+        try:
+            return getattr(import_module(module_name), '__file__', None)
+        except ImportError:
+            return None
+    try:
+        spec = find_spec(module_name)
+    except (ImportError, ValueError):
+        return None
+    return spec.origin if spec is not None and spec.has_location else None
+
+
+def _encode_value(value):
+    if value is None or isinstance(value, (bool, int, float) + six.string_types):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [_encode_value(v) for v in value]
+    if callable(value):
+        return {_REF_KEY: _get_callable_ref(value)}
+    raise _NotSerializableError(value)
+
+
+def _decode_value(value):
+    if isinstance(value, list):
+        return [_decode_value(v) for v in value]
+    if isinstance(value, dict):
+        return _resolve_callable_ref(value[_REF_KEY])
+    return value
+
+
+class CommandManifest(object):
+
+    _FILE_NAME = 'command_manifest.json'
+
+    def __init__(self, cli_ctx=None):
+        """ An on-disk index of the command table.
+            It maps each command name to its operation, its registration kwargs and the module that registered it
+            so that the commands needed for an invocation can be created without running every registration.
+
+        :param cli_ctx: CLI Context
+        :type cli_ctx: knack.cli.CLI
+        """
+        from .cli import CLI
+        if cli_ctx is not None and not isinstance(cli_ctx, CLI):
+            raise CtxTypeError(cli_ctx)
+        self.cli_ctx = cli_ctx
+        self.path = os.path.join(cli_ctx.config.config_dir, CommandManifest._FILE_NAME)
+        # Entries recorded while the command table is loaded in full
+        self.entries = OrderedDict()
+        self.modules = {}
+        self._uncacheable = set()
+        self._stored = None
+
+    def add(self, name, operation, kwargs, module_name, module_file):
+        """ Record how a command was registered.
+
+        :param name: The name of the command (e.g. 'mygroup mycommand')
+        :type name: str
+        :param operation: The operation string for the command handler (e.g. 'mymodule#myhandler')
+        :type operation: str
+        :param kwargs: The kwargs that the command was registered with
+        :type kwargs: dict
+        :param module_name: The name of the module that registered the command
+        :type module_name: str
+        :param module_file: The file of the module that registered the command
+        :type module_file: str
+        """
+        try:
+            if not module_file:
+                raise _NotSerializableError(module_name)
+            encoded_kwargs = {key: _encode_value(value) for key, value in kwargs.items()}
+        except _NotSerializableError as ex:
+            logger.debug("Command '%s' can not be added to the command manifest: %s", name, ex)
+            self._uncacheable.add(name)
+            return
+        self._uncacheable.discard(name)
+        self.entries[name] = {'operation': operation, 'kwargs': encoded_kwargs, 'module': module_name}
+        self.modules[module_name] = module_file
+
+    def add_module(self, module_name, module_file=None):
+        """ Rebuild the manifest when a module that registers commands changes
+
+        :param module_name: The name of the module
+        :type module_name: str
+        :param module_file: The file of the module (looked up from the module name if not given)
+        :type module_file: str
+        """
+        if not module_name or module_name in self.modules:
+            return
+        module_file = module_file or get_module_file(module_name)
+        if module_file:
+            self.modules[module_name] = module_file
+
+    def _get_cli_version(self):
+        return self.cli_ctx.get_cli_version()
+
+    def load(self):
+        """ Load the manifest from disk.
+
+        :return: The stored manifest or None if it does not exist or is out of date
+        :rtype: dict
+        """
+        if self._stored is not None:
+            return self._stored or None
+        self._stored = {}
+        try:
+            with open(self.path, 'r') as f:
+                stored = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if stored.get('format') != MANIFEST_FORMAT_VERSION or stored.get('cli_version') != self._get_cli_version():
+            logger.debug('Command manifest is out of date.')
+            return None
+        for module_file, mtime in stored.get('modules', {}).values():
+            try:
+                if os.path.getmtime(module_file) != mtime:
+                    logger.debug("Command manifest is out of date. '%s' has changed.", module_file)
+                    return None
+            except OSError:
+                return None
+        self._stored = stored
+        return stored
+
+    def save(self, cmd_tbl):
+        """ Persist the entries recorded while loading the full command table.
+            Nothing is written if any command in the table could not be recorded.
+
+        :param cmd_tbl: The full command table
+        :type cmd_tbl: dict
+        """
+        if self.load() is not None:
+            return
+        missing = [name for name in cmd_tbl if name not in self.entries or name in self._uncacheable]
+        if not cmd_tbl or missing:
+            logger.debug('Command manifest not saved. %d commands can not be recorded.', len(missing))
+            return
+        try:
+            modules = {name: [module_file, os.path.getmtime(module_file)]
+                       for name, module_file in self.modules.items()}
+            stored = {
+                'format': MANIFEST_FORMAT_VERSION,
+                'cli_version': self._get_cli_version(),
+                'modules': modules,
+                'commands': OrderedDict((name, self.entries[name]) for name in cmd_tbl)
+            }
+            if not os.path.isdir(os.path.dirname(self.path)):
+                os.makedirs(os.path.dirname(self.path))
+            with open(self.path, 'w') as f:
+                json.dump(stored, f)
+        except (IOError, OSError) as ex:
+            logger.debug('Unable to save command manifest: %s', ex)
+            return
+        self._stored = stored
+        logger.debug("Command manifest saved to '%s'.", self.path)
+
+    @staticmethod
+    def _get_matching_names(commands, command):
+        """ Find the commands for the longest prefix of the command that matches a group or command """
+        words = command.split()
+        while words:
+            prefix = ' '.join(words)
+            names = [name for name in commands if name == prefix or name.startswith(prefix + ' ')]
+            if names:
+                return names
+            words.pop()
+        return []
+
+    def materialize(self, commands_loader, command):
+        """ Create only the commands that match the command from the argv into the commands loader.
+
+        :param commands_loader: The commands loader to create the commands in
+        :type commands_loader: knack.commands.CLICommandsLoader
+        :param command: The command from the argv (e.g. 'mygroup mycommand')
+        :type command: str
+        :return: The names of the commands created or None if the full command table has to be loaded
+        :rtype: list
+        """
+        stored = self.load()
+        if not stored:
+            return None
+        commands = stored['commands']
+        names = CommandManifest._get_matching_names(commands, command)
+        if not names:
+            return None
+        try:
+            for name in names:
+                entry = commands[name]
+                kwargs = {key: _decode_value(value) for key, value in entry['kwargs'].items()}
+                commands_loader.command_table[name] = commands_loader.create_command(name, entry['operation'],
+                                                                                     **kwargs)
+        except (ImportError, AttributeError, KeyError, ValueError) as ex:
+            logger.debug('Unable to use the command manifest: %s', ex)
+            commands_loader.command_table.clear()
+            return None
+        logger.debug('Loaded %d of %d commands from the command manifest.', len(names), len(commands))
+        return names
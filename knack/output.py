@@ -7,11 +7,14 @@ from __future__ import print_function
 
 import errno
 import json
+import math
+import re
 import traceback
 from collections import OrderedDict
-from six import StringIO, text_type, u, string_types
+from itertools import chain, islice
+from six import StringIO, text_type, u, string_types, integer_types
 
-from .util import CLIError, CommandResultItem, CtxTypeError
+from .util import CLIError, CommandResultItem, CtxTypeError, is_stream
 from .events import EVENT_INVOKER_POST_PARSE_ARGS, EVENT_PARSER_GLOBAL_CREATE
 from .log import get_logger
 
@@ -32,41 +35,328 @@ class _ComplexEncoder(json.JSONEncoder):
         return json.JSONEncoder.default(self, o)
 
 
+_JSON_KWARGS = {'indent': 2, 'sort_keys': True, 'separators': (',', ': ')}
+# The size of the chunks of JSON a formatter yields for OutputProducer.out to write
+_CHUNK_SIZE = 64 * 1024
+
+
+def _json_input(result):
+    # OrderedDict.__dict__ is always '{}', to persist the data, convert to dict first.
+    return dict(result) if hasattr(result, '__dict__') else result
+
+
+def _dump_json(result):
+    return get_json_backend().dumps(_json_input(result))
+
+
+def _join_chunks(pieces, size=_CHUNK_SIZE):
+    """ Join many small pieces of output into chunks of about size characters. """
+    buffered = []
+    length = 0
+    for piece in pieces:
+        buffered.append(piece)
+        length += len(piece)
+        if length >= size:
+            yield ''.join(buffered)
+            buffered = []
+            length = 0
+    if buffered:
+        yield ''.join(buffered)
+
+
+def _iter_json_array(items, dump=_dump_json):
+    """ Encode the items one at a time as an indented JSON array, identical to encoding them as a list. """
+    separator = '[\n  '
+    for item in items:
+        # Strings in JSON can't contain a raw newline so only the lines of the document get indented
+        yield separator + dump(item).replace('\n', '\n  ')
+        separator = ',\n  '
+    yield '[]\n' if separator == '[\n  ' else '\n]\n'
+
+
+class JSONBackend(object):
+    """ Encodes the JSON output. Every backend produces the same output as the json module with indent=2,
+        sort_keys=True, ensure_ascii and bytes decoded to str, apart from how floats are written (see
+        _OrjsonJSONBackend).
+    """
+
+    name = None
+
+    @staticmethod
+    def is_available():
+        return True
+
+    def iter_encode(self, obj):
+        """ Encode an object in chunks
+
+        :param obj: The object to encode
+        :return: The chunks of the JSON document (without a trailing newline)
+        :rtype: iterator of str
+        """
+        raise NotImplementedError()
+
+    def dumps(self, obj):
+        return ''.join(self.iter_encode(obj))
+
+
+class _StdlibJSONBackend(JSONBackend):
+
+    name = 'json'
+
+    def iter_encode(self, obj):
+        # Encoding in one go is faster than iterencode. Streamed results are encoded one item at a time instead
+        # (see _iter_json_array).
+        output = self.dumps(obj)
+        return (output[i:i + _CHUNK_SIZE] for i in range(0, len(output), _CHUNK_SIZE))
+
+    def dumps(self, obj):
+        return json.dumps(obj, cls=_ComplexEncoder, **_JSON_KWARGS)
+
+
+class _OrjsonJSONBackend(JSONBackend):
+    """ orjson is many times faster than the pure Python encoder that json uses with indent.
+        Objects that orjson can't encode (e.g. non-str keys, big ints) or that json can't encode either
+        (datetime and dataclass instances) fall back to json. The result is not checked up front, as that takes
+        most of the time saved, so floats are written as orjson writes them: the ones that Python writes with an
+        exponent are written in another form (e.g. 1e16 for 1e+16, 0.00001 for 1e-05) and NaN and infinity,
+        which aren't valid JSON, are written as null. orjson also encodes UUID and enum values.
+
+        Unlike json, orjson encodes the whole document at once, so the encoded output is held in memory
+        (once, as bytes, when it is ASCII; the chunks are decoded as they are yielded).
+    """
+
+    name = 'orjson'
+    _NON_ASCII_BYTES = re.compile(b'[\x7f-\xff]')
+    _NON_ASCII = re.compile(u'[^\x00-\x7e]')
+
+    @staticmethod
+    def is_available():
+        try:
+            import orjson  # pylint: disable=unused-variable
+            return True
+        except ImportError:
+            return False
+
+    def __init__(self):
+        import orjson
+        self._orjson = orjson
+        self._options = orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | \
+            orjson.OPT_PASSTHROUGH_DATACLASS
+        self._fallback = _StdlibJSONBackend()
+
+    @staticmethod
+    def _default(o):
+        if isinstance(o, bytes):
+            return o.decode()
+        raise TypeError('Object of type {} is not JSON serializable'.format(type(o).__name__))
+
+    @staticmethod
+    def _escape(match):
+        code = ord(match.group(0))
+        if code > 0xFFFF:
+            code -= 0x10000
+            return '\\u{:04x}\\u{:04x}'.format(0xD800 | (code >> 10), 0xDC00 | (code & 0x3FF))
+        return '\\u{:04x}'.format(code)
+
+    def _encode(self, obj):
+        try:
+            # orjson.JSONEncodeError is a TypeError
+            data = self._orjson.dumps(obj, default=_OrjsonJSONBackend._default, option=self._options)
+        except TypeError:
+            return None
+        if _OrjsonJSONBackend._NON_ASCII_BYTES.search(data):
+            # Escape like ensure_ascii does. Only strings can contain these characters.
+            return _OrjsonJSONBackend._NON_ASCII.sub(_OrjsonJSONBackend._escape, data.decode('utf-8'))
+        # Left as bytes so that the output isn't held as both bytes and str
+        return data
+
+    @staticmethod
+    def _iter_chunks(output):
+        for i in range(0, len(output), _CHUNK_SIZE):
+            chunk = output[i:i + _CHUNK_SIZE]
+            yield chunk.decode('ascii') if isinstance(chunk, bytes) else chunk
+
+    def iter_encode(self, obj):
+        output = self._encode(obj)
+        if output is None:
+            return self._fallback.iter_encode(obj)
+        return _OrjsonJSONBackend._iter_chunks(output)
+
+    def dumps(self, obj):
+        output = self._encode(obj)
+        if output is None:
+            return self._fallback.dumps(obj)
+        return output.decode('ascii') if isinstance(output, bytes) else output
+
+
+# The first one that is available is used
+_JSON_BACKENDS = [_OrjsonJSONBackend, _StdlibJSONBackend]
+_json_backend = None
+
+
+def get_json_backend():
+    """ The JSON backend for the output
+
+    :rtype: knack.output.JSONBackend
+    """
+    global _json_backend  # pylint: disable=global-statement
+    if _json_backend is None:
+        _json_backend = next(backend for backend in _JSON_BACKENDS if backend.is_available())()
+    return _json_backend
+
+
 def format_json(obj):
+    return ''.join(iter_format_json(obj))
+
+
+def iter_format_json(obj):
+    """ JSON output in chunks (see format_json), so that it is written as it is encoded """
     result = obj.result
-    # OrderedDict.__dict__ is always '{}', to persist the data, convert to dict first.
-    input_dict = dict(result) if hasattr(result, '__dict__') else result
-    return json.dumps(input_dict, indent=2, sort_keys=True, cls=_ComplexEncoder,
-                      separators=(',', ': ')) + '\n'
+    if is_stream(result):
+        return _iter_json_array(result)
+    return chain(get_json_backend().iter_encode(_json_input(result)), ['\n'])
+
+
+def format_jsonl(obj):
+    """ JSON Lines: one compact JSON document per line for each item of a list or streamed result """
+    result = obj.result
+    items = result if isinstance(result, list) or is_stream(result) else [result]
+    encoder = _ComplexEncoder(separators=(',', ':'))
+    return (encoder.encode(dict(item) if hasattr(item, '__dict__') else item) + '\n' for item in items)
+
+
+class _JSONColorizer(object):
+    """ Encodes JSON with ANSI colors in the same pass, with the same layout as format_json. """
+
+    KEY = '\x1b[94m'
+    STRING = '\x1b[33m'
+    LITERAL = '\x1b[34m'
+    RESET = '\x1b[0m'
+
+    @staticmethod
+    def _float_str(o):
+        if o != o:  # pylint: disable=comparison-with-itself
+            return 'NaN'
+        if o in (float('inf'), float('-inf')):
+            return 'Infinity' if o > 0 else '-Infinity'
+        return float.__repr__(o)
+
+    @staticmethod
+    def _key_str(key):
+        # The same conversion of keys as the json module
+        if isinstance(key, string_types):
+            return key
+        if isinstance(key, float):
+            return _JSONColorizer._float_str(key)
+        if key is True:
+            return 'true'
+        if key is False:
+            return 'false'
+        if key is None:
+            return 'null'
+        if isinstance(key, integer_types):
+            return int.__repr__(key)
+        raise TypeError('keys must be str, int, float, bool or None, not {}'.format(type(key).__name__))
+
+    def iter_encode(self, obj):
+        """ Encode an object a piece at a time
+
+        :param obj: The object to encode
+        :return: The pieces of the colored JSON document (without a trailing newline)
+        :rtype: iterator of str
+        """
+        encode_str = json.encoder.encode_basestring_ascii
+        key, string, literal, reset = self.KEY, self.STRING, self.LITERAL, self.RESET
+        # Pending output: either text to write or a (value, indent level) to encode
+        stack = [(obj, 0)]
+        while stack:
+            item = stack.pop()
+            if not isinstance(item, tuple):
+                yield item
+                continue
+            value, level = item
+            if isinstance(value, bytes) and not isinstance(value, str):
+                value = value.decode()
+            if isinstance(value, string_types):
+                yield string + encode_str(value) + reset
+            elif value is None:
+                yield literal + 'null' + reset
+            elif value is True or value is False:
+                yield literal + ('true' if value else 'false') + reset
+            elif isinstance(value, integer_types):
+                yield literal + int.__repr__(value) + reset
+            elif isinstance(value, float):
+                yield literal + _JSONColorizer._float_str(value) + reset
+            elif isinstance(value, (list, tuple, dict)):
+                if not value:
+                    yield '{}' if isinstance(value, dict) else '[]'
+                    continue
+                newline_indent = '\n' + '  ' * (level + 1)
+                if isinstance(value, dict):
+                    pending = ['{']
+                    for child_key, child in sorted(value.items()):
+                        key_str = encode_str(_JSONColorizer._key_str(child_key))
+                        pending.append(newline_indent + key + key_str + reset + ': ')
+                        pending.append((child, level + 1))
+                        pending.append(',')
+                    pending[-1] = '\n' + '  ' * level + '}'
+                else:
+                    pending = ['[']
+                    for child in value:
+                        pending.append(newline_indent)
+                        pending.append((child, level + 1))
+                        pending.append(',')
+                    pending[-1] = '\n' + '  ' * level + ']'
+                stack.extend(reversed(pending))
+            else:
+                raise TypeError('Object of type {} is not JSON serializable'.format(type(value).__name__))
+
+    def dumps(self, obj):
+        return ''.join(self.iter_encode(obj))
 
 
 def format_json_color(obj):
-    from pygments import highlight, lexers, formatters
-    return highlight(format_json(obj), lexers.JsonLexer(), formatters.TerminalFormatter())  # pylint: disable=no-member
+    result = obj.result
+    colorizer = _JSONColorizer()
+    if is_stream(result):
+        return _iter_json_array(result, dump=lambda item: colorizer.dumps(_json_input(item)))
+    return _join_chunks(chain(colorizer.iter_encode(_json_input(result)), ['\n']))
 
 
 def format_table(obj):
+    return ''.join(iter_format_table(obj))
+
+
+def iter_format_table(obj):
+    """ Table output a line at a time (see format_table), so that a streamed result is written as it is read """
     result = obj.result
-    try:
-        if obj.table_transformer and not obj.is_query_active:
-            if isinstance(obj.table_transformer, str):
-                from jmespath import compile as compile_jmes, Options
-                result = compile_jmes(obj.table_transformer).search(result, Options(OrderedDict))
+    if obj.table_transformer and not obj.is_query_active:
+        try:
+            if is_stream(result):
+                # A table transformer works on the whole result
+                result = list(result)
+            transformer = obj.table_transformer
+            if isinstance(transformer, string_types):
+                # A JMESPath expression is compiled through the query cache the first time it is used
+                from .query import compile_query
+                transformer = compile_query(transformer)
+            if hasattr(transformer, 'search'):
+                from jmespath import Options
+                result = transformer.search(result, Options(OrderedDict))
             else:
-                result = obj.table_transformer(result)
-        result_list = result if isinstance(result, list) else [result]
-        should_sort_keys = not obj.is_query_active and not obj.table_transformer
-        to = _TableOutput(should_sort_keys)
-        return to.dump(result_list)
-    except:
-        logger.debug(traceback.format_exc())
-        raise CLIError("Table output unavailable. "
-                       "Use the --query option to specify an appropriate query. "
-                       "Use --debug for more info.")
+                result = transformer(result)
+        except:
+            logger.debug(traceback.format_exc())
+            raise CLIError(_TableOutput.UNAVAILABLE_MESSAGE)
+    result_list = result if isinstance(result, list) or is_stream(result) else [result]
+    should_sort_keys = not obj.is_query_active and not obj.table_transformer
+    return _TableOutput(should_sort_keys, max_rows=obj.max_rows).iter_lines(result_list)
 
 
 def format_tsv(obj):
     result = obj.result
+    if is_stream(result):
+        return _TsvOutput.iter_rows(result)
     result_list = result if isinstance(result, list) else [result]
     return _TsvOutput.dump(result_list)
 
@@ -74,13 +364,24 @@ def format_tsv(obj):
 class OutputProducer(object):
 
     ARG_DEST = '_output_format'
+    MAX_ROWS_ARG_DEST = '_output_max_rows'
+
+    # Registered by the CLI when it is created (see knack.cli.CLI.register_event_handlers)
+    EVENT_HANDLERS = [(EVENT_PARSER_GLOBAL_CREATE, 'on_global_arguments'),
+                      (EVENT_INVOKER_POST_PARSE_ARGS, 'handle_output_argument')]
 
     _FORMAT_DICT = {
         'json': format_json,
         'jsonc': format_json_color,
+        'jsonl': format_jsonl,
         'table': format_table,
         'tsv': format_tsv,
     }
+    # The formatters that out() uses in place of the ones that return the whole output as a string
+    _STREAMING_FORMATTERS = {
+        format_json: iter_format_json,
+        format_table: iter_format_table,
+    }
 
     @staticmethod
     def on_global_arguments(cli_ctx, **kwargs):
@@ -90,6 +391,9 @@ class OutputProducer(object):
                                default=cli_ctx.config.get('core', 'output', fallback='json'),
                                help='Output format',
                                type=str.lower)
+        arg_group.add_argument('--max-rows', dest=OutputProducer.MAX_ROWS_ARG_DEST, metavar='N', type=int,
+                               default=cli_ctx.config.get('core', 'table_max_rows', fallback=None),
+                               help='Maximum number of rows to show in table output.')
 
     @staticmethod
     def handle_output_argument(cli_ctx, **kwargs):
@@ -98,6 +402,9 @@ class OutputProducer(object):
         cli_ctx.invocation.data['output'] = getattr(args, OutputProducer.ARG_DEST)
         # We've handled the argument so remove it
         delattr(args, OutputProducer.ARG_DEST)
+        cli_ctx.invocation.data['max_rows'] = getattr(args, OutputProducer.MAX_ROWS_ARG_DEST, None)
+        if hasattr(args, OutputProducer.MAX_ROWS_ARG_DEST):
+            delattr(args, OutputProducer.MAX_ROWS_ARG_DEST)
 
     def __init__(self, cli_ctx=None):
         """ Manages the production of output from the result of a command invocation
@@ -109,8 +416,6 @@ class OutputProducer(object):
         if cli_ctx is not None and not isinstance(cli_ctx, CLI):
             raise CtxTypeError(cli_ctx)
         self.cli_ctx = cli_ctx
-        self.cli_ctx.register_event(EVENT_PARSER_GLOBAL_CREATE, OutputProducer.on_global_arguments)
-        self.cli_ctx.register_event(EVENT_INVOKER_POST_PARSE_ARGS, OutputProducer.handle_output_argument)
 
     def out(self, obj, formatter=None, out_file=None):  # pylint: disable=no-self-use
         """ Produces the output using the command result.
@@ -127,18 +432,59 @@ class OutputProducer(object):
             raise TypeError('Expected {} got {}'.format(CommandResultItem.__name__, type(obj)))
 
         import platform
-        import colorama
 
-        if platform.system() == 'Windows':
+        is_windows = platform.system() == 'Windows'
+        if is_windows:
+            import colorama
             out_file = colorama.AnsiToWin32(out_file).stream
-        output = formatter(obj)
+        # Formatters return the output or an iterable of chunks of it
+        output = OutputProducer._STREAMING_FORMATTERS.get(formatter, formatter)(obj)
+        if not isinstance(output, string_types):
+            # The first chunk is produced before anything is written, so an error in the formatter
+            # (e.g. a value that can't be serialized) in most outputs fails before any of it is written
+            output = iter(output)
+            first_chunk = next(output, None)
+            output = chain([first_chunk], output) if first_chunk is not None else []
         try:
-            print(output, file=out_file, end='')
+            if isinstance(output, string_types):
+                OutputProducer._write(output, out_file)
+            else:
+                # On Windows the output has to go through colorama and the newline translation of the text stream
+                OutputProducer._write_chunks(output, out_file, use_buffer=not is_windows)
         except IOError as ex:
             if ex.errno == errno.EPIPE:
                 pass
             else:
                 raise
+
+    @staticmethod
+    def _write_chunks(chunks, out_file, use_buffer=True):
+        # A text stream over a binary buffer (e.g. sys.stdout) gets the encoded chunks written to the buffer
+        buffer = getattr(out_file, 'buffer', None) if use_buffer else None
+        encoding = getattr(out_file, 'encoding', None)
+        if buffer is None or not encoding:
+            for index, chunk in enumerate(chunks):
+                OutputProducer._write(chunk, out_file)
+                if index == 0:
+                    # Show the start of the output right away
+                    out_file.flush()
+            return
+        errors = getattr(out_file, 'errors', None) or 'strict'
+        out_file.flush()
+        for index, chunk in enumerate(chunks):
+            try:
+                data = chunk.encode(encoding, errors)
+            except UnicodeEncodeError:
+                data = chunk.encode('ascii', 'ignore')
+            buffer.write(data)
+            if index == 0:
+                buffer.flush()
+        buffer.flush()
+
+    @staticmethod
+    def _write(output, out_file):
+        try:
+            print(output, file=out_file, end='')
         except UnicodeEncodeError:
             print(output.encode('ascii', 'ignore').decode('utf-8', 'ignore'),
                   file=out_file, end='')
@@ -147,26 +493,168 @@ class OutputProducer(object):
         return OutputProducer._FORMAT_DICT[format_type]
 
 
+_NOT_PRINTABLE_ASCII = re.compile(u'[^\x20-\x7e]')
+_wcswidth = None
+
+
+def _display_width(text):
+    """ The number of terminal columns that text takes up. Like tabulate, East Asian wide characters count as two
+        when wcwidth is installed.
+    """
+    if not _NOT_PRINTABLE_ASCII.search(text):
+        return len(text)
+    global _wcswidth  # pylint: disable=global-statement
+    if _wcswidth is None:
+        try:
+            from wcwidth import wcswidth as _wcswidth
+        except ImportError:
+            _wcswidth = len
+    return _wcswidth(text)
+
+
+def _ljust(text, width):
+    return text + ' ' * (width - _display_width(text))
+
+
+def _rjust(text, width):
+    return ' ' * (width - _display_width(text)) + text
+
+
+class _TableColumn(object):  # pylint: disable=too-few-public-methods
+
+    # The types a column can have, from least to most generic. Like tabulate, a column is numeric if all of
+    # its values are numbers (or strings of numbers) and the numbers are aligned on the decimal point.
+    NONE, BOOL, INT, FLOAT, STR = range(5)
+    _NUMBER_WITH_THOUSANDS_SEPARATORS = re.compile(r'^[+-]?[0-9]{1,3}(?:,[0-9]{3})+(?:\.[0-9]*)?$')
+
+    __slots__ = ('header', 'kind', 'width', 'float_width', 'decimals')
+
+    def __init__(self, header):
+        self.header = header
+        self.kind = _TableColumn.BOOL
+        self.width = _display_width(header) + 2
+        # The widest number up to the decimal point and the most digits after it in a float column
+        self.float_width = 0
+        self.decimals = -1
+
+    @staticmethod
+    def _get_kind(value, text):
+        if isinstance(value, bool):
+            return _TableColumn.BOOL
+        if isinstance(value, integer_types):
+            return _TableColumn.INT
+        if isinstance(value, float):
+            return _TableColumn.FLOAT
+        if not isinstance(value, string_types):
+            return _TableColumn.STR
+        if not text:
+            return _TableColumn.NONE
+        if text in ('True', 'False'):
+            return _TableColumn.BOOL
+        try:
+            int(text)
+            return _TableColumn.INT
+        except ValueError:
+            pass
+        try:
+            number = float(text)
+        except ValueError:
+            if _TableColumn._NUMBER_WITH_THOUSANDS_SEPARATORS.match(text):
+                return _TableColumn.FLOAT if '.' in text else _TableColumn.INT
+            return _TableColumn.STR
+        if (math.isinf(number) or math.isnan(number)) and text.lower() not in ('inf', '-inf', 'nan'):
+            return _TableColumn.STR
+        return _TableColumn.FLOAT
+
+    @staticmethod
+    def _to_float_text(value, text):
+        try:
+            return format(float(value.replace(',', '') if isinstance(value, string_types) else value), 'g')
+        except (ValueError, TypeError):
+            return text
+
+    @staticmethod
+    def _get_decimals(text):
+        if _TableColumn._get_kind(text, text) != _TableColumn.FLOAT:
+            return -1
+        point = text.rfind('.')
+        point = text.lower().rfind('e') if point < 0 else point
+        return len(text) - point - 1 if point >= 0 else -1
+
+    def add(self, value, text):
+        width = _display_width(text)
+        if width > self.width:
+            self.width = width
+        if self.kind == _TableColumn.STR:
+            # Nothing can change the type of the column any more
+            return
+        kind = _TableColumn._get_kind(value, text)
+        if kind > self.kind:
+            self.kind = kind
+        if kind != _TableColumn.NONE:
+            # The numbers of a float column are formatted as floats and aligned on the decimal point
+            float_text = _TableColumn._to_float_text(value, text)
+            decimals = _TableColumn._get_decimals(float_text)
+            self.decimals = max(self.decimals, decimals)
+            self.float_width = max(self.float_width, len(float_text) - decimals)
+
+    def get_width(self):
+        if self.kind == _TableColumn.FLOAT:
+            return max(_display_width(self.header) + 2, self.float_width + self.decimals)
+        return self.width
+
+    def format_header(self, width):
+        if self.kind in (_TableColumn.INT, _TableColumn.FLOAT):
+            return _rjust(self.header, width)
+        return _ljust(self.header, width)
+
+    def format_cell(self, cell, width):
+        if self.kind == _TableColumn.FLOAT:
+            if not cell[1]:
+                return ' ' * width
+            text = _TableColumn._to_float_text(*cell)
+            return _rjust(text + ' ' * (self.decimals - _TableColumn._get_decimals(text)), width)
+        if self.kind == _TableColumn.INT:
+            return _rjust(cell[1], width)
+        return _ljust(cell[1], width)
+
+
 class _TableOutput(object):  # pylint: disable=too-few-public-methods
 
     SKIP_KEYS = ['id', 'type', 'etag']
-
-    def __init__(self, should_sort_keys=False):
+    # The number of rows of a streamed result used to pick the columns and their widths
+    STREAM_WINDOW = 100
+    UNAVAILABLE_MESSAGE = ("Table output unavailable. "
+                           "Use the --query option to specify an appropriate query. "
+                           "Use --debug for more info.")
+    _EMPTY_CELL = (None, '')
+
+    def __init__(self, should_sort_keys=False, max_rows=None):
         self.should_sort_keys = should_sort_keys
+        self.max_rows = max_rows
+        # The columns for the keys of an item are worked out once for each set of keys
+        self._key_plans = {}
 
     @staticmethod
     def _capitalize_first_char(x):
         return x[0].upper() + x[1:] if x else x
 
+    def _get_key_plan(self, item):
+        keys = tuple(item.keys())
+        plan = self._key_plans.get(keys)
+        if plan is None:
+            ordered = sorted(keys) if self.should_sort_keys and isinstance(item, dict) else keys
+            plan = [(k, _TableOutput._capitalize_first_char(k)) for k in ordered if k not in _TableOutput.SKIP_KEYS]
+            self._key_plans[keys] = plan
+        return plan
+
     def _auto_table_item(self, item):
         new_entry = OrderedDict()
         try:
-            keys = sorted(item) if self.should_sort_keys and isinstance(item, dict) else item.keys()
-            for k in keys:
-                if k in _TableOutput.SKIP_KEYS:
-                    continue
-                if item[k] and not isinstance(item[k], (list, dict, set)):
-                    new_entry[_TableOutput._capitalize_first_char(k)] = item[k]
+            for k, header in self._get_key_plan(item):
+                value = item[k]
+                if value and not isinstance(value, (list, dict, set)):
+                    new_entry[header] = value
         except AttributeError:
             # handles odd cases where a string/bool/etc. is returned
             if isinstance(item, list):
@@ -184,13 +672,86 @@ class _TableOutput(object):  # pylint: disable=too-few-public-methods
             return new_result
         return self._auto_table_item(result)
 
+    @staticmethod
+    def _format_value(value):
+        if value is None:
+            return ''
+        # Floats are only shortened in numeric columns (see _TableColumn.format_cell), like tabulate does
+        return value.strip() if isinstance(value, string_types) else str(value)
+
+    def _add_row(self, columns, item):
+        """ Add the cells of an item to the columns (creating new ones as needed) and return the cells. """
+        cells = {}
+        for header, value in self._auto_table_item(item).items():
+            column = columns.get(header)
+            if column is None:
+                column = columns[header] = _TableColumn(header)
+            text = _TableOutput._format_value(value)
+            column.add(value, text)
+            cells[header] = (value, text)
+        return cells
+
+    @staticmethod
+    def _format_row(layout, cells):
+        return '  '.join(column.format_cell(cells.get(column.header, _TableOutput._EMPTY_CELL), width)
+                         for column, width in layout).rstrip() + '\n'
+
     def dump(self, data):
-        from tabulate import tabulate
-        table_data = self._auto_table(data)
-        table_str = tabulate(table_data, headers="keys", tablefmt="simple") if table_data else ''
-        if table_str == '\n':
-            raise ValueError('Unable to extract fields for table.')
-        return table_str + '\n'
+        return ''.join(self.iter_lines(data))
+
+    def iter_lines(self, data):
+        """ Yield the table a line at a time.
+            The columns and their widths come from a single pass over a list. For a streamed result they come
+            from its first STREAM_WINDOW rows and later rows that are wider than their columns are not truncated.
+
+        :param data: The items, one per row
+        :type data: list or iterator
+        :return: The lines of the table
+        :rtype: iterator of str
+        """
+        try:
+            for line in self._iter_lines(data):
+                yield line
+        except CLIError:
+            raise
+        except Exception:  # pylint: disable=broad-except
+            logger.debug(traceback.format_exc())
+            raise CLIError(_TableOutput.UNAVAILABLE_MESSAGE)
+
+    def _iter_lines(self, data):
+        rows = iter(data)
+        truncated = []
+        if self.max_rows is not None:
+            rows = self._limit(rows, truncated)
+        columns = OrderedDict()
+        window = islice(rows, _TableOutput.STREAM_WINDOW) if is_stream(data) else rows
+        window_cells = [self._add_row(columns, item) for item in window]
+        if not window_cells:
+            yield '\n'
+            return
+        if not columns:
+            # e.g. empty objects or objects with only empty or nested values
+            yield '\n'
+            return
+        layout = [(column, column.get_width()) for column in columns.values()]
+        yield '  '.join(column.format_header(width) for column, width in layout).rstrip() + '\n'
+        yield '  '.join('-' * width for _, width in layout) + '\n'
+        for cells in window_cells:
+            yield _TableOutput._format_row(layout, cells)
+        for item in rows:
+            cells = {}
+            for header, value in self._auto_table_item(item).items():
+                cells[header] = (value, _TableOutput._format_value(value))
+            yield _TableOutput._format_row(layout, cells)
+        if truncated:
+            logger.warning('Only the first %d rows are shown. Use --max-rows to show more.', self.max_rows)
+
+    def _limit(self, rows, truncated):
+        for index, item in enumerate(rows):
+            if index >= self.max_rows:
+                truncated.append(True)
+                return
+            yield item
 
 
 class _TsvOutput(object):  # pylint: disable=too-few-public-methods
@@ -237,6 +798,13 @@ class _TsvOutput(object):  # pylint: disable=too-few-public-methods
             _TsvOutput._dump_obj(data, stream)
         stream.write('\n')
 
+    @staticmethod
+    def iter_rows(data):
+        for item in data:
+            io = StringIO()
+            _TsvOutput._dump_row(item, io)
+            yield io.getvalue()
+
     @staticmethod
     def dump(data):
         io = StringIO()
@@ -4,6 +4,7 @@
 # --------------------------------------------------------------------------------------------
 
 import argparse
+import functools
 
 from .events import EVENT_PARSER_GLOBAL_CREATE
 from .util import CtxTypeError
@@ -26,6 +27,36 @@ ARGPARSE_SUPPORTED_KWARGS = [
 ]
 
 
+class _LazyParserMap(dict):
+    """ The choices of a subparsers action where each parser is only created when it is first looked up """
+
+    _PENDING = object()
+
+    def __init__(self):
+        super(_LazyParserMap, self).__init__()
+        self._factories = {}
+
+    def add_factory(self, name, factory):
+        self._factories[name] = factory
+        super(_LazyParserMap, self).__setitem__(name, _LazyParserMap._PENDING)
+
+    def __getitem__(self, name):
+        parser = super(_LazyParserMap, self).__getitem__(name)
+        if parser is _LazyParserMap._PENDING:
+            parser = self._factories.pop(name)()
+            super(_LazyParserMap, self).__setitem__(name, parser)
+        return parser
+
+    def get(self, name, default=None):
+        return self[name] if name in self else default
+
+    def values(self):
+        return [self[name] for name in self]
+
+    def items(self):
+        return [(name, self[name]) for name in self]
+
+
 class CLICommandParser(argparse.ArgumentParser):
 
     @staticmethod
@@ -36,17 +67,24 @@ class CLICommandParser(argparse.ArgumentParser):
         return global_parser
 
     @staticmethod
-    def _add_argument(obj, arg):
+    def _add_argument(obj, arg, require_arguments=True):
         """ Only pass valid argparse kwargs to argparse.ArgumentParser.add_argument """
         options_list = arg.options_list
         argparse_options = {name: value for name, value in arg.options.items() if name in ARGPARSE_SUPPORTED_KWARGS}
+        if not require_arguments:
+            argparse_options.pop('required', None)
         return obj.add_argument(*options_list, **argparse_options)
 
-    def __init__(self, cli_ctx=None, cli_help=None, **kwargs):
+    def __init__(self, cli_ctx=None, cli_help=None, lazy_subparsers=False, require_arguments=True, **kwargs):
         """ Create the argument parser
 
         :param cli_ctx: CLI Context
         :type cli_ctx: knack.cli.CLI
+        :param lazy_subparsers: Only create the parsers for groups and commands when parsing or help reaches them
+        :type lazy_subparsers: bool
+        :param require_arguments: Whether the arguments of the commands that are registered as required are
+                                  required when parsing (e.g. --for-each checks them for each record instead)
+        :type require_arguments: bool
         :param kwargs: These kwargs are typically used by argparse when creating the subparsers
         """
         from .cli import CLI
@@ -55,6 +93,9 @@ class CLICommandParser(argparse.ArgumentParser):
         self.cli_ctx = cli_ctx
         self.cli_help = cli_help
         self.subparsers = {}
+        self.lazy_subparsers = lazy_subparsers
+        self.require_arguments = require_arguments
+        self._lazy_choices = {}
         self.parents = kwargs.get('parents', [])
         self.help_file = kwargs.pop('help_file', None)
         # We allow a callable for description to be passed in in order to delay-load any help
@@ -77,48 +118,101 @@ class CLICommandParser(argparse.ArgumentParser):
             sp = self.add_subparsers(dest='_command')
             sp.required = True
             self.subparsers = {(): sp}
+            if self.lazy_subparsers:
+                self._set_lazy_choices(sp, ())
+        if self.lazy_subparsers:
+            self._load_command_table_lazily(cmd_tbl)
+            return
         for command_name, metadata in cmd_tbl.items():
             subparser = self._get_subparser(command_name.split())
             command_verb = command_name.split()[-1]
-            # To work around http://bugs.python.org/issue9253, we artificially add any new
-            # parsers we add to the "choices" section of the subparser.
-            subparser.choices[command_verb] = command_verb
-            # inject command_module designer's help formatter -- default is HelpFormatter
-            fc = metadata.formatter_class or argparse.HelpFormatter
-
-            command_parser = subparser.add_parser(command_verb,
-                                                  description=metadata.description,
-                                                  parents=self.parents,
-                                                  conflict_handler='error',
-                                                  help_file=metadata.help,
-                                                  formatter_class=fc,
-                                                  cli_help=self.cli_help)
-
-            command_validator = metadata.validator
-            argument_validators = []
-            argument_groups = {}
-            for arg in metadata.arguments.values():
-                if arg.validator:
-                    argument_validators.append(arg.validator)
-                if arg.arg_group:
-                    try:
-                        group = argument_groups[arg.arg_group]
-                    except KeyError:
-                        # group not found so create
-                        group_name = '{} Arguments'.format(arg.arg_group)
-                        group = command_parser.add_argument_group(arg.arg_group, group_name)
-                        argument_groups[arg.arg_group] = group
-                    param = CLICommandParser._add_argument(group, arg)
-                else:
-                    param = CLICommandParser._add_argument(command_parser, arg)
-                param.completer = arg.completer
-
-            command_parser.set_defaults(
-                func=metadata,
-                command=command_name,
-                _command_validator=command_validator,
-                _argument_validators=argument_validators,
-                _parser=command_parser)
+            command_parser = subparser.add_parser(command_verb, **self._get_command_parser_kwargs(metadata))
+            self._load_command_arguments(command_parser, command_name, metadata, self.require_arguments)
+
+    def _get_command_parser_kwargs(self, metadata):
+        # inject command_module designer's help formatter -- default is HelpFormatter
+        fc = metadata.formatter_class or argparse.HelpFormatter
+        return {
+            'description': metadata.description,
+            'parents': self.parents,
+            'conflict_handler': 'error',
+            'help_file': metadata.help,
+            'formatter_class': fc,
+            'cli_help': self.cli_help
+        }
+
+    @staticmethod
+    def _load_command_arguments(command_parser, command_name, metadata, require_arguments=True):
+        command_validator = metadata.validator
+        argument_validators = []
+        argument_groups = {}
+        for arg in metadata.arguments.values():
+            if arg.validator:
+                argument_validators.append(arg.validator)
+            if arg.arg_group:
+                try:
+                    group = argument_groups[arg.arg_group]
+                except KeyError:
+                    # group not found so create
+                    group_name = '{} Arguments'.format(arg.arg_group)
+                    group = command_parser.add_argument_group(arg.arg_group, group_name)
+                    argument_groups[arg.arg_group] = group
+                param = CLICommandParser._add_argument(group, arg, require_arguments)
+            else:
+                param = CLICommandParser._add_argument(command_parser, arg, require_arguments)
+            param.completer = arg.completer
+
+        command_parser.set_defaults(
+            func=metadata,
+            command=command_name,
+            _command_validator=command_validator,
+            _argument_validators=argument_validators,
+            _parser=command_parser)
+
+    def _set_lazy_choices(self, subparsers_action, path):
+        lazy_choices = self._lazy_choices.setdefault(path, _LazyParserMap())
+        # argparse uses the same mapping for the choices and to look up the parser to continue with
+        subparsers_action._name_parser_map = lazy_choices  # pylint: disable=protected-access
+        subparsers_action.choices = lazy_choices
+
+    def _load_command_table_lazily(self, cmd_tbl):
+        """ Only record the tree of groups and commands.
+            The parser for a group or command is created when parsing or help goes down its path.
+        """
+        for command_name, metadata in cmd_tbl.items():
+            path = tuple(command_name.split())
+            for length in range(1, len(path)):
+                group_choices = self._lazy_choices.setdefault(path[:length - 1], _LazyParserMap())
+                if path[length - 1] not in group_choices:
+                    group_choices.add_factory(path[length - 1], functools.partial(self._create_group_parser,
+                                                                                  path[:length]))
+            # Loading a command again replaces any parser already created for it (e.g. as its arguments changed)
+            command_choices = self._lazy_choices.setdefault(path[:-1], _LazyParserMap())
+            command_choices.add_factory(path[-1], functools.partial(self._create_command_parser,
+                                                                    path, command_name, metadata))
+
+    @staticmethod
+    def _create_parser(subparsers_action, name, **kwargs):
+        """ Create a parser for a name that is already in the lazy choices of the subparsers action.
+            (argparse.add_parser would reject the name as a conflict)
+        """
+        # pylint: disable=protected-access
+        kwargs.setdefault('prog', '{} {}'.format(subparsers_action._prog_prefix, name))
+        return subparsers_action._parser_class(**kwargs)
+
+    def _create_group_parser(self, path):
+        group_parser = CLICommandParser._create_parser(self.subparsers[path[:-1]], path[-1], cli_help=self.cli_help)
+        sp = group_parser.add_subparsers(dest='_subcommand')
+        sp.required = True
+        self._set_lazy_choices(sp, path)
+        self.subparsers[path] = sp
+        return group_parser
+
+    def _create_command_parser(self, path, command_name, metadata):
+        command_parser = CLICommandParser._create_parser(self.subparsers[path[:-1]], path[-1],
+                                                         **self._get_command_parser_kwargs(metadata))
+        self._load_command_arguments(command_parser, command_name, metadata, self.require_arguments)
+        return command_parser
 
     def _get_subparser(self, path):
         """For each part of the path, walk down the tree of
@@ -0,0 +1,147 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+import os
+import sys
+import datetime
+from contextlib import contextmanager
+
+from .util import CtxTypeError, ensure_dir
+from .events import EVENT_INVOKER_PRE_CMD_TBL_CREATE, EVENT_PARSER_GLOBAL_CREATE
+from .log import get_logger
+
+logger = get_logger(__name__)
+
+
+class CLIProfiler(object):
+
+    PROFILE_FLAG = '--profile'
+    PROFILE_MEMORY_FLAG = '--profile-memory'
+
+    # Registered by the CLI when it is created (see knack.cli.CLI.register_event_handlers)
+    EVENT_HANDLERS = [(EVENT_PARSER_GLOBAL_CREATE, 'on_global_arguments'),
+                      (EVENT_INVOKER_PRE_CMD_TBL_CREATE, 'remove_profile_flags')]
+
+    @staticmethod
+    def on_global_arguments(_, **kwargs):
+        arg_group = kwargs.get('arg_group')
+        # Like the logging flags, these are read before parsing as the profile covers the whole invocation.
+        arg_group.add_argument(CLIProfiler.PROFILE_FLAG, dest='_profile', action='store_true',
+                               help='Profile the command with cProfile and save the stats to the logs directory.')
+        arg_group.add_argument(CLIProfiler.PROFILE_MEMORY_FLAG, dest='_profile_memory', action='store_true',
+                               help='Trace memory allocations and show the top allocation sites and peak memory.')
+
+    @staticmethod
+    def remove_profile_flags(_, **kwargs):
+        args = kwargs.get('args')
+        for flag in (CLIProfiler.PROFILE_FLAG, CLIProfiler.PROFILE_MEMORY_FLAG):
+            while flag in args:
+                args.remove(flag)
+
+    def __init__(self, name, cli_ctx=None):
+        """
+
+        :param name: The name to be used for profile files
+        :type name: str
+        :param cli_ctx: CLI Context
+        :type cli_ctx: knack.cli.CLI
+        """
+        from .cli import CLI
+        if cli_ctx is not None and not isinstance(cli_ctx, CLI):
+            raise CtxTypeError(cli_ctx)
+        self.name = name
+        self.cli_ctx = cli_ctx
+        self.top_allocations = cli_ctx.config.getint('profile', 'top_allocations', fallback=10)
+
+    def _get_profile_dir(self):
+        from .log import CLILogging
+        return CLILogging._get_log_dir(self.cli_ctx)  # pylint: disable=protected-access
+
+    def _get_stats_file_path(self):
+        timestamp = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+        file_name = '{}_{}_{}.pstats'.format(self.name, timestamp, os.getpid())
+        return os.path.join(self._get_profile_dir(), file_name)
+
+    @contextmanager
+    def profile(self, args):
+        """ Profile the code run in this context if the profile flags are in the arguments.
+
+        :param args: The arguments from the command line
+        :type args: list
+        """
+        cpu = CLIProfiler.PROFILE_FLAG in args
+        memory = CLIProfiler.PROFILE_MEMORY_FLAG in args
+        if not cpu and not memory:
+            yield
+            return
+        profiler = self._start_cpu_profile() if cpu else None
+        tracing = self._start_memory_trace() if memory else False
+        try:
+            yield
+        finally:
+            if tracing:
+                self._stop_memory_trace()
+            if profiler:
+                self._stop_cpu_profile(profiler)
+
+    @staticmethod
+    def _start_cpu_profile():
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def _stop_cpu_profile(self, profiler):
+        profiler.disable()
+        stats_file = self._get_stats_file_path()
+        try:
+            ensure_dir(os.path.dirname(stats_file))
+            profiler.dump_stats(stats_file)
+        except (IOError, OSError) as ex:
+            logger.warning("Unable to save the profile to '%s': %s", stats_file, ex)
+            return
+        sys.stderr.write("Profile saved to '{}'. View it with: python -m pstats {}\n".format(stats_file,
+                                                                                          stats_file))
+
+    @staticmethod
+    def _start_memory_trace():
+        try:
+            import tracemalloc
+        except ImportError:
+            logger.warning('Memory profiling requires tracemalloc (Python 3.4+).')
+            return False
+        if tracemalloc.is_tracing():
+            logger.warning('Memory is already being traced so %s is ignored.', CLIProfiler.PROFILE_MEMORY_FLAG)
+            return False
+        tracemalloc.start()
+        return True
+
+    def _stop_memory_trace(self):
+        import tracemalloc
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        sys.stderr.write(CLIProfiler.format_memory_report(snapshot.statistics('lineno')[:self.top_allocations],
+                                                          peak))
+
+    @staticmethod
+    def format_memory_report(statistics, peak):
+        """ A report of the top allocation sites
+
+        :param statistics: The allocation statistics, largest first
+        :type statistics: list of tracemalloc.Statistic
+        :param peak: The peak traced memory in bytes
+        :type peak: int
+        :return: The report
+        :rtype: str
+        """
+        report = 'Peak memory: {:.1f} KiB\n'.format(peak / 1024.0)
+        report += 'Top {} allocation sites:\n'.format(len(statistics))
+        for index, stat in enumerate(statistics, 1):
+            frame = stat.traceback[0]
+            report += '#{}: {}:{}: {:.1f} KiB in {} blocks\n'.format(index, frame.filename, frame.lineno,
+                                                                   stat.size / 1024.0, stat.count)
+        return report
@@ -3,15 +3,344 @@
 # Licensed under the MIT License. See License.txt in the project root for license information.
 # --------------------------------------------------------------------------------------------
 
+import os
+import json
+import threading
 import collections
+from itertools import islice
 
 from .events import (EVENT_PARSER_GLOBAL_CREATE, EVENT_INVOKER_POST_PARSE_ARGS,
-                     EVENT_INVOKER_FILTER_RESULT)
-from .util import CtxTypeError
+                     EVENT_INVOKER_FILTER_RESULT, EVENT_CLI_POST_EXECUTE)
+from .util import CtxTypeError, is_stream, todict
+from .log import get_logger
+
+logger = get_logger(__name__)
+
+
+class QueryCache(object):
+
+    def __init__(self, max_size=256):
+        """ A bounded cache of compiled JMESPath expressions, least recently used first out.
+
+        :param max_size: The most expressions to keep
+        :type max_size: int
+        """
+        self.max_size = max_size
+        self.modified = False
+        self._expressions = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._expressions)
+
+    def compile(self, expression):
+        """ Get the compiled JMESPath expression, compiling it if it isn't in the cache.
+
+        :param expression: The JMESPath expression
+        :type expression: str
+        :return: The compiled expression
+        :rtype: jmespath.parser.ParsedResult
+        """
+        with self._lock:
+            compiled = self._expressions.pop(expression, None)
+            if compiled is not None:
+                self._expressions[expression] = compiled
+                return compiled
+        from jmespath import compile as compile_jmespath
+        compiled = compile_jmespath(expression)
+        with self._lock:
+            self._expressions[expression] = compiled
+            while len(self._expressions) > self.max_size:
+                self._expressions.popitem(last=False)
+            self.modified = True
+        return compiled
+
+    def clear(self):
+        with self._lock:
+            self._expressions.clear()
+
+    def load(self, path):
+        """ Add the expressions saved with save() to the cache. A missing or invalid file is ignored.
+
+        :param path: The path to the file
+        :type path: str
+        """
+        import jmespath
+        from jmespath.parser import ParsedResult
+        try:
+            with open(path, 'r') as f:
+                stored = json.load(f)
+            if stored['jmespath_version'] != jmespath.__version__:
+                return
+            expressions = stored['expressions']
+        except (IOError, OSError, ValueError, KeyError, TypeError) as ex:
+            logger.debug("Unable to load the query cache from '%s': %s", path, ex)
+            return
+        with self._lock:
+            # The expressions that were used in this process are more recent than the ones that were saved
+            loaded = collections.OrderedDict((expression, ParsedResult(expression, parsed))
+                                             for expression, parsed in expressions[-self.max_size:])
+            loaded.update(self._expressions)
+            while len(loaded) > self.max_size:
+                loaded.popitem(last=False)
+            self._expressions = loaded
+
+    def save(self, path):
+        """ Save the expressions in the cache so that they can be loaded by other processes.
+
+        :param path: The path to the file
+        :type path: str
+        """
+        import jmespath
+        with self._lock:
+            expressions = [[expression, compiled.parsed] for expression, compiled in self._expressions.items()]
+            self.modified = False
+        try:
+            with open(path, 'w') as f:
+                json.dump({'jmespath_version': jmespath.__version__, 'expressions': expressions}, f)
+        except (IOError, OSError, TypeError, ValueError) as ex:
+            logger.debug("Unable to save the query cache to '%s': %s", path, ex)
+
+
+# The compiled queries and string table transformers of the process. Commands run in a batch, by the daemon
+# or in tests share it.
+_query_cache = QueryCache()
+
+
+def compile_query(expression):
+    """ Compile a JMESPath expression using the cache of compiled expressions of the process.
+
+    :param expression: The JMESPath expression
+    :type expression: str
+    :return: The compiled expression
+    :rtype: jmespath.parser.ParsedResult
+    """
+    return _query_cache.compile(expression)
+
+
+def get_query_cache():
+    """ The cache of compiled JMESPath expressions of the process
+
+    :rtype: knack.query.QueryCache
+    """
+    return _query_cache
+
+
+class QueryAnalysis(object):  # pylint: disable=too-few-public-methods
+
+    def __init__(self, fields=None, filters=None, limit=None):
+        """ What a query reads from a result that is a list of items. A handler can use it to fetch less
+            (e.g. select fields, filter on the server and stop paging early). The query still runs on whatever
+            the handler returns, so the result is correct as long as the handler returns at least:
+
+            - the fields of each item that are in fields (all the fields if fields is None)
+            - the items that match all of the filters, in order (the items that don't match may be left out)
+            - the first limit items that match the filters (all of them if limit is None)
+
+        :param fields: The top-level fields of the items that the query reads or None if it may read any
+        :type fields: set of str
+        :param filters: The values that the fields of an item must equal for the query to use it
+        :type filters: dict
+        :param limit: The number of items (after the filters) that the query reads from the start of the list
+        :type limit: int
+        """
+        self.fields = fields
+        self.filters = filters or {}
+        self.limit = limit
+
+    def __repr__(self):
+        return 'QueryAnalysis(fields={!r}, filters={!r}, limit={!r})'.format(
+            sorted(self.fields) if self.fields is not None else None, self.filters, self.limit)
+
+
+def _get_fields(node):
+    """ The top-level fields that an expression reads from the value it is applied to or None for any field. """
+    node_type = node['type']
+    children = node['children']
+    if node_type == 'field':
+        return {node['value']}
+    if node_type in ('literal', 'expref'):
+        # An expression reference is applied to the elements of another argument of the function
+        return set()
+    if node_type in ('subexpression', 'index_expression', 'projection', 'filter_projection', 'flatten',
+                     'value_projection', 'pipe'):
+        # The rest of the expression reads from what the first part returns
+        return _get_fields(children[0])
+    if node_type in ('multi_select_dict', 'multi_select_list', 'key_val_pair', 'comparator', 'and_expression',
+                     'or_expression', 'not_expression', 'function_expression'):
+        fields = set()
+        for child in children:
+            child_fields = _get_fields(child)
+            if child_fields is None:
+                return None
+            fields.update(child_fields)
+        return fields
+    # e.g. the current node '@'
+    return None
+
+
+def _get_equality_filters(node):
+    """ The fields and values of a condition that only compares fields with literals for equality """
+    if node['type'] == 'and_expression':
+        filters = {}
+        for child in node['children']:
+            child_filters = _get_equality_filters(child)
+            if child_filters is None or any(filters.get(k, v) != v for k, v in child_filters.items()):
+                return None
+            filters.update(child_filters)
+        return filters
+    if node['type'] == 'comparator' and node['value'] == 'eq':
+        left, right = node['children']
+        if left['type'] == 'literal':
+            left, right = right, left
+        if left['type'] == 'field' and right['type'] == 'literal' and \
+                (right['value'] is None or isinstance(right['value'], (str, int, float, bool))):
+            return {left['value']: right['value']}
+    return None
+
+
+def _get_list_stages(node):
+    """ Split an expression into the stages it applies to the list of items (filters, indexes and slices in
+        order) and the expression it applies to each item (None for the whole item).
+        None if the expression is not of that form.
+    """
+    node_type = node['type']
+    children = node['children']
+    if node_type in ('identity', 'current'):
+        return [], None
+    if node_type in ('projection', 'filter_projection', 'flatten', 'index_expression', 'subexpression'):
+        split = _get_list_stages(children[0])
+        if split is None or split[1] is not None:
+            return None
+        stages = split[0]
+        if node_type == 'flatten':
+            # Items that are objects are unchanged
+            return stages, None
+        if node_type == 'projection':
+            return stages, None if children[1]['type'] == 'identity' else children[1]
+        if node_type == 'filter_projection':
+            return stages + [('filter', children[2])], None if children[1]['type'] == 'identity' else children[1]
+        if node_type == 'index_expression':
+            return stages + [(children[1]['type'], children[1])], None
+        # A subexpression of a single item, e.g. '[0].name'
+        if stages and stages[-1][0] == 'index':
+            return stages, children[1]
+        return None
+    if node_type == 'pipe':
+        left, right = [_get_list_stages(child) for child in children]
+        if left is None or left[1] is not None or right is None:
+            return None
+        return left[0] + right[0], right[1]
+    return None
+
+
+def _get_slice_stop(kind, stage):
+    """ The number of items an index or slice reads from the start of the list, 0 if it reads to the end
+        and None if it may read from the end.
+    """
+    if kind == 'index':
+        return stage['value'] + 1 if stage['value'] >= 0 else None
+    start, stop, step = stage['children']
+    if (start is not None and start < 0) or (stop is not None and stop < 0) or (step is not None and step < 0):
+        return None
+    return stop or 0 if stop is not None else 0
+
+
+def analyze_query(expression):
+    """ Analyze a compiled JMESPath expression for what it reads from a list of items. See QueryAnalysis.
+
+    :param expression: The compiled expression
+    :type expression: jmespath.parser.ParsedResult
+    :rtype: knack.query.QueryAnalysis
+    """
+    split = _get_list_stages(expression.parsed)
+    if split is None:
+        return QueryAnalysis(fields=_get_fields(expression.parsed))
+    stages, item_node = split
+    fields = _get_fields(item_node) if item_node is not None else None
+    for kind, stage in stages:
+        if kind == 'filter' and fields is not None:
+            condition_fields = _get_fields(stage)
+            fields = fields.union(condition_fields) if condition_fields is not None else None
+    filters = {}
+    limit = None
+    for kind, stage in stages:
+        if kind == 'filter':
+            stage_filters = _get_equality_filters(stage)
+            # A filter after a limit only applies to the first items. After a filter that can't be described
+            # with filters, which items a later index or slice reads isn't known.
+            if limit is not None or stage_filters is None or \
+                    any(filters.get(k, v) != v for k, v in stage_filters.items()):
+                break
+            filters.update(stage_filters)
+            continue
+        stop = _get_slice_stop(kind, stage)
+        if stop is None:
+            break
+        if stop:
+            limit = stop if limit is None else min(limit, stop)
+    return QueryAnalysis(fields=fields, filters=filters, limit=limit)
+
+
+def _is_false(value):
+    # The same as JMESPath
+    return value == '' or value == [] or value == {} or value is None or value is False
+
+
+def _search_stream(node, items, interpreter):
+    """ Run an expression on an iterator of items one item at a time, for expressions made of projections
+        (e.g. '[].name' or '[].{x: a, y: b}'), filters (e.g. "[?a=='b']"), flattening, slices from the start
+        (e.g. '[:10]') and pipes of these.
+
+    :param node: The AST of the expression
+    :type node: dict
+    :param items: The items
+    :type items: iterator
+    :param interpreter: The JMESPath interpreter to apply the rest of the expression to each item with
+    :type interpreter: jmespath.visitor.TreeInterpreter
+    :return: The result as an iterator or None if the expression can't run on one item at a time
+    :rtype: iterator
+    """
+    node_type = node['type']
+    children = node['children']
+    if node_type in ('identity', 'current'):
+        return items
+    if node_type == 'pipe':
+        left = _search_stream(children[0], items, interpreter)
+        return _search_stream(children[1], left, interpreter) if left is not None else None
+    if node_type not in ('projection', 'filter_projection', 'flatten', 'index_expression'):
+        return None
+    if node_type == 'index_expression':
+        slice_args = children[1]['children'] if children[1]['type'] == 'slice' else None
+        if not slice_args or any(value is not None and value < 0 for value in slice_args) or slice_args[2] == 0:
+            return None
+    base = _search_stream(children[0], items, interpreter)
+    if base is None:
+        return None
+    if node_type == 'index_expression':
+        return islice(base, *slice_args)
+    if node_type == 'flatten':
+        return (value for item in base for value in (item if isinstance(item, list) else [item]))
+    if node_type == 'filter_projection':
+        condition = children[2]
+        base = (item for item in base if not _is_false(interpreter.visit(condition, item)))
+    # A projection leaves out the items for which the expression is null
+    if children[1]['type'] == 'identity':
+        return (item for item in base if item is not None)
+    values = (interpreter.visit(children[1], item) for item in base)
+    return (value for value in values if value is not None)
 
 
 class CLIQuery(object):
 
+    CACHE_FILE_NAME = 'query_cache.json'
+    _loaded_cache_files = set()
+
+    # Registered by the CLI when it is created (see knack.cli.CLI.register_event_handlers)
+    EVENT_HANDLERS = [(EVENT_PARSER_GLOBAL_CREATE, 'on_global_arguments'),
+                      (EVENT_INVOKER_POST_PARSE_ARGS, 'handle_query_parameter'),
+                      (EVENT_CLI_POST_EXECUTE, 'save_cache')]
+
     @staticmethod
     def jmespath_type(raw_query):
         """Compile the query with JMESPath and return the compiled result.
@@ -19,15 +348,30 @@ class CLIQuery(object):
         In addition though, JMESPath can raise a KeyError.
         ValueErrors are caught by argparse so argument errors can be generated.
         """
-        from jmespath import compile as compile_jmespath
         try:
-            return compile_jmespath(raw_query)
+            return compile_query(raw_query)
         except KeyError:
             # Raise a ValueError which argparse can handle
             raise ValueError
 
     @staticmethod
-    def on_global_arguments(_, **kwargs):
+    def _get_cache_file(cli_ctx):
+        if not cli_ctx.config.getboolean('query', 'persist_cache', fallback=False):
+            return None
+        return os.path.join(cli_ctx.config.config_dir, CLIQuery.CACHE_FILE_NAME)
+
+    @staticmethod
+    def save_cache(cli_ctx, **_):
+        cache_file = CLIQuery._get_cache_file(cli_ctx)
+        if cache_file and _query_cache.modified:
+            _query_cache.save(cache_file)
+
+    @staticmethod
+    def on_global_arguments(cli_ctx, **kwargs):
+        cache_file = CLIQuery._get_cache_file(cli_ctx)
+        if cache_file and cache_file not in CLIQuery._loaded_cache_files:
+            CLIQuery._loaded_cache_files.add(cache_file)
+            _query_cache.load(cache_file)
         arg_group = kwargs.get('arg_group')
         arg_group.add_argument('--query', dest='_jmespath_query', metavar='JMESPATH',
                                help='JMESPath query string. See http://jmespath.org/ for more'
@@ -40,18 +384,53 @@ class CLIQuery(object):
         query_expression = args._jmespath_query  # pylint: disable=protected-access
         del args._jmespath_query
         if query_expression:
-            def filter_output(cli_ctx, **kwargs):
-                from jmespath import Options
-                kwargs['event_data']['result'] = query_expression.search(
-                    kwargs['event_data']['result'], Options(collections.OrderedDict))
-                cli_ctx.unregister_event(EVENT_INVOKER_FILTER_RESULT, filter_output)
-            cli_ctx.register_event(EVENT_INVOKER_FILTER_RESULT, filter_output)
+            # The query is kept with the invocation so that it never applies to another invocation of a
+            # long-lived CLI (e.g. in batch mode or after a command failed before its result was filtered).
             cli_ctx.invocation.data['query_active'] = True
+            cli_ctx.invocation.data['query_expression'] = query_expression
+            # Handlers can use it to only fetch what the query reads
+            cli_ctx.invocation.data['query_analysis'] = analyze_query(query_expression)
+            # The query runs after the other filter handlers, which were registered before the arguments were parsed.
+            # The handler only filters the result of an invocation that has a query so it can stay registered.
+            cli_ctx.unregister_event(EVENT_INVOKER_FILTER_RESULT, CLIQuery.filter_output)
+            cli_ctx.register_event(EVENT_INVOKER_FILTER_RESULT, CLIQuery.filter_output)
+
+    _functions = None
+
+    @staticmethod
+    def _get_functions():
+        """ The JMESPath functions check the type name of their arguments so views of the result
+            (see knack.util.todict_view) are converted before they are passed to a function.
+        """
+        if CLIQuery._functions is None:
+            from jmespath import functions
+
+            class _ViewFunctions(functions.Functions):
+                def call_function(self, function_name, resolved_args):
+                    resolved_args = [todict(arg) if isinstance(arg, (dict, list)) else arg for arg in resolved_args]
+                    return super(_ViewFunctions, self).call_function(function_name, resolved_args)
+
+            CLIQuery._functions = _ViewFunctions()
+        return CLIQuery._functions
+
+    @staticmethod
+    def filter_output(cli_ctx, **kwargs):
+        query_expression = cli_ctx.invocation.data.get('query_expression')
+        if query_expression:
+            from jmespath import Options
+            from jmespath.visitor import TreeInterpreter
+            result = kwargs['event_data']['result']
+            options = Options(collections.OrderedDict, custom_functions=CLIQuery._get_functions())
+            if is_stream(result):
+                streamed = _search_stream(query_expression.parsed, result, TreeInterpreter(options))
+                if streamed is not None:
+                    kwargs['event_data']['result'] = streamed
+                    return
+                result = list(result)
+            kwargs['event_data']['result'] = query_expression.search(result, options)
 
     def __init__(self, cli_ctx=None):
         from .cli import CLI
         if cli_ctx is not None and not isinstance(cli_ctx, CLI):
             raise CtxTypeError(cli_ctx)
         self.cli_ctx = cli_ctx
-        self.cli_ctx.register_event(EVENT_PARSER_GLOBAL_CREATE, CLIQuery.on_global_arguments)
-        self.cli_ctx.register_event(EVENT_INVOKER_POST_PARSE_ARGS, CLIQuery.handle_query_parameter)
@@ -6,6 +6,7 @@
 import collections
 import jmespath
 from .exceptions import JMESPathCheckAssertionError
+from ..query import compile_query
 
 
 class JMESPathCheck(object):  # pylint: disable=too-few-public-methods
@@ -15,8 +16,7 @@ class JMESPathCheck(object):  # pylint: disable=too-few-public-methods
 
     def __call__(self, execution_result):
         json_value = execution_result.get_output_in_json()
-        actual_result = jmespath.search(self._query, json_value,
-                                        jmespath.Options(collections.OrderedDict))
+        actual_result = compile_query(self._query).search(json_value, jmespath.Options(collections.OrderedDict))
         if not actual_result == self._expected_result:
             if actual_result:
                 raise JMESPathCheckAssertionError(self._query, self._expected_result, actual_result,
@@ -32,8 +32,7 @@ class JMESPathCheckExists(object):  # pylint: disable=too-few-public-methods
 
     def __call__(self, execution_result):
         json_value = execution_result.get_output_in_json()
-        actual_result = jmespath.search(self._query, json_value,
-                                        jmespath.Options(collections.OrderedDict))
+        actual_result = compile_query(self._query).search(json_value, jmespath.Options(collections.OrderedDict))
         if not actual_result:
             raise JMESPathCheckAssertionError(self._query, 'some value', actual_result,
                                               execution_result.output)
@@ -46,8 +45,7 @@ class JMESPathCheckGreaterThan(object):  # pylint: disable=too-few-public-method
 
     def __call__(self, execution_result):
         json_value = execution_result.get_output_in_json()
-        actual_result = jmespath.search(self._query, json_value,
-                                        jmespath.Options(collections.OrderedDict))
+        actual_result = compile_query(self._query).search(json_value, jmespath.Options(collections.OrderedDict))
         if not actual_result > self._expected_result:
             expected_result_format = "> {}".format(self._expected_result)
 
@@ -0,0 +1,76 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from timeit import default_timer
+
+PHASE_LOAD_COMMAND_TABLE = 'load_command_table'
+PHASE_LOAD_ARGUMENTS = 'load_arguments'
+PHASE_PARSER_LOAD = 'parser_load_command_table'
+PHASE_PARSE_ARGS = 'parse_args'
+PHASE_VALIDATION = 'validation'
+PHASE_HANDLER = 'handler'
+PHASE_TODICT = 'todict'
+PHASE_TRANSFORM = 'transform_result'
+PHASE_FILTER = 'filter_result'
+PHASE_OUTPUT = 'output'
+
+
+class InvocationTimings(object):
+
+    def __init__(self):
+        """ High resolution timings of the phases of an invocation (in seconds) """
+        self.start = default_timer()
+        self.end = None
+        self.phases = OrderedDict()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        """ Time a phase of the invocation. Time spent in a phase more than once is added up.
+
+        :param name: The name of the phase (e.g. knack.timings.PHASE_HANDLER)
+        :type name: str
+        """
+        start = default_timer()
+        try:
+            yield
+        finally:
+            elapsed = default_timer() - start
+            # Phases can run on many threads (e.g. the handler with --for-each)
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    def stop(self):
+        self.end = default_timer()
+
+    @property
+    def total(self):
+        return (self.end or default_timer()) - self.start
+
+    def to_dict(self):
+        result = OrderedDict(self.phases)
+        result['total'] = self.total
+        return result
+
+    def format_report(self):
+        """ A breakdown of the time spent in each phase
+
+        :return: The report as a table
+        :rtype: str
+        """
+        total = self.total
+        framework = total - self.phases.get(PHASE_HANDLER, 0.0)
+        name_width = max([len(name) for name in self.phases] + [len('framework (excl. handler)')])
+        row_format = '{:<' + str(name_width) + '}  {:>12}  {:>6}\n'
+        report = row_format.format('Phase', 'Time (ms)', '%')
+        report += row_format.format('-' * name_width, '-' * 12, '-' * 6)
+        for name, elapsed in list(self.phases.items()) + [('framework (excl. handler)', framework),
+                                                           ('total', total)]:
+            percent = (elapsed / total * 100) if total else 0.0
+            report += row_format.format(name, '{:.3f}'.format(elapsed * 1000), '{:.1f}'.format(percent))
+        return report
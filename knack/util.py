@@ -5,15 +5,35 @@
 
 import os
 import re
+from contextlib import contextmanager
 from datetime import date, time, datetime, timedelta
+from timeit import default_timer
 from enum import Enum
 
+try:
+    from collections.abc import Iterator
+except ImportError:
+    from collections import Iterator  # pylint: disable=deprecated-class
+
 
 class CommandResultItem(object):  # pylint: disable=too-few-public-methods
-    def __init__(self, result, table_transformer=None, is_query_active=False):
+    def __init__(self, result, table_transformer=None, is_query_active=False, exit_code=0, max_rows=None):
         self.result = result
         self.table_transformer = table_transformer
         self.is_query_active = is_query_active
+        self.exit_code = exit_code
+        self.max_rows = max_rows
+
+
+def is_stream(obj):
+    """ Whether a result is an iterator (e.g. from a generator) whose items should be streamed to the output
+        instead of being collected into a list first.
+
+    :param obj: The result
+    :return: True if the result should be streamed
+    :rtype: bool
+    """
+    return isinstance(obj, Iterator)
 
 
 class CLIError(Exception):
@@ -39,6 +59,88 @@ def ensure_dir(d):
         os.makedirs(d)
 
 
+def _lock_file(f):
+    try:
+        import fcntl
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    except ImportError:
+        import msvcrt
+        f.seek(0)
+        while True:
+            try:
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)  # pylint: disable=no-member
+                return
+            except IOError:
+                # LK_LOCK gives up after 10 seconds so keep waiting
+                pass
+
+
+def _unlock_file(f):
+    try:
+        import fcntl
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    except ImportError:
+        import msvcrt
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)  # pylint: disable=no-member
+
+
+@contextmanager
+def file_lock(path):
+    """ Hold an advisory lock on a file while in this context. Processes that lock the same file run the
+        context one at a time. The lock file is created if it doesn't exist.
+
+    :param path: The path to the lock file
+    :type path: str
+    :return: The seconds spent waiting for the lock
+    :rtype: float
+    """
+    ensure_dir(os.path.dirname(path) or '.')
+    with open(path, 'a') as f:
+        start = default_timer()
+        _lock_file(f)
+        try:
+            yield default_timer() - start
+        finally:
+            _unlock_file(f)
+
+
+@contextmanager
+def atomic_write(path, mode=None):
+    """ Write a file that readers either see in full or not at all. The content is written to a temporary
+        file in the same directory, which replaces the file when the context exits without an error.
+
+    :param path: The path to the file
+    :type path: str
+    :param mode: The permissions of the file (e.g. stat.S_IRUSR | stat.S_IWUSR)
+    :type mode: int
+    :return: The temporary file to write the content to
+    """
+    import tempfile
+    directory = os.path.dirname(path) or '.'
+    ensure_dir(directory)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        if mode is not None:
+            os.chmod(temp_path, mode)
+        if hasattr(os, 'replace'):
+            os.replace(temp_path, path)
+        else:
+            if os.name == 'nt' and os.path.exists(path):
+                os.remove(path)
+            os.rename(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
 def normalize_newlines(str_to_normalize):
     return str_to_normalize.replace('\r\n', '\n')
 
@@ -55,22 +157,203 @@ def to_snake_case(s):
     return re.sub('([a-z0-9])([A-Z])', r'\1_\2', s1).lower()
 
 
-def todict(obj):  # pylint: disable=too-many-return-statements
+_TODICT_CONVERTERS = {}
+_TODICT_PLANS = {}
+# Values of these types are returned as they are unless a converter is registered for them
+_TODICT_LEAF_TYPES = {type(None), bool, int, float, str, bytes}
+# What todict does with a value of a type
+_PLAN_LEAF, _PLAN_VALUE, _PLAN_CONVERT, _PLAN_DICT, _PLAN_LIST, _PLAN_OBJECT = range(6)
+# Put on the stack of todict after the items of a container, to mark that the container has been converted
+_TODICT_END = object()
+
 
+def register_todict_converter(obj_type, converter):
+    """ Register how todict converts objects of a type (and its subclasses) e.g. to serialize
+        a custom type or to leave out some of its attributes.
+
+    Example:
+        register_todict_converter(Decimal, str)
+
+    :param obj_type: The type to convert
+    :type obj_type: type
+    :param converter: Called with the object. Its result is converted further by todict.
+    :type converter: function
+    """
+    _TODICT_CONVERTERS[obj_type] = converter
+    for leaf_type in list(_TODICT_LEAF_TYPES):
+        if issubclass(leaf_type, obj_type):
+            _TODICT_LEAF_TYPES.discard(leaf_type)
+    _TODICT_PLANS.clear()
+
+
+def _get_todict_plan(obj):
+    for obj_type in type(obj).__mro__:
+        if obj_type in _TODICT_CONVERTERS:
+            return _PLAN_CONVERT, _TODICT_CONVERTERS[obj_type]
     if isinstance(obj, dict):
-        return {k: todict(v) for (k, v) in obj.items()}
+        return _PLAN_DICT, None
     elif isinstance(obj, list):
-        return [todict(a) for a in obj]
+        return _PLAN_LIST, None
     elif isinstance(obj, Enum):
-        return obj.value
+        return _PLAN_VALUE, lambda o: o.value
     elif isinstance(obj, (date, time, datetime)):
-        return obj.isoformat()
+        return _PLAN_VALUE, lambda o: o.isoformat()
     elif isinstance(obj, timedelta):
-        return str(obj)
+        return _PLAN_VALUE, str
     elif hasattr(obj, '_asdict'):
-        return todict(obj._asdict())
+        return _PLAN_CONVERT, lambda o: o._asdict()
     elif hasattr(obj, '__dict__'):
-        return dict([(to_camel_case(k), todict(v))
-                     for k, v in obj.__dict__.items()
-                     if not callable(v) and not k.startswith('_')])
-    return obj
+        # The camelCase names of the attributes of the type, worked out when an attribute is first seen
+        return _PLAN_OBJECT, {}
+    return _PLAN_LEAF, None
+
+
+def todict(obj):
+    """ Convert a result to dicts, lists and values that can be serialized.
+        The objects are walked with an explicit stack (so deep results don't hit the recursion limit)
+        and what to do with each type is worked out once (see register_todict_converter).
+
+    :param obj: The result of a command
+    :return: The converted result
+    :raises ValueError: If an object contains itself (e.g. a child with a reference to its parent)
+    """
+    plans = _TODICT_PLANS
+    leaf_types = _TODICT_LEAF_TYPES
+    root = [obj]
+    # Values still to convert and the container and key to store each result in
+    stack = [(obj, root, 0)]
+    # The ids of the containers whose items are being converted, i.e. the path from the root
+    path = set()
+    while stack:
+        value, container, key = stack.pop()
+        if value is _TODICT_END:
+            path.discard(key)
+            continue
+        value_type = type(value)
+        if value_type in leaf_types:
+            continue
+        plan = plans.get(value_type)
+        if plan is None:
+            plan = plans[value_type] = _get_todict_plan(value)
+        kind, detail = plan
+        if kind in (_PLAN_DICT, _PLAN_LIST, _PLAN_OBJECT):
+            value_id = id(value)
+            if value_id in path:
+                raise ValueError('Circular reference detected')
+            path.add(value_id)
+            stack.append((_TODICT_END, None, value_id))
+        if kind == _PLAN_DICT:
+            result = {}
+            for k, v in value.items():
+                result[k] = v
+                if type(v) not in leaf_types:
+                    stack.append((v, result, k))
+        elif kind == _PLAN_LIST:
+            result = list(value)
+            for index, v in enumerate(result):
+                if type(v) not in leaf_types:
+                    stack.append((v, result, index))
+        elif kind == _PLAN_OBJECT:
+            result = {}
+            for k, v in value.__dict__.items():
+                try:
+                    name = detail[k]
+                except KeyError:
+                    name = detail[k] = None if k.startswith('_') else to_camel_case(k)
+                if name is None or callable(v):
+                    continue
+                result[name] = v
+                if type(v) not in leaf_types:
+                    stack.append((v, result, name))
+        elif kind == _PLAN_VALUE:
+            result = detail(value)
+        elif kind == _PLAN_CONVERT:
+            result = detail(value)
+            if type(result) is not value_type:
+                stack.append((result, container, key))
+        else:
+            continue
+        container[key] = result
+    return root[0]
+
+
+class _DictView(dict):
+    """ A dict whose values are converted by todict when they are first read. """
+
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        converted = _to_view(value)
+        if converted is not value:
+            dict.__setitem__(self, key, converted)
+        return converted
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def values(self):
+        return [self[k] for k in self]
+
+    def items(self):
+        return [(k, self[k]) for k in self]
+
+    def __eq__(self, other):
+        # The values that haven't been read are still unconverted so the converted contents are compared
+        return todict(self) == (todict(other) if isinstance(other, (_DictView, _ListView)) else other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+
+class _ListView(list):
+    """ A list of the items of a result, with objects and dicts as views """
+
+    def __eq__(self, other):
+        return todict(self) == (todict(other) if isinstance(other, (_DictView, _ListView)) else other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+
+def _to_view(value):
+    value_type = type(value)
+    if value_type in _TODICT_LEAF_TYPES or value_type in (_DictView, _ListView):
+        return value
+    plan = _TODICT_PLANS.get(value_type)
+    if plan is None:
+        plan = _TODICT_PLANS[value_type] = _get_todict_plan(value)
+    kind, detail = plan
+    if kind == _PLAN_DICT:
+        return _DictView(value)
+    elif kind == _PLAN_LIST:
+        return _ListView(_to_view(v) for v in value)
+    elif kind == _PLAN_OBJECT:
+        view = _DictView()
+        for k, v in value.__dict__.items():
+            try:
+                name = detail[k]
+            except KeyError:
+                name = detail[k] = None if k.startswith('_') else to_camel_case(k)
+            if name is not None and not callable(v):
+                dict.__setitem__(view, name, v)
+        return view
+    elif kind == _PLAN_VALUE:
+        return detail(value)
+    elif kind == _PLAN_CONVERT:
+        result = detail(value)
+        return result if type(result) is value_type else _to_view(result)
+    return value
+
+
+def todict_view(obj):
+    """ Like todict, but objects and dicts are only converted as their values are read.
+        This is used to run a query over a result without converting the parts the query doesn't read.
+        Call todict on what the query returns to convert the rest.
+
+    :param obj: The result of a command
+    :return: The result with dict and list views in place of objects, dicts and lists
+    """
+    return _to_view(obj)
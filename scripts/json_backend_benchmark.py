@@ -0,0 +1,85 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+# Verify that every available JSON backend produces the same output as the json module and compare how
+# long they take. Floats that a backend writes in another form (see _OrjsonJSONBackend) are compared by value.
+#
+# Usage: python scripts/json_backend_benchmark.py [number of items]
+
+from __future__ import print_function
+import json
+import math
+import random
+import sys
+from timeit import default_timer
+
+from knack.output import _JSON_BACKENDS, _ComplexEncoder, _JSON_KWARGS
+
+
+def generate_result(count, edge_floats=False):
+    rnd = random.Random(0)
+    words = [u'alpha', u'beta', u'caf\xe9', u'\u65e5\u672c', u'\U0001f600', u'tab\there', u'quote"']
+
+    def _value(depth):
+        kind = rnd.randint(0, 7 if depth < 3 else 4)
+        if kind == 0:
+            return None
+        if kind == 1:
+            return rnd.random() < 0.5
+        if kind == 2:
+            return rnd.randint(-2 ** 40, 2 ** 40)
+        if kind == 3:
+            if edge_floats:
+                # Floats that backends may write differently from the json module
+                return rnd.choice([rnd.random() * 1e-6, 1e20, float('nan'), float('-inf'), 0.0])
+            return rnd.uniform(-1e6, 1e6)
+        if kind == 4:
+            return rnd.choice(words) + str(rnd.randint(0, 1000))
+        if kind == 5:
+            return b'bytes'
+        if kind == 6:
+            return [_value(depth + 1) for _ in range(rnd.randint(0, 4))]
+        return {rnd.choice(words): _value(depth + 1) for _ in range(rnd.randint(0, 4))}
+
+    return [{'id': i, 'name': 'item{}'.format(i), 'properties': _value(0)} for i in range(count)]
+
+
+def _same_value(decoded, value):
+    if isinstance(value, float) and (math.isnan(value) or math.isinf(value)):
+        # Not valid JSON, so backends may write null instead
+        return decoded is None or decoded == value or (math.isnan(value) and math.isnan(decoded))
+    if isinstance(value, bytes):
+        return decoded == value.decode()
+    if isinstance(value, list):
+        return len(decoded) == len(value) and all(_same_value(d, v) for d, v in zip(decoded, value))
+    if isinstance(value, dict):
+        return sorted(decoded) == sorted(value) and all(_same_value(decoded[k], v) for k, v in value.items())
+    return decoded == value
+
+
+def main(count):
+    result = generate_result(count)
+    edge_items = generate_result(1000, edge_floats=True)
+    start = default_timer()
+    expected = json.dumps(result, cls=_ComplexEncoder, **_JSON_KWARGS)
+    print('{:<10} {:>10.1f} ms'.format('reference', (default_timer() - start) * 1000))
+    failed = False
+    for backend_cls in _JSON_BACKENDS:
+        if not backend_cls.is_available():
+            print('{:<10} {:>13}'.format(backend_cls.name, 'unavailable'))
+            continue
+        backend = backend_cls()
+        start = default_timer()
+        output = ''.join(backend.iter_encode(result))
+        elapsed = default_timer() - start
+        same = output.encode('utf-8') == expected.encode('utf-8')
+        same = same and all(_same_value(json.loads(backend.dumps(item)), item) for item in edge_items)
+        failed = failed or not same
+        print('{:<10} {:>10.1f} ms  {}'.format(backend.name, elapsed * 1000, 'identical' if same else 'DIFFERENT'))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000))
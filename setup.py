@@ -15,10 +15,8 @@ DEPENDENCIES = [
     'argcomplete',
     'colorama',
     'jmespath',
-    'pygments',
     'pyyaml',
-    'six',
-    'tabulate'
+    'six'
 ]
 
 with open('README.rst', 'r', encoding='utf-8') as f:
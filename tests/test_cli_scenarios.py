@@ -4,6 +4,7 @@
 # --------------------------------------------------------------------------------------------
 
 import os
+import json
 import unittest
 import mock
 
@@ -13,6 +14,7 @@ from six import StringIO
 from knack import CLI
 from knack.commands import CLICommand, CLICommandsLoader
 from knack.invocation import CommandInvoker
+from knack.util import CLIError
 from tests.util import MockContext
 
 class TestCLIScenarios(unittest.TestCase):
@@ -116,5 +118,290 @@ class TestCLIScenarios(unittest.TestCase):
         self.assertEqual(expected_output, mock_stdout.getvalue())
         self.assertEqual(0, exit_code)
 
+    def _get_batch_cli(self):
+        def list_handler(_):
+            return [{'a': 1}, {'a': 2}]
+
+        def echo_handler(args):
+            return args['value']
+
+        class MyCommandsLoader(CLICommandsLoader):
+            loads = 0
+
+            def load_command_table(self, args):
+                MyCommandsLoader.loads += 1
+                self.command_table['abc list'] = CLICommand(self.cli_ctx, 'abc list', list_handler)
+                echo = CLICommand(self.cli_ctx, 'abc echo', echo_handler)
+                echo.add_argument('value', '--value', required=True)
+                self.command_table['abc echo'] = echo
+                return OrderedDict(self.command_table)
+
+        mycli = CLI(cli_name='exapp1', config_dir=self.mock_ctx.config.config_dir,
+                    commands_loader_cls=MyCommandsLoader)
+        return mycli, MyCommandsLoader
+
+    def test_invoke_batch(self):
+        mycli, loader_cls = self._get_batch_cli()
+        mock_stdout = StringIO()
+        with mock.patch('sys.stderr', new_callable=StringIO):
+            exit_codes = mycli.invoke_batch([['abc', 'echo', '--value', 'one'],
+                                             ['abc', 'list', '--query', '[1].a'],
+                                             ['abc', 'echo'],
+                                             ['abc', 'echo', '--value', 'two', '-o', 'tsv'],
+                                             ['abc', 'list', '-o', 'tsv']], out_file=mock_stdout)
+        self.assertEqual(exit_codes, [0, 0, 2, 0, 0])
+        self.assertEqual(mock_stdout.getvalue(), '"one"\n2\ntwo\n1\n2\n')
+        self.assertEqual(loader_cls.loads, 1)
+
+    def test_invoke_batch_reloads_for_other_commands(self):
+        def handler(_):
+            return 'done'
+
+        class MyCommandsLoader(CLICommandsLoader):
+            loads = 0
+
+            def load_command_table(self, args):
+                # Only load the group of the command
+                MyCommandsLoader.loads += 1
+                self.command_table['{} run'.format(args[0])] = CLICommand(self.cli_ctx, '{} run'.format(args[0]),
+                                                                        handler)
+                return OrderedDict(self.command_table)
+
+        mycli = CLI(cli_name='exapp1', config_dir=self.mock_ctx.config.config_dir,
+                    commands_loader_cls=MyCommandsLoader)
+        mock_stdout = StringIO()
+        exit_codes = mycli.invoke_batch([['abc', 'run'], ['abc', 'run'], ['xyz', 'run'], ['abc', 'run']],
+                                        out_file=mock_stdout)
+        self.assertEqual(exit_codes, [0, 0, 0, 0])
+        self.assertEqual(mock_stdout.getvalue(), '"done"\n' * 4)
+        self.assertEqual(MyCommandsLoader.loads, 3)
+
+    def test_query_runs_after_filter_handlers(self):
+        from knack.events import EVENT_INVOKER_FILTER_RESULT
+
+        def add_total(_, **kwargs):
+            result = kwargs['event_data']['result']
+            kwargs['event_data']['result'] = {'items': result, 'total': len(result)}
+
+        mycli, _ = self._get_batch_cli()
+        mycli.register_event(EVENT_INVOKER_FILTER_RESULT, add_total)
+        for _ in range(2):
+            mock_stdout = StringIO()
+            self.assertEqual(mycli.invoke(['abc', 'list', '--query', 'total'], out_file=mock_stdout), 0)
+            self.assertEqual(mock_stdout.getvalue(), '2\n')
+
+    def test_invoke_script(self):
+        mycli, loader_cls = self._get_batch_cli()
+        script_path = os.path.join(self.mock_ctx.config.config_dir, 'script.txt')
+        with open(script_path, 'w') as f:
+            f.write('# provision\nexapp1 abc echo --value "hello world"\n\nabc list --query [0].a  # first\n')
+        mock_stdout = StringIO()
+        exit_code = mycli.invoke(['--script', script_path], out_file=mock_stdout)
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(mock_stdout.getvalue(), '"hello world"\n1\n')
+        self.assertEqual(loader_cls.loads, 1)
+
+        with mock.patch('sys.stderr', new_callable=StringIO):
+            self.assertEqual(mycli.invoke(['--script', script_path + '.missing']), 1)
+
+    def _get_for_each_cli(self):
+        def greet_handler(args):
+            if args['name'] == 'fail':
+                raise CLIError('cannot greet')
+            return {'message': '{}, {}'.format(args['greeting'], args['name'])}
+
+        class MyCommandsLoader(CLICommandsLoader):
+            def load_command_table(self, args):
+                greet = CLICommand(self.cli_ctx, 'abc greet', greet_handler)
+                greet.add_argument('name', '--name', required=True)
+                greet.add_argument('greeting', '--greeting', '-g', default='hello')
+                self.command_table['abc greet'] = greet
+                return OrderedDict(self.command_table)
+
+        return CLI(cli_name='exapp1', config_dir=self.mock_ctx.config.config_dir,
+                   commands_loader_cls=MyCommandsLoader)
+
+    def test_for_each_records_in_input_order(self):
+        mycli = self._get_for_each_cli()
+        records = ''.join(json.dumps(r) + '\n' for r in [{'name': 'a'}, {'name': 'b', 'g': 'hi'}, {'name': 'fail'},
+                                                            {'--name': 'c', 'greeting': 'hey'}, {'unknown': 1}])
+        mock_stdout = StringIO()
+        with mock.patch('sys.stdin', StringIO(records + '\nnot json\n')), \
+                mock.patch('knack.invocation.logger') as mock_logger:
+            exit_code = mycli.invoke(['abc', 'greet', '--for-each', '--for-each-workers', '3', '--query', 'message',
+                                      '-o', 'tsv'], out_file=mock_stdout)
+        self.assertEqual(exit_code, 1)
+        self.assertEqual(mock_stdout.getvalue(), 'hello, a\nhi, b\nhey, c\n')
+        self.assertEqual(mycli.invocation.data['for_each_exit_codes'], [0, 0, 1, 0, 1, 1])
+        errors = [call[0][0] % call[0][1:] for call in mock_logger.error.call_args_list]
+        self.assertIn('Record 2: cannot greet', errors)
+        self.assertIn("Record 4: unrecognized field 'unknown'", errors)
+
+    def test_for_each_records_in_completion_order(self):
+        mycli = self._get_for_each_cli()
+        records = ''.join(json.dumps({'name': str(i)}) + '\n' for i in range(50))
+        mock_stdout = StringIO()
+        with mock.patch('sys.stdin', StringIO(records)):
+            exit_code = mycli.invoke(['abc', 'greet', '-g', 'yo', '--for-each', 'completion', '--query', 'message',
+                                      '-o', 'tsv'], out_file=mock_stdout)
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(sorted(mock_stdout.getvalue().splitlines()), sorted('yo, {}'.format(i) for i in range(50)))
+
+    def test_for_each_result_events_on_invocation_thread(self):
+        import threading
+        import time
+        from knack.events import EVENT_INVOKER_FILTER_RESULT
+        mycli = self._get_for_each_cli()
+        threads = set()
+
+        def collect_messages(cli_ctx, **kwargs):
+            threads.add(threading.current_thread())
+            data = cli_ctx.invocation.data
+            messages = data['messages'] or []
+            time.sleep(0.001)
+            data['messages'] = messages + [kwargs['event_data']['result']['message']]
+
+        mycli.register_event(EVENT_INVOKER_FILTER_RESULT, collect_messages)
+        records = ''.join(json.dumps({'name': str(i)}) + '\n' for i in range(20))
+        with mock.patch('sys.stdin', StringIO(records)):
+            exit_code = mycli.invoke(['abc', 'greet', '--for-each', 'completion', '--for-each-workers', '4',
+                                      '-o', 'tsv'], out_file=StringIO())
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(threads, {threading.current_thread()})
+        self.assertEqual(sorted(mycli.invocation.data['messages']), sorted('hello, {}'.format(i) for i in range(20)))
+        # The required arguments of the command are checked as usual without --for-each
+        command_parser = mycli.invocation._get_command_parser('abc greet')  # pylint: disable=protected-access
+        self.assertEqual([a.dest for a in command_parser._actions if a.required], ['name'])
+
+    def test_for_each_flag_with_value(self):
+        mycli = self._get_for_each_cli()
+        records = ''.join(json.dumps({'name': str(i)}) + '\n' for i in range(5))
+        for flag in ['--for-each=completion', '--for-each=input']:
+            mock_stdout = StringIO()
+            with mock.patch('sys.stdin', StringIO(records)):
+                exit_code = mycli.invoke(['abc', 'greet', '--name', 'z', flag, '--query', 'message', '-o', 'tsv'],
+                                         out_file=mock_stdout)
+            self.assertEqual(exit_code, 0)
+            self.assertEqual(sorted(mock_stdout.getvalue().splitlines()),
+                             ['hello, {}'.format(i) for i in range(5)])
+
+    def test_for_each_flag_abbreviated(self):
+        mycli = self._get_for_each_cli()
+        mock_stdout = StringIO()
+        # An abbreviation is parsed like argparse does, so it never runs the command once and ignores stdin
+        with mock.patch('sys.stdin', StringIO('{"name": "a"}\n')), \
+                mock.patch('sys.stderr', new_callable=StringIO) as mock_stderr:
+            with self.assertRaises(SystemExit):
+                mycli.invoke(['abc', 'greet', '--name', 'z', '--for-e'], out_file=mock_stdout)
+        self.assertIn('ambiguous option: --for-e', mock_stderr.getvalue())
+        self.assertEqual(mock_stdout.getvalue(), '')
+
+    def test_for_each_required_argument_missing(self):
+        mycli = self._get_for_each_cli()
+        with mock.patch('sys.stdin', StringIO('{"greeting": "hi"}\n')), \
+                mock.patch('knack.invocation.logger') as mock_logger:
+            exit_code = mycli.invoke(['abc', 'greet', '--for-each'], out_file=StringIO())
+        self.assertEqual(exit_code, 1)
+        mock_logger.error.assert_called_once_with('Record %d: %s', 0, mock.ANY)
+        self.assertEqual(str(mock_logger.error.call_args[0][2]), 'the following arguments are required: --name')
+
+    def test_debug_timings(self):
+        from knack.events import EVENT_CLI_TIMINGS
+        mycli, _ = self._get_batch_cli()
+        collected = []
+        mycli.register_event(EVENT_CLI_TIMINGS, lambda _, **kwargs: collected.append(kwargs['timings']))
+        with mock.patch('sys.stderr', new_callable=StringIO) as mock_stderr:
+            exit_code = mycli.invoke(['abc', 'list', '--query', '[0]'], out_file=StringIO())
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(mock_stderr.getvalue(), '')
+        timings = collected[0].to_dict()
+        for phase in ['load_command_table', 'parse_args', 'handler', 'todict', 'filter_result', 'output']:
+            self.assertIn(phase, timings)
+        self.assertGreaterEqual(timings['total'], sum(v for k, v in timings.items() if k != 'total'))
+
+        with mock.patch('sys.stderr', new_callable=StringIO) as mock_stderr:
+            exit_code = mycli.invoke(['abc', 'list', '--debug-timings'], out_file=StringIO())
+        self.assertEqual(exit_code, 0)
+        report = mock_stderr.getvalue()
+        self.assertIn('handler', report)
+        self.assertIn('framework (excl. handler)', report)
+        self.assertIsNot(collected[0], collected[1])
+
+    def test_subsystems_created_on_demand(self):
+        from knack.output import OutputProducer
+        mycli, _ = self._get_batch_cli()
+        self.assertNotIn('_output', mycli.__dict__)
+        self.assertNotIn('_query', mycli.__dict__)
+        mycli.out_file = StringIO()
+        self.assertEqual(mycli.invoke(['--version']), 0)
+        self.assertIn('Python', mycli.out_file.getvalue())
+        self.assertNotIn('_output', mycli.__dict__)
+        self.assertNotIn('_query', mycli.__dict__)
+        self.assertIsNone(mycli.invocation)
+
+        # The event handlers were registered up front so the arguments work without the instances
+        out_file = StringIO()
+        self.assertEqual(mycli.invoke(['abc', 'list', '--query', '[0].a', '--output', 'tsv'], out_file=out_file), 0)
+        self.assertEqual(out_file.getvalue(), '1\n')
+        self.assertIsInstance(mycli.output, OutputProducer)
+        self.assertNotIn('_query', mycli.__dict__)
+
+    def test_subsystem_subclass_registers_handlers_in_init(self):
+        from knack.events import EVENT_PARSER_GLOBAL_CREATE
+        from knack.output import OutputProducer
+
+        def add_extra_argument(_, **kwargs):
+            kwargs.get('arg_group').add_argument('--extra', action='store_true')
+
+        class MyOutputProducer(OutputProducer):
+            def __init__(self, cli_ctx=None):
+                super(MyOutputProducer, self).__init__(cli_ctx=cli_ctx)
+                cli_ctx.register_event(EVENT_PARSER_GLOBAL_CREATE, add_extra_argument)
+
+        _, loader_cls = self._get_batch_cli()
+        mycli = CLI(cli_name='exapp1', config_dir=self.mock_ctx.config.config_dir,
+                    commands_loader_cls=loader_cls, output_cls=MyOutputProducer)
+        self.assertIsInstance(mycli.__dict__.get('_output'), MyOutputProducer)
+        out_file = StringIO()
+        self.assertEqual(mycli.invoke(['abc', 'list', '--extra', '--output', 'tsv'], out_file=out_file), 0)
+        self.assertEqual(out_file.getvalue(), '1\n2\n')
+
+    def test_invoker_parts_can_be_set(self):
+        mycli, _ = self._get_batch_cli()
+        invoker = CommandInvoker(cli_ctx=mycli)
+        cli_help, parser, commands_loader = object(), object(), object()
+        invoker.help = cli_help
+        invoker.parser = parser
+        invoker.commands_loader = commands_loader
+        self.assertIs(invoker.help, cli_help)
+        self.assertIs(invoker.parser, parser)
+        self.assertIs(invoker.commands_loader, commands_loader)
+
+    def test_flight_recorder_dumped_on_failure(self):
+        import logging
+        from knack.log import CLI_LOGGER_NAME, get_logger
+        cli_logger = logging.getLogger(CLI_LOGGER_NAME)
+        self.addCleanup(setattr, cli_logger, 'handlers', list(cli_logger.handlers))
+        log_dir = os.path.join(self.mock_ctx.config.config_dir, 'logs')
+        with self.mock_ctx.config.transaction():
+            self.mock_ctx.config.set_value('logging', 'flight_recorder', 'yes')
+            self.mock_ctx.config.set_value('logging', 'log_dir', log_dir)
+        mycli = self._get_for_each_cli()
+        with mock.patch('sys.stderr', new_callable=StringIO):
+            self.assertEqual(mycli.invoke(['abc', 'greet', '--name', 'a'], out_file=StringIO()), 0)
+            self.assertFalse(os.path.exists(log_dir))
+            get_logger('a.module').debug('Record of the last invocation')
+            self.assertEqual(mycli.invoke(['abc', 'greet', '--name', 'fail'], out_file=StringIO()), 1)
+        dumps = os.listdir(log_dir)
+        self.assertEqual(len(dumps), 1)
+        self.assertTrue(dumps[0].startswith('exapp1_') and dumps[0].endswith('.debug.log'))
+        with open(os.path.join(log_dir, dumps[0])) as f:
+            lines = f.read().splitlines()
+        self.assertTrue(any(line.endswith(" : DEBUG : cli.knack.cli : Command arguments: "
+                                          "['abc', 'greet', '--name', 'fail']") for line in lines))
+        self.assertTrue(lines[-1].endswith(' : ERROR : cli.knack.cli : cannot greet'))
+        self.assertFalse([line for line in lines if 'Record of the last invocation' in line])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -7,6 +7,7 @@ import os
 import stat
 import unittest
 import tempfile
+from timeit import default_timer
 import mock
 from six.moves import configparser
 
@@ -153,5 +154,92 @@ class TestCLIConfig(unittest.TestCase):
         self.assertFalse(bool(file_mode & stat.S_IXOTH))
 
 
+    def test_get_after_env_changes(self):
+        self.cli_config.set_value('test_section', 'test_option', 'file_value')
+        self.assertEqual(self.cli_config.get('test_section', 'test_option'), 'file_value')
+        env_var = self.cli_config.env_var_name('test_section', 'test_option')
+        with mock.patch.dict('os.environ', {env_var: 'env_value'}):
+            self.assertEqual(self.cli_config.get('test_section', 'test_option'), 'env_value')
+        self.assertEqual(self.cli_config.get('test_section', 'test_option'), 'file_value')
+
+    def test_get_after_config_file_changes(self):
+        self.cli_config.set_value('test_section', 'test_option', 'a_value')
+        self.assertEqual(self.cli_config.get('test_section', 'test_option'), 'a_value')
+        # Another process changes the config file
+        other_config = CLIConfig(config_dir=self.cli_config.config_dir)
+        other_config.set_value('test_section', 'test_option', 'another_value')
+        os.utime(self.cli_config.config_path, (0, 0))
+        self.assertEqual(self.cli_config.get('test_section', 'test_option'), 'a_value')
+        # The file is checked again once FILE_CHECK_INTERVAL has passed
+        later = default_timer() + CLIConfig.FILE_CHECK_INTERVAL
+        with mock.patch('knack.config.default_timer', return_value=later):
+            self.assertEqual(self.cli_config.get('test_section', 'test_option'), 'another_value')
+
+    def test_get_after_config_file_changes_keeps_other_files(self):
+        other_path = os.path.join(self.cli_config.config_dir, 'other_config')
+        with open(other_path, 'w') as other_file:
+            other_file.write('[other_section]\nother_option = other_value\n')
+        self.cli_config.config_parser.read(other_path)
+        self.cli_config.set_value('test_section', 'test_option', 'a_value')
+        os.utime(self.cli_config.config_path, (0, 0))
+        later = default_timer() + CLIConfig.FILE_CHECK_INTERVAL
+        with mock.patch('knack.config.default_timer', return_value=later):
+            self.assertEqual(self.cli_config.get('test_section', 'test_option'), 'a_value')
+            self.assertEqual(self.cli_config.get('other_section', 'other_option'), 'other_value')
+
+    def test_typed_values_cached(self):
+        self.cli_config.set_value('test_section', 'test_option', 'yes')
+        with mock.patch.object(CLIConfig, '_to_boolean', wraps=CLIConfig._to_boolean) as to_boolean:
+            self.assertTrue(self.cli_config.getboolean('test_section', 'test_option'))
+            self.assertTrue(self.cli_config.getboolean('test_section', 'test_option'))
+        self.assertEqual(to_boolean.call_count, 1)
+        self.cli_config.config_parser.set('test_section', 'test_option', 'no')
+        self.assertFalse(self.cli_config.getboolean('test_section', 'test_option'))
+
+    def test_transaction_writes_once(self):
+        with mock.patch.object(CLIConfig, '_write', wraps=self.cli_config._write) as write:
+            with self.cli_config.transaction():
+                for i in range(40):
+                    self.cli_config.set_value('test_section', 'option_{}'.format(i), str(i))
+                self.assertFalse(os.path.exists(self.cli_config.config_path))
+        self.assertEqual(write.call_count, 1)
+        config = get_config_parser()
+        config.read(self.cli_config.config_path)
+        self.assertEqual(len(config.options('test_section')), 40)
+        self.assertEqual(self.cli_config.get('test_section', 'option_39'), '39')
+
+    def test_transaction_discarded_on_error(self):
+        self.cli_config.set_value('test_section', 'test_option', 'a_value')
+        with self.assertRaises(ValueError):
+            with self.cli_config.transaction():
+                self.cli_config.set_value('test_section', 'test_option', 'another_value')
+                self.cli_config.set_value('test_section', 'test_option_another', 'another_value')
+                raise ValueError()
+        config = get_config_parser()
+        config.read(self.cli_config.config_path)
+        self.assertEqual(config.items('test_section'), [('test_option', 'a_value')])
+        # The next transaction isn't affected
+        self.cli_config.set_value('test_section', 'test_option_another', 'another_value')
+        self.assertEqual(self.cli_config.get('test_section', 'test_option_another'), 'another_value')
+
+    def test_transaction_concurrent_writers(self):
+        import threading
+        # Each writer has its own CLIConfig as if it were another process
+        writers = [CLIConfig(config_dir=self.cli_config.config_dir) for _ in range(8)]
+
+        def _set_values(index, config):
+            for i in range(10):
+                config.set_value('test_section', 'option_{}_{}'.format(index, i), 'value')
+
+        threads = [threading.Thread(target=_set_values, args=(index, config)) for index, config in enumerate(writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        config = get_config_parser()
+        config.read(self.cli_config.config_path)
+        self.assertEqual(len(config.options('test_section')), 80)
+
+
 if __name__ == '__main__':
     unittest.main()
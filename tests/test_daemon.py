@@ -0,0 +1,130 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+from knack.daemon import CLIDaemon, invoke_with_daemon, is_daemon_supported
+from tests.util import MockContext
+
+DAEMON_APP = """
+import os
+import sys
+sys.path.insert(0, {root!r})
+
+from knack import CLI
+from knack.commands import CLICommandsLoader, CommandGroup
+from knack.daemon import CLIDaemon, invoke_with_daemon
+from knack.util import CLIError
+
+
+def hello_handler(name='world'):
+    return {{'hello': name, 'pid': os.getpid(), 'cwd': os.getcwd(), 'env': os.environ.get('DAEMON_TEST_VALUE')}}
+
+
+def fail_handler():
+    raise CLIError('it failed')
+
+
+class DaemonCommandsLoader(CLICommandsLoader):
+
+    def load_command_table(self, args):
+        with CommandGroup(self, 'abc', '__main__#{{}}') as g:
+            g.command('hello', 'hello_handler')
+            g.command('fail', 'fail_handler')
+        return super(DaemonCommandsLoader, self).load_command_table(args)
+
+
+def _in_process(args):
+    cli = CLI(cli_name='daemontest', config_dir={config_dir!r}, commands_loader_cls=DaemonCommandsLoader)
+    return cli.invoke(args)
+
+
+if __name__ == '__main__':
+    if sys.argv[1] == 'serve':
+        cli = CLI(cli_name='daemontest', config_dir={config_dir!r}, commands_loader_cls=DaemonCommandsLoader)
+        CLIDaemon(cli, socket_path={socket_path!r}).serve_forever()
+    else:
+        sys.exit(invoke_with_daemon({socket_path!r}, sys.argv[2:], _in_process))
+"""
+
+
+@unittest.skipUnless(is_daemon_supported(), 'Unix domain sockets with fd passing are required.')
+class TestDaemon(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.temp_dir, 'daemon.sock')
+        self.app_path = os.path.join(self.temp_dir, 'daemonapp.py')
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        with open(self.app_path, 'w') as f:
+            f.write(DAEMON_APP.format(root=root, config_dir=self.temp_dir, socket_path=self.socket_path))
+        self.server = None
+
+    def tearDown(self):
+        if self.server:
+            self.server.terminate()
+            self.server.wait()
+        shutil.rmtree(self.temp_dir)
+
+    def _start_server(self):
+        self.server = subprocess.Popen([sys.executable, self.app_path, 'serve'])
+        for _ in range(100):
+            if os.path.exists(self.socket_path):
+                return
+            time.sleep(0.05)
+        self.fail('The daemon did not start.')
+
+    def _run_client(self, *args, **kwargs):
+        env = dict(os.environ, DAEMON_TEST_VALUE='from-client')
+        proc = subprocess.Popen([sys.executable, self.app_path, 'client'] + list(args),
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, cwd=kwargs.get('cwd'))
+        stdout, stderr = proc.communicate()
+        return proc.returncode, stdout.decode('utf-8'), stderr.decode('utf-8')
+
+    def test_daemon_serves_invocations(self):
+        self._start_server()
+        exit_code, stdout, _ = self._run_client('abc', 'hello', '--name', 'daemon', cwd=self.temp_dir)
+        self.assertEqual(exit_code, 0)
+        self.assertIn('"hello": "daemon"', stdout)
+        self.assertIn('"pid": {}'.format(self.server.pid), stdout)
+        self.assertIn('"env": "from-client"', stdout)
+        self.assertIn('"cwd": "{}"'.format(os.path.realpath(self.temp_dir)), stdout)
+
+        exit_code, stdout, stderr = self._run_client('abc', 'fail')
+        self.assertEqual(exit_code, 1)
+        self.assertEqual(stdout, '')
+        self.assertIn('it failed', stderr)
+
+        exit_code, stdout, _ = self._run_client('abc', 'hello')
+        self.assertEqual(exit_code, 0)
+        self.assertIn('"hello": "world"', stdout)
+
+    def test_client_falls_back_in_process(self):
+        exit_code, stdout, _ = self._run_client('abc', 'hello')
+        self.assertEqual(exit_code, 0)
+        self.assertIn('"hello": "world"', stdout)
+        self.assertIn('"pid": ', stdout)
+        self.assertNotIn('"pid": {}'.format(os.getpid()), stdout)
+
+    def test_fallback_called_without_daemon(self):
+        calls = []
+        exit_code = invoke_with_daemon(self.socket_path, ['abc'], lambda args: calls.append(args) or 3)
+        self.assertEqual(exit_code, 3)
+        self.assertEqual(calls, [['abc']])
+
+    def test_default_socket_path(self):
+        mock_ctx = MockContext()
+        daemon = CLIDaemon(cli_ctx=mock_ctx)
+        self.assertEqual(daemon.socket_path, os.path.join(mock_ctx.config.config_dir, 'daemon.sock'))
+
+
+if __name__ == '__main__':
+    unittest.main()
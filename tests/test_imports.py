@@ -0,0 +1,66 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+import os
+import sys
+import json
+import subprocess
+import unittest
+
+# Third-party modules that should only be imported on the code paths that use them
+DEFERRED_MODULES = ('argcomplete', 'colorama', 'jmespath', 'pygments', 'yaml', 'tabulate', 'wcwidth')
+
+# Run in a new interpreter as other tests import these modules
+IMPORTS_SCRIPT = """
+import sys
+import json
+import tempfile
+from collections import OrderedDict
+import knack
+modules_after_import = list(sys.modules)
+
+from six import StringIO
+from knack import CLI, CLICommandsLoader, CLICommand
+
+
+class CommandsLoader(CLICommandsLoader):
+    def load_command_table(self, args):
+        self.command_table['abc'] = CLICommand(self.cli_ctx, 'abc', lambda _: {'a': 1})
+        return OrderedDict(self.command_table)
+
+
+cli = CLI(cli_name='exapp', config_dir=tempfile.mkdtemp(), commands_loader_cls=CommandsLoader, out_file=StringIO())
+exit_code = cli.invoke(['abc'])
+print(json.dumps({'import': modules_after_import, 'invoke': list(sys.modules), 'exit_code': exit_code}))
+"""
+
+
+def _top_level(modules):
+    return set(module.split('.')[0] for module in modules)
+
+
+class TestImports(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([root_dir, os.environ.get('PYTHONPATH', '')]))
+        env.pop('_ARGCOMPLETE', None)
+        output = subprocess.check_output([sys.executable, '-c', IMPORTS_SCRIPT], env=env, cwd=root_dir)
+        cls.modules = json.loads(output.decode('utf-8'))
+
+    def test_import_knack_defers_third_party_modules(self):
+        loaded = _top_level(self.modules['import'])
+        self.assertFalse(loaded.intersection(DEFERRED_MODULES), loaded.intersection(DEFERRED_MODULES))
+        self.assertNotIn('logging.handlers', self.modules['import'])
+
+    def test_invoke_defers_third_party_modules(self):
+        self.assertEqual(self.modules['exit_code'], 0)
+        loaded = _top_level(self.modules['invoke'])
+        self.assertFalse(loaded.intersection(DEFERRED_MODULES), loaded.intersection(DEFERRED_MODULES))
+
+
+if __name__ == '__main__':
+    unittest.main()
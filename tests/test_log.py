@@ -3,13 +3,17 @@
 # Licensed under the MIT License. See License.txt in the project root for license information.
 # --------------------------------------------------------------------------------------------
 
+import os
+import json
+import shutil
+import tempfile
 import unittest
 import mock
 import logging
 import colorama
 
 from knack.events import EVENT_PARSER_GLOBAL_CREATE, EVENT_INVOKER_PRE_CMD_TBL_CREATE
-from knack.log import CLILogging, get_logger, CLI_LOGGER_NAME, _CustomStreamHandler
+from knack.log import CLILogging, get_logger, CLI_LOGGER_NAME, _CustomStreamHandler, _get_rotating_file_handler_cls
 from tests.util import MockContext
 
 
@@ -99,5 +103,142 @@ class TestCustomStreamHandler(unittest.TestCase):
             self.assertTrue(message.endswith(colorama.Style.RESET_ALL))
 
 
+class TestFileLogging(unittest.TestCase):
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.log_dir, True)
+
+    def _restore_handlers(self, *loggers):
+        for logger in loggers:
+            self.addCleanup(setattr, logger, 'handlers', list(logger.handlers))
+            self.addCleanup(setattr, logger, 'propagate', logger.propagate)
+            logger.handlers = []
+
+    def test_file_log_written_in_background(self):
+        root_logger = logging.getLogger()
+        cli_logger = logging.getLogger(CLI_LOGGER_NAME)
+        self._restore_handlers(root_logger, cli_logger)
+        self.addCleanup(CLILogging._end_file_log)  # pylint: disable=protected-access
+        mock_ctx = MockContext()
+        mock_ctx.config.set_value('logging', 'enable_log_file', 'yes')
+        mock_ctx.config.set_value('logging', 'log_dir', self.log_dir)
+        cli_logging = CLILogging('clitest', cli_ctx=mock_ctx)
+        cli_logging.configure([])
+        get_logger('a.module').debug('Message %d', 1)
+        CLILogging.flush_file_log()
+        with open(os.path.join(self.log_dir, 'clitest.log')) as f:
+            lines = f.read().splitlines()
+        self.assertTrue(lines[-1].endswith(' : DEBUG : cli.a.module : Message 1'))
+        self.assertTrue(lines[-1].startswith('{} : '.format(os.getpid())))
+
+    def test_file_log_end_registered_once(self):
+        root_logger = logging.getLogger()
+        cli_logger = logging.getLogger(CLI_LOGGER_NAME)
+        self._restore_handlers(root_logger, cli_logger)
+        self.addCleanup(CLILogging._end_file_log)  # pylint: disable=protected-access
+        mock_ctx = MockContext()
+        with mock_ctx.config.transaction():
+            mock_ctx.config.set_value('logging', 'enable_log_file', 'yes')
+            mock_ctx.config.set_value('logging', 'log_dir', self.log_dir)
+        cli_logging = CLILogging('clitest', cli_ctx=mock_ctx)
+        with mock.patch.object(CLILogging, '_end_file_log_registered', False), \
+                mock.patch('atexit.register') as register:
+            cli_logging.configure([])
+            # Set up the handlers again, as for a CLI whose loggers were reset
+            root_logger.handlers = []
+            cli_logger.handlers = []
+            cli_logging.configure([])
+        self.assertEqual(register.call_count, 1)
+
+    def test_json_file_log(self):
+        root_logger = logging.getLogger()
+        cli_logger = logging.getLogger(CLI_LOGGER_NAME)
+        self._restore_handlers(root_logger, cli_logger)
+        self.addCleanup(CLILogging._end_file_log)  # pylint: disable=protected-access
+        mock_ctx = MockContext()
+        with mock_ctx.config.transaction():
+            mock_ctx.config.set_value('logging', 'enable_log_file', 'yes')
+            mock_ctx.config.set_value('logging', 'log_dir', self.log_dir)
+            mock_ctx.config.set_value('logging', 'log_file_format', 'json')
+        cli_logging = CLILogging('clitest', cli_ctx=mock_ctx)
+        cli_logging.configure([])
+        get_logger('a.module').debug('Before the command is known')
+        mock_ctx.invocation = mock.Mock(data={'command': 'group cmd'})
+        get_logger('a.module').warning('Message %d', 1)
+        CLILogging.flush_file_log()
+        with open(os.path.join(self.log_dir, 'clitest.log')) as f:
+            entries = [json.loads(line) for line in f.read().splitlines()]
+        self.assertEqual(entries[-2]['command'], None)
+        entry = entries[-1]
+        self.assertEqual(entry['message'], 'Message 1')
+        self.assertEqual(entry['level'], 'WARNING')
+        self.assertEqual(entry['logger'], 'cli.a.module')
+        self.assertEqual(entry['process'], os.getpid())
+        self.assertEqual(entry['command'], 'group cmd')
+        self.assertEqual(entry['invocation_id'], cli_logging.invocation_id)
+        self.assertGreaterEqual(entry['elapsed'], 0)
+        self.assertTrue(entry['time'].endswith('Z'))
+        # The next invocation gets a new ID and doesn't know its command until it has an invocation
+        cli_logging.configure([])
+        get_logger('a.module').debug('Next invocation')
+        CLILogging.flush_file_log()
+        with open(os.path.join(self.log_dir, 'clitest.log')) as f:
+            entry = json.loads(f.read().splitlines()[-1])
+        self.assertNotEqual(entry['invocation_id'], entries[-1]['invocation_id'])
+        self.assertEqual(entry['command'], None)
+
+    def _log_exception(self, log_file_format):
+        root_logger = logging.getLogger()
+        cli_logger = logging.getLogger(CLI_LOGGER_NAME)
+        self._restore_handlers(root_logger, cli_logger)
+        self.addCleanup(CLILogging._end_file_log)  # pylint: disable=protected-access
+        mock_ctx = MockContext()
+        with mock_ctx.config.transaction():
+            mock_ctx.config.set_value('logging', 'enable_log_file', 'yes')
+            mock_ctx.config.set_value('logging', 'log_dir', self.log_dir)
+            mock_ctx.config.set_value('logging', 'log_file_format', log_file_format)
+        cli_logging = CLILogging('clitest', cli_ctx=mock_ctx)
+        cli_logging.configure([])
+        try:
+            raise ValueError('bad value')
+        except ValueError:
+            get_logger('a.module').exception('Failed %s', 'here')
+        CLILogging.flush_file_log()
+        with open(os.path.join(self.log_dir, 'clitest.log')) as f:
+            return f.read()
+
+    def test_file_log_exception(self):
+        content = self._log_exception('text')
+        self.assertIn(' : cli.a.module : Failed here\nTraceback', content)
+        self.assertTrue(content.endswith('ValueError: bad value\n'))
+
+    def test_json_file_log_exception(self):
+        entry = json.loads(self._log_exception('json').splitlines()[-1])
+        self.assertEqual(entry['message'], 'Failed here')
+        self.assertTrue(entry['exception'].startswith('Traceback'))
+        self.assertTrue(entry['exception'].endswith('ValueError: bad value'))
+
+    def test_shared_log_file_rotation(self):
+        log_file_path = os.path.join(self.log_dir, 'clitest.log')
+        # Each handler stands for another process writing to the same log file
+        handlers = [_get_rotating_file_handler_cls()(log_file_path, maxBytes=1000, backupCount=100)
+                    for _ in range(3)]
+        record_count = 300
+        for index in range(record_count):
+            record = logging.LogRecord('cli', logging.DEBUG, __file__, 0, 'Record %03d', (index,), None)
+            handlers[index % len(handlers)].handle(record)
+        for handler in handlers:
+            handler.close()
+        records = []
+        for name in os.listdir(self.log_dir):
+            if name.startswith('clitest.log') and not name.endswith('.lock'):
+                with open(os.path.join(self.log_dir, name)) as f:
+                    lines = f.read().splitlines()
+                # A file is rotated once it reached maxBytes, so only its last record may go over
+                self.assertLess(sum(len(line) + 1 for line in lines[:-1]), 1000)
+                records.extend(lines)
+        self.assertEqual(sorted(records), ['Record {:03d}'.format(index) for index in range(record_count)])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,183 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+import os
+import json
+import unittest
+from six import StringIO
+
+from knack.commands import CLICommandsLoader, CommandGroup
+from knack.manifest import CommandManifest
+from tests.util import MockContext
+
+
+def list_handler():
+    return ['a', 'b']
+
+
+def show_handler(name):
+    return {'name': name}
+
+
+def upper_transformer(result):
+    return [x.upper() for x in result]
+
+
+class ManifestCommandsLoader(CLICommandsLoader):
+
+    registrations = 0
+
+    def __init__(self, cli_ctx=None):
+        super(ManifestCommandsLoader, self).__init__(cli_ctx=cli_ctx, use_command_manifest=True)
+
+    def register_commands(self):
+        ManifestCommandsLoader.registrations += 1
+        with CommandGroup(self, 'abc', '{}#{{}}'.format(__name__)) as g:
+            g.command('list', 'list_handler', table_transformer=upper_transformer)
+            g.command('show', 'show_handler')
+        with CommandGroup(self, 'xyz', '{}#{{}}'.format(__name__)) as g:
+            g.command('list', 'list_handler')
+
+
+class MyCommandGroup(CommandGroup):
+
+    def __init__(self, command_loader, group_name, **kwargs):
+        super(MyCommandGroup, self).__init__(command_loader, group_name, 'json#{}', **kwargs)
+
+
+class OverriddenCommandsLoader(ManifestCommandsLoader):
+
+    def load_command_table(self, args):
+        self.register_commands()
+        return super(OverriddenCommandsLoader, self)._get_loaded_command_table()
+
+
+class TestCommandManifest(unittest.TestCase):
+
+    def setUp(self):
+        ManifestCommandsLoader.registrations = 0
+        self.mock_ctx = MockContext()
+        self.mock_ctx.commands_loader_cls = ManifestCommandsLoader
+        self.manifest_path = os.path.join(self.mock_ctx.config.config_dir, 'command_manifest.json')
+
+    def _invoke(self, args):
+        out = StringIO()
+        exit_code = self.mock_ctx.invoke(args, out_file=out)
+        return exit_code, out.getvalue()
+
+    def test_manifest_saved_after_full_load(self):
+        exit_code, _ = self._invoke(['abc', 'list'])
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(ManifestCommandsLoader.registrations, 1)
+        with open(self.manifest_path) as f:
+            stored = json.load(f)
+        self.assertEqual(list(stored['commands']), ['abc list', 'abc show', 'xyz list'])
+        self.assertEqual(stored['commands']['abc list']['kwargs']['table_transformer'],
+                         {'__ref__': '{}#upper_transformer'.format(__name__)})
+
+    def test_manifest_materializes_matching_commands(self):
+        self._invoke(['abc', 'list'])
+        exit_code, output = self._invoke(['abc', 'show', '--name', 'foo'])
+        self.assertEqual(exit_code, 0)
+        self.assertIn('"name": "foo"', output)
+        # The registrations were skipped and only the commands for the argv prefix were created
+        self.assertEqual(ManifestCommandsLoader.registrations, 1)
+        self.assertEqual(sorted(self.mock_ctx.invocation.commands_loader.command_table), ['abc show'])
+
+        self._invoke(['-o', 'table', 'abc', 'list'])
+        self.assertEqual(ManifestCommandsLoader.registrations, 2)
+        exit_code, output = self._invoke(['abc', 'list', '-o', 'table'])
+        self.assertEqual(exit_code, 0)
+        self.assertIn('A', output)
+        self.assertEqual(ManifestCommandsLoader.registrations, 2)
+
+    def test_manifest_group_prefix(self):
+        self._invoke(['abc', 'list'])
+        manifest = CommandManifest(cli_ctx=self.mock_ctx)
+        loader = CLICommandsLoader(cli_ctx=self.mock_ctx)
+        self.assertEqual(manifest.materialize(loader, 'abc'), ['abc list', 'abc show'])
+        loader.command_table.clear()
+        self.assertEqual(manifest.materialize(loader, 'xyz list extra'), ['xyz list'])
+        loader.command_table.clear()
+        self.assertIsNone(manifest.materialize(loader, 'unknown list'))
+
+    def test_manifest_invalidated_by_version(self):
+        self._invoke(['abc', 'list'])
+        self.mock_ctx.get_cli_version = lambda: '2.0.0'
+        self.assertIsNone(CommandManifest(cli_ctx=self.mock_ctx).load())
+        self._invoke(['abc', 'list'])
+        self.assertEqual(ManifestCommandsLoader.registrations, 2)
+        self.assertIsNotNone(CommandManifest(cli_ctx=self.mock_ctx).load())
+
+    def test_manifest_invalidated_by_module_mtime(self):
+        self._invoke(['abc', 'list'])
+        with open(self.manifest_path) as f:
+            stored = json.load(f)
+        stored['modules'][__name__][1] -= 10
+        with open(self.manifest_path, 'w') as f:
+            json.dump(stored, f)
+        self.assertIsNone(CommandManifest(cli_ctx=self.mock_ctx).load())
+
+    def test_manifest_not_saved_with_unserializable_kwargs(self):
+        cl = ManifestCommandsLoader(cli_ctx=self.mock_ctx)
+        with CommandGroup(cl, 'abc', '{}#{{}}'.format(__name__)) as g:
+            g.command('list', 'list_handler', table_transformer=lambda r: r)
+        cl.command_manifest.save(cl.command_table)
+        self.assertFalse(os.path.exists(self.manifest_path))
+
+    def test_manifest_not_used_with_overridden_load_command_table(self):
+        self.mock_ctx.commands_loader_cls = OverriddenCommandsLoader
+        self.assertEqual(self._invoke(['abc', 'list'])[0], 0)
+        self.assertEqual(self._invoke(['abc', 'list'])[0], 0)
+        self.assertEqual(ManifestCommandsLoader.registrations, 2)
+        self.assertFalse(os.path.exists(self.manifest_path))
+
+    def test_manifest_records_handler_module(self):
+        import json as json_module
+        cl = ManifestCommandsLoader(cli_ctx=self.mock_ctx)
+        with MyCommandGroup(cl, 'json') as g:
+            g.command('dumps', 'dumps')
+        cl.command_manifest.save(cl.command_table)
+        with open(self.manifest_path) as f:
+            stored = json.load(f)
+        self.assertEqual(stored['commands']['json dumps']['module'], 'json')
+        self.assertEqual(stored['modules']['json'][0], json_module.__file__)
+
+    def test_manifest_invalidated_by_registering_module_mtime(self):
+        import sys
+        import shutil
+        import tempfile
+        module_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, module_dir, True)
+        with open(os.path.join(module_dir, 'manifest_helper_commands.py'), 'w') as f:
+            f.write('from knack.commands import CommandGroup\n\n\n'
+                    'def register(loader):\n'
+                    '    with CommandGroup(loader, "helper", "tests.test_manifest#{}") as g:\n'
+                    '        g.command("list", "list_handler")\n')
+        sys.path.insert(0, module_dir)
+        self.addCleanup(sys.path.remove, module_dir)
+        self.addCleanup(sys.modules.pop, 'manifest_helper_commands', None)
+
+        class HelperCommandsLoader(ManifestCommandsLoader):
+            def register_commands(self):
+                import manifest_helper_commands
+                manifest_helper_commands.register(self)
+
+        self.mock_ctx.commands_loader_cls = HelperCommandsLoader
+        self.assertEqual(self._invoke(['helper', 'list'])[0], 0)
+        with open(self.manifest_path) as f:
+            stored = json.load(f)
+        self.assertEqual(stored['modules']['manifest_helper_commands'][0],
+                         os.path.join(module_dir, 'manifest_helper_commands.py'))
+        self.assertIsNotNone(CommandManifest(cli_ctx=self.mock_ctx).load())
+        # Changing the helper that registers the commands makes the manifest out of date
+        stored['modules']['manifest_helper_commands'][1] -= 10
+        with open(self.manifest_path, 'w') as f:
+            json.dump(stored, f)
+        self.assertIsNone(CommandManifest(cli_ctx=self.mock_ctx).load())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,11 +5,17 @@
 
 from __future__ import print_function
 
+import io
+import json
+import re
+import sys
 import unittest
+import mock
 from collections import OrderedDict
 from six import StringIO
 
-from knack.output import OutputProducer, format_json, format_table, format_tsv
+from knack.output import (OutputProducer, format_json, format_json_color, format_jsonl, format_table, format_tsv,
+                          iter_format_json, _TableOutput)
 from knack.util import CommandResultItem, normalize_newlines
 from tests.util import MockContext
 
@@ -76,6 +82,104 @@ class TestOutput(unittest.TestCase):
 }
 """))
 
+    def test_out_json_in_chunks(self):
+        obj = {'items': [{'name': 'item{}'.format(i), 'tags': {'a': i}} for i in range(5000)]}
+        chunks = list(iter_format_json(CommandResultItem(obj)))
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(len(chunk) < 2 * 64 * 1024 for chunk in chunks))
+        self.assertEqual(''.join(chunks), json.dumps(obj, indent=2, sort_keys=True, separators=(',', ': ')) + '\n')
+
+    def test_out_json_error_before_output(self):
+        output_producer = OutputProducer(cli_ctx=self.mock_ctx)
+        with self.assertRaises(TypeError):
+            output_producer.out(CommandResultItem({'a': 1, 'b': object()}), formatter=format_json,
+                                out_file=self.io)
+        self.assertEqual(self.io.getvalue(), '')
+        with self.assertRaises(TypeError):
+            format_json(CommandResultItem([object()]))
+
+    def test_out_json_through_binary_buffer(self):
+        output_producer = OutputProducer(cli_ctx=self.mock_ctx)
+        for encoding, expected in [('utf-8', u'caf\xe9\n'.encode('utf-8')), ('ascii', b'caf\n')]:
+            buffer = io.BytesIO()
+            out_file = io.TextIOWrapper(buffer, encoding=encoding)
+            with mock.patch.object(buffer, 'flush', wraps=buffer.flush) as mock_flush:
+                output_producer.out(CommandResultItem(iter([u'caf\xe9'])), formatter=format_tsv, out_file=out_file)
+            self.assertEqual(buffer.getvalue(), expected)
+            self.assertTrue(mock_flush.called)
+
+    def test_out_json_backends_same_output(self):
+        from knack.output import _OrjsonJSONBackend, _StdlibJSONBackend
+        if not _OrjsonJSONBackend.is_available():
+            self.skipTest('orjson is not installed')
+        values = [None, True, False, 0, -1, 2 ** 63 - 1, 2 ** 64, 0.0, 1.5, -0.1, 1e-4, 1e15, u'caf\xe9',
+                  u'\U0001f600', u'\x7f\x1f\t"\\/', u'\u2028', b'bytes', [], {}, [[]], {'a': {}},
+                  OrderedDict([('b', 1), ('a', 2)]), (1, 2), {1: 'int key'}]
+        objs = values + [values, {'key{}'.format(i): v for i, v in enumerate(values)}]
+        orjson_backend, stdlib_backend = _OrjsonJSONBackend(), _StdlibJSONBackend()
+        for obj in objs:
+            expected = json.dumps(obj, indent=2, sort_keys=True, separators=(',', ': '),
+                                  default=lambda o: o.decode())
+            self.assertEqual(orjson_backend.dumps(obj), expected)
+            self.assertEqual(''.join(orjson_backend.iter_encode(obj)), expected)
+            self.assertEqual(''.join(stdlib_backend.iter_encode(obj)), expected)
+
+    def test_out_json_orjson_floats(self):
+        from knack.output import _OrjsonJSONBackend
+        if not _OrjsonJSONBackend.is_available():
+            self.skipTest('orjson is not installed')
+        orjson_backend = _OrjsonJSONBackend()
+        # Written in another form than json writes them, but with the same value
+        for value in [9e-5, 1e-7, 1e16, 1e100]:
+            self.assertNotEqual(orjson_backend.dumps(value), json.dumps(value))
+            self.assertEqual(json.loads(orjson_backend.dumps([value])), [value])
+        for value in [float('nan'), float('inf'), float('-inf')]:
+            self.assertEqual(orjson_backend.dumps(value), 'null')
+
+    def test_out_json_backends_same_errors(self):
+        import datetime
+        from knack.output import _OrjsonJSONBackend, _StdlibJSONBackend
+        if not _OrjsonJSONBackend.is_available():
+            self.skipTest('orjson is not installed')
+        orjson_backend, stdlib_backend = _OrjsonJSONBackend(), _StdlibJSONBackend()
+        # orjson can encode these but json can't, so both backends have to reject them
+        for value in [datetime.datetime(2020, 1, 1), datetime.date(2020, 1, 1), object()]:
+            for obj in [value, [value], {'key': value}]:
+                with self.assertRaises(TypeError):
+                    stdlib_backend.dumps(obj)
+                with self.assertRaises(TypeError):
+                    orjson_backend.dumps(obj)
+                with self.assertRaises(TypeError):
+                    ''.join(orjson_backend.iter_encode(obj))
+
+    def test_out_json_color(self):
+        obj = OrderedDict([('name', u'caf\xe9'), ('count', 2), ('tags', [None, True, 1.5, b'x']), ('empty', {})])
+        output = ''.join(format_json_color(CommandResultItem(obj)))
+        self.assertEqual(output, '{\n'
+                                 '  \x1b[94m"count"\x1b[0m: \x1b[34m2\x1b[0m,\n'
+                                 '  \x1b[94m"empty"\x1b[0m: {},\n'
+                                 '  \x1b[94m"name"\x1b[0m: \x1b[33m"caf\\u00e9"\x1b[0m,\n'
+                                 '  \x1b[94m"tags"\x1b[0m: [\n'
+                                 '    \x1b[34mnull\x1b[0m,\n'
+                                 '    \x1b[34mtrue\x1b[0m,\n'
+                                 '    \x1b[34m1.5\x1b[0m,\n'
+                                 '    \x1b[33m"x"\x1b[0m\n'
+                                 '  ]\n'
+                                 '}\n')
+
+    def test_out_json_color_same_as_json(self):
+        from knack.output import _StdlibJSONBackend
+        values = [None, False, 2 ** 70, -0.5, 1e20, float('nan'), float('-inf'), u'\U0001f600', u'a\n"b"', [], {},
+                  [[]], (1, 2), {1: 'int key', 2.5: 'float key'}, {None: 'none key'}]
+        # Floats are written like the json module writes them, which orjson doesn't do
+        with mock.patch.dict(sys.modules, {'pygments': None}), \
+                mock.patch('knack.output._json_backend', _StdlibJSONBackend()):
+            for obj in values + [values, {'key{}'.format(i): v for i, v in enumerate(values)}]:
+                for make_result in (lambda: obj, lambda: iter([obj, obj])):
+                    expected = ''.join(format_json(CommandResultItem(make_result())))
+                    output = ''.join(format_json_color(CommandResultItem(make_result())))
+                    self.assertEqual(re.sub('\x1b\\[[0-9;]*m', '', output), expected)
+
     # TABLE output tests
 
     def test_out_table(self):
@@ -159,6 +263,71 @@ qwerty  0b1f6472qwerty  True      0b1f6472
 qwerty  0b1f6472qwerty  True
 """))
 
+    def test_out_table_numeric_alignment(self):
+        output_producer = OutputProducer(cli_ctx=self.mock_ctx)
+        obj = [OrderedDict([('name', 'a'), ('count', 10), ('size', 1.5), ('ok', True)]),
+               OrderedDict([('name', '12'), ('count', '2'), ('size', '10'), ('ok', False)]),
+               OrderedDict([('name', 'bbbbbbbbb'), ('size', 0.125), ('id', 'skipped')])]
+        output_producer.out(CommandResultItem(obj, is_query_active=True), formatter=format_table, out_file=self.io)
+        self.assertEqual(normalize_newlines(self.io.getvalue()), normalize_newlines(
+            """Name         Count    Size  Ok
+---------  -------  ------  ----
+a               10   1.5    True
+12               2  10
+bbbbbbbbb            0.125
+"""))
+
+    def test_out_table_max_rows(self):
+        output_producer = OutputProducer(cli_ctx=self.mock_ctx)
+        obj = [{'name': 'n{}'.format(i)} for i in range(5)]
+        with mock.patch('knack.output.logger') as mock_logger:
+            output_producer.out(CommandResultItem(iter(obj), max_rows=2), formatter=format_table, out_file=self.io)
+        self.assertEqual(self.io.getvalue(), 'Name\n------\nn0\nn1\n')
+        mock_logger.warning.assert_called_once_with(mock.ANY, 2)
+
+    def test_out_table_empty_object(self):
+        output_producer = OutputProducer(cli_ctx=self.mock_ctx)
+        output_producer.out(CommandResultItem({}), formatter=format_table, out_file=self.io)
+        self.assertEqual(self.io.getvalue(), '\n')
+        self.assertEqual(format_table(CommandResultItem([{'sub': {'a': 1}}, {'sub': {'a': 2}}])), '\n')
+        self.assertEqual(format_table(CommandResultItem([{'a': False}, {'a': False}])), '\n')
+
+    def test_out_table_same_as_tabulate(self):
+        try:
+            from tabulate import tabulate
+        except ImportError:
+            self.skipTest('tabulate is not installed')
+        results = [
+            [{'a': 787.0146635603288, 'b': 'x'}, {'a': 'abc', 'b': 1}],
+            [{'a': 787.0146635603288}, {'a': 2}, {'a': '3.25'}],
+            [{'name': 'a', 'count': 10, 'size': 1.5, 'ok': True}, {'name': '12', 'count': '2', 'size': '10'},
+             {'name': 'bbbbbbbbb', 'size': 0.125, 'ok': False}],
+            [{'value': 1e-07}, {'value': 123456789.123}, {'value': 'n/a'}],
+            [{'value': '1,234.5'}, {'value': 10}],
+            [['a', 1], ['bb', 2.5]],
+            ['text', 'more text'],
+        ]
+        for result in results:
+            table = _TableOutput(should_sort_keys=True)
+            expected = tabulate(table._auto_table(result), headers='keys', tablefmt='simple') + '\n'
+            self.assertEqual(format_table(CommandResultItem(result)), expected)
+
+    def test_out_table_wide_characters_same_as_tabulate(self):
+        try:
+            from tabulate import tabulate
+            import wcwidth  # pylint: disable=unused-variable
+        except ImportError:
+            self.skipTest('tabulate or wcwidth is not installed')
+        results = [
+            [{'name': u'\u65e5\u672c', 'count': 1}, {'name': 'abc', 'count': 22}],
+            [{u'\u540d\u524d': u'\ud55c\uad6d\uc5b4', 'size': 1.5}, {u'\u540d\u524d': 'x', 'size': u'\u4e2d'}],
+            [{'a': u'caf\xe9', 'b': u'\uff76\uff80\uff76\uff85'}, {'a': u'\u4e2d\u6587abc', 'b': 'plain'}],
+        ]
+        for result in results:
+            table = _TableOutput(should_sort_keys=True)
+            expected = tabulate(table._auto_table(result), headers='keys', tablefmt='simple') + '\n'
+            self.assertEqual(format_table(CommandResultItem(result)), expected)
+
     # TSV output tests
     def test_output_format_dict(self):
         obj = {}
@@ -192,6 +361,59 @@ qwerty  0b1f6472qwerty  True
         result = format_tsv(CommandResultItem([obj1, obj2]))
         self.assertEqual(result, '1\t2\n3\t4\n')
 
+    # JSONL output tests
+
+    def test_out_jsonl_list(self):
+        output_producer = OutputProducer(cli_ctx=self.mock_ctx)
+        output_producer.out(CommandResultItem([OrderedDict([('b', 1), ('a', [1, 2])]), {'c': b'bytes'}, 'text']),
+                            formatter=format_jsonl, out_file=self.io)
+        self.assertEqual(self.io.getvalue(), '{"b":1,"a":[1,2]}\n{"c":"bytes"}\n"text"\n')
+
+    def test_out_jsonl_single_object(self):
+        output_producer = OutputProducer(cli_ctx=self.mock_ctx)
+        output_producer.out(CommandResultItem({'active': True}), formatter=format_jsonl, out_file=self.io)
+        self.assertEqual(self.io.getvalue(), '{"active":true}\n')
+
+    # STREAMED RESULTS
+
+    def _out_stream(self, items, formatter, **kwargs):
+        output_producer = OutputProducer(cli_ctx=self.mock_ctx)
+        output_producer.out(CommandResultItem(iter(items), **kwargs), formatter=formatter, out_file=self.io)
+        return self.io.getvalue()
+
+    def test_out_stream_same_as_list(self):
+        items = [{'name': 'n{}'.format(i), 'count': i, 'tags': {'a': 'b'}} for i in range(5)]
+        for formatter in (format_json, format_jsonl, format_tsv, format_table):
+            expected = formatter(CommandResultItem(items))
+            self.assertEqual(self._out_stream(items, formatter), ''.join(expected))
+            self.io.truncate(0)
+            self.io.seek(0)
+        self.assertEqual(self._out_stream([], format_json), '[]\n')
+
+    def test_out_stream_is_lazy(self):
+        written = []
+
+        def _items():
+            for i in range(3):
+                # Everything before this item has been written already
+                written.append(self.io.getvalue())
+                yield {'value': i}
+        self._out_stream(_items(), format_tsv)
+        self.assertEqual(written, ['', '0\n', '0\n1\n'])
+
+    def test_out_table_stream_window(self):
+        items = [{'name': 'n{}'.format(i), 'count': i} for i in range(1, 204)]
+        items.append({'name': 'a-name-longer-than-the-window', 'count': 10000})
+        lines = self._out_stream(items, format_table).splitlines()
+        self.assertEqual(lines[:3], ['  Count  Name', '-------  ------', '      1  n1'])
+        self.assertEqual(lines[-1], '  10000  a-name-longer-than-the-window')
+        self.assertEqual(len(lines), 206)
+
+    def test_out_table_stream_with_transformer(self):
+        items = [{'name': 'n{}'.format(i)} for i in range(3)]
+        result = self._out_stream(items, format_table, table_transformer=lambda r: [{'Id': len(r)}])
+        self.assertEqual(result, '  Id\n----\n   3\n')
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -3,7 +3,9 @@
 # Licensed under the MIT License. See License.txt in the project root for license information.
 # --------------------------------------------------------------------------------------------
 
+import argparse
 import unittest
+import mock
 from six import StringIO
 
 from knack.parser import CLICommandParser
@@ -61,6 +63,20 @@ class TestParser(unittest.TestCase):
         parser.parse_args('test command'.split())
         self.assertTrue(CLICommandParser.error.called)
 
+    def test_required_parameter_not_required(self):
+        def test_handler(args):  # pylint: disable=unused-argument
+            pass
+
+        command = CLICommand(self.mock_ctx, 'test command', test_handler)
+        command.add_argument('req', '--req', required=True)
+        cmd_table = {'test command': command}
+
+        for lazy_subparsers in [False, True]:
+            parser = CLICommandParser(lazy_subparsers=lazy_subparsers, require_arguments=False)
+            parser.load_command_table(cmd_table)
+            args = parser.parse_args('test command'.split())
+            self.assertIsNone(args.req)
+
     def test_nargs_parameter(self):
         def test_handler():
             pass
@@ -127,6 +143,47 @@ class TestParser(unittest.TestCase):
         parser = CLICommandParser()
         parser.load_command_table(cmd_table)
 
+    def test_lazy_subparsers_only_created_on_path(self):
+        def test_handler():
+            pass
+
+        cmd_table = {}
+        for group in ['group1', 'group2']:
+            for verb in ['create', 'delete']:
+                name = '{} sub {}'.format(group, verb)
+                cmd_table[name] = CLICommand(self.mock_ctx, name, test_handler)
+                cmd_table[name].add_argument('name', '--name')
+
+        parser = CLICommandParser(lazy_subparsers=True)
+        parser.load_command_table(cmd_table)
+        self.assertEqual(list(parser.subparsers), [()])
+
+        args = parser.parse_args('group1 sub delete --name foo'.split())
+        self.assertIs(args.func, cmd_table['group1 sub delete'])
+        self.assertEqual(args.name, 'foo')
+        self.assertEqual(sorted(parser.subparsers), [(), ('group1',), ('group1', 'sub')])
+        group_choices = parser.subparsers[('group1', 'sub')].choices
+        self.assertEqual(sorted(group_choices), ['create', 'delete'])
+        # Only the parser of the command that was reached has been created
+        self.assertNotIsInstance(dict.get(group_choices, 'create'), CLICommandParser)
+        self.assertIsInstance(dict.get(group_choices, 'delete'), CLICommandParser)
+        self.assertTrue(group_choices['delete'].prog.endswith(' group1 sub delete'))
+
+        args = parser.parse_args('group2 sub create'.split())
+        self.assertIs(args.func, cmd_table['group2 sub create'])
+
+    def test_lazy_subparsers_invalid_choice(self):
+        def test_handler():
+            pass
+
+        command = CLICommand(self.mock_ctx, 'test command', test_handler)
+        parser = CLICommandParser(lazy_subparsers=True)
+        parser.load_command_table({'test command': command})
+        with mock.patch('sys.stderr', new_callable=StringIO) as mock_stderr:
+            with self.assertRaises(SystemExit):
+                argparse.ArgumentParser.parse_args(parser, 'test unknown'.split())
+        self.assertIn("invalid choice: 'unknown'", mock_stderr.getvalue())
+
 
 class VerifyError(object):  # pylint: disable=too-few-public-methods
 
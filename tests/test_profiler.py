@@ -0,0 +1,85 @@
+# --------------------------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for license information.
+# --------------------------------------------------------------------------------------------
+
+import os
+import pstats
+import unittest
+from collections import OrderedDict
+import mock
+from six import StringIO
+
+from knack import CLI
+from knack.commands import CLICommand, CLICommandsLoader
+from knack.events import EVENT_PARSER_GLOBAL_CREATE, EVENT_INVOKER_PRE_CMD_TBL_CREATE
+from knack.profiler import CLIProfiler
+from tests.util import MockContext
+
+
+def build_handler(_):
+    return [{'id': i} for i in range(1000)]
+
+
+class ProfilerCommandsLoader(CLICommandsLoader):
+
+    def load_command_table(self, args):
+        self.command_table['abc build'] = CLICommand(self.cli_ctx, 'abc build', build_handler)
+        return OrderedDict(self.command_table)
+
+
+class TestProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.mock_ctx = MockContext()
+        self.cli = CLI(cli_name='proftest', config_dir=self.mock_ctx.config.config_dir,
+                       commands_loader_cls=ProfilerCommandsLoader)
+        self.log_dir = os.path.join(self.mock_ctx.config.config_dir, 'logs')
+
+    def test_cli_ctx_type_error(self):
+        with self.assertRaises(TypeError):
+            CLIProfiler('myclitest', cli_ctx=object())
+
+    def test_profile_argument_registrations(self):
+        parser_arg_group_mock = mock.MagicMock()
+        self.mock_ctx.raise_event(EVENT_PARSER_GLOBAL_CREATE, arg_group=parser_arg_group_mock)
+        parser_arg_group_mock.add_argument.assert_any_call(CLIProfiler.PROFILE_FLAG, dest=mock.ANY,
+                                                           action=mock.ANY, help=mock.ANY)
+        parser_arg_group_mock.add_argument.assert_any_call(CLIProfiler.PROFILE_MEMORY_FLAG, dest=mock.ANY,
+                                                           action=mock.ANY, help=mock.ANY)
+
+    def test_profile_arguments_removed(self):
+        arguments = ['abc', CLIProfiler.PROFILE_FLAG, CLIProfiler.PROFILE_MEMORY_FLAG]
+        self.mock_ctx.raise_event(EVENT_INVOKER_PRE_CMD_TBL_CREATE, args=arguments)
+        self.assertEqual(arguments, ['abc'])
+
+    def test_no_profile_without_flag(self):
+        exit_code = self.cli.invoke(['abc', 'build'], out_file=StringIO())
+        self.assertEqual(exit_code, 0)
+        self.assertFalse(os.path.exists(self.log_dir))
+
+    def test_cpu_profile_saved(self):
+        with mock.patch('sys.stderr', new_callable=StringIO) as mock_stderr:
+            exit_code = self.cli.invoke(['abc', 'build', '--profile'], out_file=StringIO())
+        self.assertEqual(exit_code, 0)
+        stats_files = os.listdir(self.log_dir)
+        self.assertEqual(len(stats_files), 1)
+        self.assertTrue(stats_files[0].startswith('proftest_'))
+        self.assertTrue(stats_files[0].endswith('.pstats'))
+        self.assertIn(stats_files[0], mock_stderr.getvalue())
+        stats = pstats.Stats(os.path.join(self.log_dir, stats_files[0]))
+        self.assertTrue(any(func[2] == 'build_handler' for func in stats.stats))
+
+    def test_memory_profile_report(self):
+        with mock.patch('sys.stderr', new_callable=StringIO) as mock_stderr:
+            exit_code = self.cli.invoke(['abc', 'build', '--profile-memory'], out_file=StringIO())
+        self.assertEqual(exit_code, 0)
+        report = mock_stderr.getvalue()
+        self.assertIn('Peak memory: ', report)
+        self.assertIn('Top 10 allocation sites:', report)
+        self.assertIn('#1: ', report)
+        self.assertFalse(os.path.exists(self.log_dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -78,5 +78,234 @@ class TestQuery(unittest.TestCase):
         with self.assertRaises(ValueError):
             CLIQuery.jmespath_type(query)
 
+
+class TestQueryOnLazyResult(unittest.TestCase):
+
+    def setUp(self):
+        from collections import OrderedDict
+        from knack import CLI
+        from knack.commands import CLICommand, CLICommandsLoader
+
+        self.conversions = conversions = []
+
+        class Details(object):
+            def __init__(self, size):
+                self.size = size
+
+            def _asdict(self):
+                conversions.append(self.size)
+                return {'size': self.size}
+
+        class Resource(object):
+            def __init__(self, name, size):
+                self.resource_name = name
+                self.details = Details(size)
+
+        def list_handler(_):
+            return [Resource('b', 2), Resource('a', 1)]
+
+        class MyCommandsLoader(CLICommandsLoader):
+            def load_command_table(self, args):
+                self.command_table['abc list'] = CLICommand(self.cli_ctx, 'abc list', list_handler)
+                return OrderedDict(self.command_table)
+
+        self.cli = CLI(cli_name='querytest', config_dir=MockContext().config.config_dir,
+                       commands_loader_cls=MyCommandsLoader)
+
+    def _query(self, query):
+        from six import StringIO
+        out = StringIO()
+        exit_code = self.cli.invoke(['abc', 'list', '--query', query, '-o', 'jsonl'], out_file=out)
+        self.assertEqual(exit_code, 0)
+        return out.getvalue()
+
+    def test_query_only_converts_what_it_reads(self):
+        self.assertEqual(self._query('[].resourceName'), '"b"\n"a"\n')
+        self.assertEqual(self.conversions, [])
+        self.assertEqual(self._query('[0].details'), '{"size":2}\n')
+        self.assertEqual(self.conversions, [2])
+        self.assertEqual(self._query('[1]'), '{"resourceName":"a","details":{"size":1}}\n')
+
+    def test_query_functions_on_lazy_result(self):
+        self.assertEqual(self._query('sort_by(@, &resourceName)[].details.size'), '1\n2\n')
+        self.assertEqual(self._query('length(@)'), '2\n')
+        self.assertEqual(self._query('keys(@[0])'), '"resourceName"\n"details"\n')
+        self.assertEqual(self._query("[?resourceName=='a'].details"), '{"size":1}\n')
+
+    def test_query_compares_converted_values(self):
+        self.assertEqual(self._query("[?details==`{\"size\":1}`].resourceName"), '"a"\n')
+        self.assertEqual(self._query("[?details!=`{\"size\":1}`].resourceName"), '"b"\n')
+        self.assertEqual(self._query("[?[details]==`[{\"size\":2}]`].resourceName"), '"b"\n')
+
+    def test_filter_handlers_get_converted_result(self):
+        from knack.events import EVENT_INVOKER_FILTER_RESULT
+        results = []
+        self.cli.register_event(EVENT_INVOKER_FILTER_RESULT,
+                                lambda _, **kwargs: results.append(kwargs['event_data']['result']))
+        self.assertEqual(self._query('[0].resourceName'), '"b"\n')
+        self.assertIs(type(results[0]), list)
+        self.assertIs(type(results[0][0]), dict)
+        self.assertEqual(results[0][0]['details'], {'size': 2})
+
+
+class TestQueryCache(unittest.TestCase):
+
+    def test_query_cache_least_recently_used(self):
+        from knack.query import QueryCache
+        cache = QueryCache(max_size=2)
+        compiled_a = cache.compile('a')
+        cache.compile('b')
+        self.assertIs(cache.compile('a'), compiled_a)
+        cache.compile('c')
+        self.assertEqual(len(cache), 2)
+        # 'b' was the least recently used so it was dropped
+        self.assertIs(cache.compile('a'), compiled_a)
+        self.assertEqual(cache.compile('b').search({'b': 1}), 1)
+        self.assertEqual(len(cache), 2)
+
+    def test_query_cache_save_and_load(self):
+        import os
+        import tempfile
+        from knack.query import QueryCache
+        cache_file = os.path.join(tempfile.mkdtemp(), 'query_cache.json')
+        cache = QueryCache()
+        cache.compile("[?name=='a'].{n: name, v: `[1, 2]`}")
+        self.assertTrue(cache.modified)
+        cache.save(cache_file)
+        self.assertFalse(cache.modified)
+
+        loaded = QueryCache()
+        loaded.load(cache_file)
+        self.assertEqual(len(loaded), 1)
+        with mock.patch('jmespath.compile') as mock_compile:
+            compiled = loaded.compile("[?name=='a'].{n: name, v: `[1, 2]`}")
+        self.assertFalse(mock_compile.called)
+        self.assertEqual(compiled.search([{'name': 'a'}, {'name': 'b'}]), [{'n': 'a', 'v': [1, 2]}])
+        QueryCache().load(os.path.join(os.path.dirname(cache_file), 'missing.json'))
+
+    def test_query_argument_uses_cache(self):
+        self.assertIs(CLIQuery.jmespath_type('[0].name'), CLIQuery.jmespath_type('[0].name'))
+
+    def test_string_table_transformer_compiled_on_use(self):
+        import jmespath
+        from knack.commands import CLICommand
+        from knack.output import format_table
+        from knack.query import get_query_cache
+        from knack.util import CommandResultItem
+        get_query_cache().clear()
+        with mock.patch('jmespath.compile', wraps=jmespath.compile) as mock_compile:
+            command = CLICommand(MockContext(), 'abc list', lambda _: None, table_transformer='[].{Name: name}')
+            self.assertEqual(command.table_transformer, '[].{Name: name}')
+            self.assertFalse(mock_compile.called)
+            for _ in range(2):
+                output = format_table(CommandResultItem([{'name': 'a'}], table_transformer=command.table_transformer))
+                self.assertEqual(output, 'Name\n------\na\n')
+        self.assertEqual(mock_compile.call_count, 1)
+
+
+class TestQueryAnalysis(unittest.TestCase):
+
+    def _analyze(self, query):
+        from knack.query import analyze_query, compile_query
+        analysis = analyze_query(compile_query(query))
+        return analysis.fields, analysis.filters, analysis.limit
+
+    def test_query_analysis_fields(self):
+        self.assertEqual(self._analyze('[].name'), ({'name'}, {}, None))
+        self.assertEqual(self._analyze('[].{a: a, b: c.d}'), ({'a', 'c'}, {}, None))
+        self.assertEqual(self._analyze('[].[name, tags.env]'), ({'name', 'tags'}, {}, None))
+        self.assertEqual(self._analyze('name'), ({'name'}, {}, None))
+        self.assertEqual(self._analyze('[].[name, @]'), (None, {}, None))
+        self.assertEqual(self._analyze('length(@)'), (None, {}, None))
+
+    def test_query_analysis_limit(self):
+        self.assertEqual(self._analyze('[0].id'), ({'id'}, {}, 1))
+        self.assertEqual(self._analyze('[2:4]'), (None, {}, 4))
+        self.assertEqual(self._analyze('[:10] | [:3].name'), ({'name'}, {}, 3))
+        self.assertEqual(self._analyze('[5:]'), (None, {}, None))
+        self.assertEqual(self._analyze('[-1]'), (None, {}, None))
+        self.assertEqual(self._analyze('[::-1] | [0]'), (None, {}, None))
+        self.assertEqual(self._analyze('sort_by(@, &name)[0]'), (None, {}, None))
+
+    def test_query_analysis_filters(self):
+        self.assertEqual(self._analyze("[?name=='a'].id"), ({'id', 'name'}, {'name': 'a'}, None))
+        self.assertEqual(self._analyze("[?name=='a' && `3`==size] | [0].id"),
+                         ({'id', 'name', 'size'}, {'name': 'a', 'size': 3}, 1))
+        # Other conditions can't be pushed down, nor can a limit that comes after them
+        self.assertEqual(self._analyze("[?size>`3`] | [0].id"), ({'id', 'size'}, {}, None))
+        self.assertEqual(self._analyze("[?name=='a' || name=='b'].id"), ({'id', 'name'}, {}, None))
+        # A filter after a limit only applies to the first items
+        self.assertEqual(self._analyze("[:5] | [?name=='a'].id"), ({'id', 'name'}, {}, 5))
+
+    def test_query_analysis_in_invocation_data(self):
+        from collections import OrderedDict
+        from six import StringIO
+        from knack import CLI
+        from knack.commands import CLICommand, CLICommandsLoader
+        analyses = []
+
+        def list_handler(_):
+            analysis = cli.invocation.data['query_analysis']
+            analyses.append(analysis)
+            items = [{'name': 'a', 'id': 1}, {'name': 'b', 'id': 2}, {'name': 'a', 'id': 3}]
+            items = [item for item in items if all(item.get(k) == v for k, v in analysis.filters.items())]
+            return items[:analysis.limit]
+
+        class MyCommandsLoader(CLICommandsLoader):
+            def load_command_table(self, args):
+                self.command_table['abc list'] = CLICommand(self.cli_ctx, 'abc list', list_handler)
+                return OrderedDict(self.command_table)
+
+        cli = CLI(cli_name='querytest', config_dir=MockContext().config.config_dir,
+                  commands_loader_cls=MyCommandsLoader)
+        out = StringIO()
+        self.assertEqual(cli.invoke(['abc', 'list', '--query', "[?name=='a'] | [0].id", '-o', 'tsv'], out_file=out), 0)
+        self.assertEqual(out.getvalue(), '1\n')
+        self.assertEqual((analyses[0].fields, analyses[0].filters, analyses[0].limit),
+                         ({'id', 'name'}, {'name': 'a'}, 1))
+
+
+class TestQueryOnStream(unittest.TestCase):
+
+    def setUp(self):
+        from collections import OrderedDict
+        from knack import CLI
+        from knack.commands import CLICommand, CLICommandsLoader
+
+        self.produced = produced = []
+
+        def list_handler(_):
+            for i in range(10):
+                produced.append(i)
+                yield {'id': i, 'parity': 'even' if i % 2 == 0 else 'odd', 'tags': [i, -i]}
+
+        class MyCommandsLoader(CLICommandsLoader):
+            def load_command_table(self, args):
+                self.command_table['abc list'] = CLICommand(self.cli_ctx, 'abc list', list_handler)
+                self.command_table['abc show'] = CLICommand(self.cli_ctx, 'abc show', lambda _: list(list_handler(_)))
+                return OrderedDict(self.command_table)
+
+        self.cli = CLI(cli_name='querytest', config_dir=MockContext().config.config_dir,
+                       commands_loader_cls=MyCommandsLoader)
+
+    def _query(self, command, query, output='json'):
+        from six import StringIO
+        out = StringIO()
+        exit_code = self.cli.invoke(['abc', command, '--query', query, '-o', output], out_file=out)
+        self.assertEqual(exit_code, 0)
+        return out.getvalue()
+
+    def test_query_on_stream_same_as_list(self):
+        for query in ['[].id', "[?parity=='odd']", "[?parity=='odd'].{i: id}", '[3:7:2].tags', '[].tags[]',
+                      "[?parity=='even'] | [1:3].id", '[0]', 'length(@)', '[-2:]']:
+            for output in ['json', 'tsv']:
+                self.assertEqual(self._query('list', query, output), self._query('show', query, output))
+
+    def test_query_on_stream_reads_one_item_at_a_time(self):
+        self.assertEqual(self._query('list', '[:3].id', 'tsv'), '0\n1\n2\n')
+        # The items after the slice are never produced
+        self.assertEqual(self.produced, [0, 1, 2])
+
+
 if __name__ == '__main__':
     unittest.main()
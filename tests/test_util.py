@@ -3,11 +3,16 @@
 # Licensed under the MIT License. See License.txt in the project root for license information.
 # --------------------------------------------------------------------------------------------
 
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 import unittest
 from datetime import date, time, datetime
+from decimal import Decimal
+from enum import Enum
 
-from knack.util import todict, to_snake_case
+import mock
+
+import knack.util
+from knack.util import todict, to_snake_case, register_todict_converter
 
 class TestUtils(unittest.TestCase):
 
@@ -68,6 +73,81 @@ class TestUtils(unittest.TestCase):
         expected = the_input.isoformat()
         self.assertEqual(actual, expected)
 
+    def test_application_todict_nested_models(self):
+        class Color(Enum):
+            RED = 'red'
+
+        class Model(object):
+            def __init__(self, **kwargs):
+                self.__dict__.update(kwargs)
+
+            def method(self):
+                pass
+
+        Point = namedtuple('Point', ['x_value', 'y'])
+        the_input = [Model(display_name='a', _private=1, color=Color.RED, callback=len,
+                           child=Model(created_on=date(2017, 1, 2), point=Point(1, 2), tags=OrderedDict(b=1, a=2)))]
+        actual = todict(the_input)
+        expected = [{'displayName': 'a', 'color': 'red',
+                     'child': {'createdOn': '2017-01-02', 'point': {'x_value': 1, 'y': 2}, 'tags': {'b': 1, 'a': 2}}}]
+        self.assertEqual(actual, expected)
+        self.assertEqual(list(actual[0]['child']['tags']), ['b', 'a'])
+
+    def test_application_todict_camel_case_names_cached(self):
+        class Model(object):
+            def __init__(self):
+                self.resource_group = 'rg'
+
+        with mock.patch('knack.util.to_camel_case', side_effect=knack.util.to_camel_case) as mock_camel_case:
+            actual = todict([Model() for _ in range(10)])
+        self.assertEqual(actual, [{'resourceGroup': 'rg'}] * 10)
+        self.assertEqual(mock_camel_case.call_count, 1)
+
+    def test_application_todict_deep(self):
+        the_input = value = []
+        for _ in range(10000):
+            value.append([])
+            value = value[0]
+        actual = todict(the_input)
+        for _ in range(10000):
+            actual = actual[0]
+        self.assertEqual(actual, [])
+
+    def test_application_todict_circular_reference(self):
+        class Node(object):
+            def __init__(self, parent=None):
+                self.parent = parent
+                self.children = []
+
+        parent = Node()
+        parent.children.append(Node(parent))
+        with self.assertRaises(ValueError):
+            todict(parent)
+        the_input = {'a': 1}
+        the_input['self'] = [the_input]
+        with self.assertRaises(ValueError):
+            todict(the_input)
+        # The same object more than once is not a circular reference
+        child = Node()
+        self.assertEqual(todict([child, {'x': child}]),
+                         [{'children': [], 'parent': None}, {'x': {'children': [], 'parent': None}}])
+
+    def test_application_todict_register_converter(self):
+        class Secret(object):
+            def __init__(self, value):
+                self.value = value
+
+        def _remove_converters():
+            knack.util._TODICT_CONVERTERS.clear()  # pylint: disable=protected-access
+            knack.util._TODICT_PLANS.clear()  # pylint: disable=protected-access
+        self.addCleanup(_remove_converters)
+        self.assertEqual(todict({'price': Decimal('1.50'), 'secret': Secret('x')}),
+                         {'price': Decimal('1.50'), 'secret': {'value': 'x'}})
+        register_todict_converter(Decimal, str)
+        register_todict_converter(Secret, lambda s: {'masked': [Decimal('2')]})
+        self.assertEqual(todict({'price': Decimal('1.50'), 'secret': Secret('x')}),
+                         {'price': '1.50', 'secret': {'masked': ['2']}})
+
     def test_to_snake_case_from_camel(self):
         the_input = 'thisIsCamelCase'
         expected = 'this_is_camel_case'